@@ -21,11 +21,20 @@ login.init_app(app)
 login.login_view = "auth.login"
 login.login_message = "Пожалуйста, авторизуйтесь в системе для доступа к этой странице."
 
-db.init_app(app)
+from .database import init_database  # noqa: E402
+
+init_database(app)
 migrate.init_app(app, db)
 from .admin import init_admin  # noqa: E402
+from .cache import init_route_body_cache  # noqa: E402
+from .jobs import init_export_jobs  # noqa: E402
+from .writer import init_audit_writer, init_write_coordinator  # noqa: E402
 
 init_admin(app)
+init_route_body_cache(app)
+init_export_jobs(app)
+init_write_coordinator(app)
+init_audit_writer(app)
 
 from app.routes import auth_bp, profile_bp, route_management_bp  # noqa: E402
 
@@ -54,9 +63,13 @@ def create_app(config_class=Config):
     login.login_view = "auth.login"
     login.login_message = "Пожалуйста, авторизуйтесь в системе для доступа к этой странице."
 
-    db.init_app(new_app)
+    init_database(new_app)
     migrate.init_app(new_app, db)
     init_admin(new_app)
+    init_route_body_cache(new_app)
+    init_export_jobs(new_app)
+    init_write_coordinator(new_app)
+    init_audit_writer(new_app)
 
     @new_app.context_processor
     def inject():
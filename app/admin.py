@@ -3,7 +3,7 @@ from datetime import UTC, datetime
 
 import sqlalchemy as sa
 from flask import abort, redirect, request, url_for
-from flask_admin import Admin, AdminIndexView, expose
+from flask_admin import Admin, AdminIndexView, BaseView, expose
 from flask_admin.menu import MenuLink
 from flask_admin.contrib.sqla import ModelView
 from flask_login import current_user
@@ -12,7 +12,11 @@ from wtforms import PasswordField, StringField
 from wtforms.validators import DataRequired, Optional
 
 from app import db
-from app.models import AuditLog, Route, User
+from app.history import parse_utc, route_history_rows, route_state_at
+from app.models import AuditLog, Route, User, defer_route_payload
+
+# Сколько последних изменений маршрута показывать на странице истории
+ROUTE_HISTORY_SHOWN = 50
 
 
 def _is_admin() -> bool:
@@ -37,7 +41,7 @@ class SecureAdminIndexView(AdminIndexView):
             or 0
         )
 
-        recent_logs = db.session.scalars(sa.select(AuditLog).order_by(AuditLog.created_at.desc()).limit(20)).all()
+        recent_logs = db.session.scalars(sa.select(AuditLog).options(*defer_route_payload(AuditLog.route)).order_by(AuditLog.created_at.desc()).limit(20)).all()
         return {
             "total_users": total_users,
             "total_routes": total_routes,
@@ -137,9 +141,14 @@ class RouteAdminView(SecureModelView):
         "region_code",
         "carrier_id",
         "unit_id",
+        "stops_count",
+        "tariffs_count",
         "stops_set",
         "is_completed",
     ]
+    # Счётчики пересчитываются моделью при изменении остановок и тарифов; версию, время изменения
+    # и хеш импорта ведёт само приложение — их правка вручную ломает блокировку и поиск дубликатов
+    form_excluded_columns = ["stops_count", "tariffs_count", "version", "updated_at", "import_hash"]
     column_labels = {
         "id": "ID",
         "user_id": "Пользователь",
@@ -149,6 +158,8 @@ class RouteAdminView(SecureModelView):
         "region_code": "Регион",
         "carrier_id": "Оператор",
         "unit_id": "Подразделение",
+        "stops_count": "Остановок",
+        "tariffs_count": "Тарифов",
         "stops_set": "Остановки заполнены",
         "is_completed": "Готов",
     }
@@ -156,6 +167,10 @@ class RouteAdminView(SecureModelView):
     column_searchable_list = ["route_name", "route_number", "transport_type"]
     column_filters = ["user_id", "transport_type", "is_completed", "stops_set", "region_code"]
 
+    def get_query(self):
+        # Списку маршрутов не нужны остановки, тарифы и матрица цен
+        return super().get_query().options(*defer_route_payload())
+
     def _user_formatter(self, context, model, name):
         if not model.user_id:
             return "-"
@@ -193,6 +208,10 @@ class AuditLogAdminView(SecureModelView):
     column_searchable_list = ["action", "entity_type", "user.username", "user_id", "endpoint", "method"]
     column_filters = ["action", "entity_type", "user_id", "route_id", "method", "created_at"]
 
+    def get_query(self):
+        # Маршрут записи подгружается только ради названия
+        return super().get_query().options(*defer_route_payload(AuditLog.route))
+
     @staticmethod
     def _user_formatter(view, context, model, name):
         if model.user:
@@ -251,6 +270,46 @@ class AuditLogAdminView(SecureModelView):
     }
 
 
+class RouteHistoryAdminView(BaseView):
+    """Маршрут на выбранный момент, восстановленный по журналу аудита, и список его изменений."""
+
+    def is_accessible(self):
+        return _is_admin()
+
+    def inaccessible_callback(self, name, **kwargs):
+        if not current_user.is_authenticated:
+            return redirect(url_for("auth.login", next=request.url))
+        return abort(403)
+
+    @expose("/")
+    def index(self):
+        route_id = request.args.get("route_id", type=int)
+        at_arg = request.args.get("at", "")
+        moment = state = error = None
+        changes = []
+        if route_id is not None:
+            try:
+                moment = parse_utc(at_arg) if at_arg else datetime.now(UTC)
+            except ValueError:
+                error = "Момент времени должен быть в формате ISO 8601."
+            else:
+                state = route_state_at(route_id, moment)
+                if state is None:
+                    error = "Нет истории маршрута на этот момент."
+            changes = route_history_rows(route_id, state, ROUTE_HISTORY_SHOWN)
+        snapshot_json = json.dumps(state.snapshot, ensure_ascii=False, indent=2) if state and state.snapshot else None
+        return self.render(
+            "admin/route_history.html",
+            route_id=route_id,
+            at=at_arg,
+            moment=moment,
+            state=state,
+            error=error,
+            changes=changes,
+            snapshot_json=snapshot_json,
+        )
+
+
 def init_admin(app):
     if "admin" in app.extensions:
         return  
@@ -266,3 +325,4 @@ def init_admin(app):
     admin.add_view(UserAdminView(User, db.session))
     admin.add_view(RouteAdminView(Route, db.session))
     admin.add_view(AuditLogAdminView(AuditLog, db.session))
+    admin.add_view(RouteHistoryAdminView(name="История маршрута", category="Аудит", endpoint="route_history", url="route_history"))
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
-from flask import has_request_context, request
+from datetime import UTC, datetime
+
+from flask import current_app, has_request_context, request
 from flask_login import current_user
 
 from app import db
 from app.models import AuditLog, Route
+from app.prices import price_matrix_as_list
+from app.writer import defer_audit_log, get_audit_writer, get_write_coordinator, queue_audit_row
 
 
 def serialize_route(route: Route) -> dict:
@@ -20,32 +24,137 @@ def serialize_route(route: Route) -> dict:
         "decimal_places": route.decimal_places,
         "tariff_tables": route.tariff_tables,
         "stops": route.stops,
-        "price_matrix": route.price_matrix,
+        "price_matrix": price_matrix_as_list(route.price_matrix),
         "stops_set": route.stops_set,
         "is_completed": route.is_completed,
     }
 
 
-def log_action(action: str, entity_type: str, route_id: int | None = None, details: dict | None = None, user_id: int | None = None) -> AuditLog:
+def route_snapshot_details(route: Route) -> dict:
+    """Детали записи о создании маршрута: версия и полный снимок, от которого восстанавливается история."""
+    return {"version": route.version, "snapshot": serialize_route(route)}
+
+
+def route_change_details(before: dict, route: Route) -> dict:
+    """
+    Детали записи об изменении маршрута: новая версия и только изменившиеся поля, остановки и ячейки цен
+    относительно снимка before. На каждой AUDIT_SNAPSHOT_INTERVAL-й версии добавляется полный снимок,
+    чтобы состояние на любой момент восстанавливалось от ближайшего снимка небольшим числом изменений.
+    """
+    after = serialize_route(route)
+    details = {"version": route.version, "changes": diff_route_snapshots(before, after)}
+    if route.version % current_app.config["AUDIT_SNAPSHOT_INTERVAL"] == 0:
+        details["snapshot"] = after
+    return details
+
+
+def diff_route_snapshots(before: dict, after: dict) -> dict:
+    """
+    Изменения между двумя снимками serialize_route, только непустые разделы:
+    fields — {поле: [было, стало]}; stops — изменённые остановки [[индекс, было, стало], ...] и length при
+    изменении их числа; price_matrix — изменённые ячейки [[строка, столбец, было, стало], ...] и shape
+    (длины строк до и после) при изменении размера. Отсутствующий элемент записывается как None.
+    """
+    changes = {}
+    fields = {key: [before.get(key), value] for key, value in after.items() if key not in ("id", "stops", "price_matrix") and before.get(key) != value}
+    if fields:
+        changes["fields"] = fields
+
+    before_stops, after_stops = before.get("stops") or [], after.get("stops") or []
+    stops = {}
+    items = [list(change) for change in _list_changes(before_stops, after_stops)]
+    if items:
+        stops["items"] = items
+    if len(before_stops) != len(after_stops):
+        stops["length"] = [len(before_stops), len(after_stops)]
+    if stops:
+        changes["stops"] = stops
+
+    before_matrix, after_matrix = before.get("price_matrix") or [], after.get("price_matrix") or []
+    matrix = {}
+    cells = [[i, j, old, new] for i in range(max(len(before_matrix), len(after_matrix))) for j, old, new in _list_changes(_row(before_matrix, i), _row(after_matrix, i))]
+    if cells:
+        matrix["cells"] = cells
+    before_shape, after_shape = [len(row) for row in before_matrix], [len(row) for row in after_matrix]
+    if before_shape != after_shape:
+        matrix["shape"] = [before_shape, after_shape]
+    if matrix:
+        changes["price_matrix"] = matrix
+    return changes
+
+
+def apply_route_changes(snapshot: dict, changes: dict) -> dict:
+    """Снимок после изменений diff_route_snapshots; исходный снимок не меняется."""
+    result = {**snapshot}
+    for key, (_, new) in changes.get("fields", {}).items():
+        result[key] = new
+
+    if "stops" in changes:
+        stops = list(snapshot.get("stops") or [])
+        length = changes["stops"].get("length", [len(stops), len(stops)])[1]
+        stops = (stops + [None] * length)[:length]
+        for index, _, new in changes["stops"].get("items", []):
+            if index < length:
+                stops[index] = new
+        result["stops"] = stops
+
+    if "price_matrix" in changes:
+        matrix = snapshot.get("price_matrix") or []
+        shape = changes["price_matrix"].get("shape", [None, [len(row) for row in matrix]])[1]
+        matrix = [[_row(matrix, i)[j] if j < len(_row(matrix, i)) else None for j in range(length)] for i, length in enumerate(shape)]
+        for i, j, _, new in changes["price_matrix"].get("cells", []):
+            if i < len(matrix) and j < len(matrix[i]):
+                matrix[i][j] = new
+        result["price_matrix"] = matrix
+    return result
+
+
+def _row(matrix: list, index: int) -> list:
+    return matrix[index] if index < len(matrix) else []
+
+
+def _list_changes(before: list, after: list):
+    for index in range(max(len(before), len(after))):
+        old = before[index] if index < len(before) else None
+        new = after[index] if index < len(after) else None
+        if old != new:
+            yield index, old, new
+
+
+def build_audit_row(action: str, entity_type: str, route_id: int | None = None, details: dict | None = None, user_id: int | None = None) -> dict:
+    """Значения полей записи журнала; пользователь и параметры запроса берутся из текущего запроса, если он есть."""
     resolved_user_id = user_id
     if resolved_user_id is None and has_request_context() and not current_user.is_anonymous:
         resolved_user_id = current_user.id
 
-    endpoint = request.endpoint if has_request_context() else None
-    method = request.method if has_request_context() else None
-    ip_address = request.remote_addr if has_request_context() else None
-    user_agent = request.user_agent.string if has_request_context() and request.user_agent else None
-
-    log = AuditLog(
-        user_id=resolved_user_id,
-        route_id=route_id,
-        action=action,
-        entity_type=entity_type,
-        details=details or {},
-        endpoint=endpoint,
-        method=method,
-        ip_address=ip_address,
-        user_agent=user_agent,
-    )
-    db.session.add(log)
+    return {
+        "user_id": resolved_user_id,
+        "route_id": route_id,
+        "action": action,
+        "entity_type": entity_type,
+        "details": details or {},
+        "endpoint": request.endpoint if has_request_context() else None,
+        "method": request.method if has_request_context() else None,
+        "ip_address": request.remote_addr if has_request_context() else None,
+        "user_agent": request.user_agent.string if has_request_context() and request.user_agent else None,
+        # Время события, а не вставки: асинхронный журнал пишет запись позже
+        "created_at": datetime.now(UTC),
+    }
+
+
+def log_action(action: str, entity_type: str, route_id: int | None = None, details: dict | None = None, user_id: int | None = None, sync: bool = False) -> AuditLog:
+    """
+    Записывает действие в журнал вместе с транзакцией текущей сессии (фиксирует её вызывающий код).
+    При AUDIT_ASYNC запись после фиксации уходит в очередь фонового потока и ID не получает;
+    sync=True записывает её синхронно, когда ID нужен сразу (например, номер выгрузки).
+    """
+    row = build_audit_row(action, entity_type, route_id=route_id, details=details, user_id=user_id)
+    log = AuditLog(**row)
+    if not sync and get_audit_writer() is not None:
+        queue_audit_row(row)
+    elif get_write_coordinator() is None:
+        db.session.add(log)
+    else:
+        # Режим одного писателя: запись вставит поток записи после фиксации транзакции запроса
+        defer_audit_log(log, row)
     return log
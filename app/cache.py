@@ -0,0 +1,236 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+from app.prices import PriceMatrix
+
+# При превышении лимита диска удаляем записи до этой доли лимита, чтобы следующие записи не запускали обход каталога снова
+DISK_PRUNE_TARGET = 0.9
+
+
+def route_fingerprint(route, decimal_places, format_version=None):
+    """
+    Отпечаток содержимого маршрута, от которого зависит тело файла конфигурации (тег R и далее).
+    format_version — версия формата тела: после её смены тела, сохранённые в кэше на диске, не используются.
+    """
+    payload = [
+        format_version,
+        route.route_number,
+        route.transport_type,
+        route.route_name,
+        route.stops,
+        route.tariff_tables,
+        route.price_matrix,
+        str(decimal_places),
+    ]
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=_fingerprint_default)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _fingerprint_default(value):
+    # Упакованная матрица цен входит в отпечаток хэшем своих байтов, без разворачивания в словари
+    if isinstance(value, PriceMatrix):
+        return value.digest()
+    return str(value)
+
+
+class RouteBodyCache:
+    """
+    Кэш отрисованных тел маршрутов (байты CP866) с вытеснением давно неиспользуемых записей (LRU).
+    Записи хранятся в памяти и, если задан каталог, на диске; для каждого уровня задан лимит в байтах.
+    Ключ записи: ID маршрута, точность цен и отпечаток содержимого. На диске записи лежат в подкаталоге
+    своего маршрута; занятый объём учитывается в памяти, каталог обходится только при превышении лимита.
+    """
+
+    def __init__(self, max_memory_bytes, disk_dir=None, max_disk_bytes=0):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    @staticmethod
+    def _key(route_id, decimal_places, fingerprint):
+        return f"{route_id}_{decimal_places}_{fingerprint}"
+
+    def _route_dir(self, route_id):
+        return os.path.join(self.disk_dir, str(route_id))
+
+    def _disk_path(self, route_id, key):
+        return os.path.join(self._route_dir(route_id), f"{key}.trfz")
+
+    def get(self, route_id, decimal_places, fingerprint):
+        key = self._key(route_id, decimal_places, fingerprint)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(route_id, key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # Отмечаем использование для LRU на диске
+        except OSError:
+            return None
+
+        with self._lock:
+            self._remember(key, data)
+        return data
+
+    def put(self, route_id, decimal_places, fingerprint, data):
+        key = self._key(route_id, decimal_places, fingerprint)
+        with self._lock:
+            self._remember(key, data)
+
+        if self.disk_dir and len(data) <= self.max_disk_bytes:
+            path = self._disk_path(route_id, key)
+            tmp_path = path + f".{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                replaced = _file_size(path)
+                os.replace(tmp_path, path)
+            except OSError:
+                return
+            with self._lock:
+                self._disk_bytes += len(data) - replaced
+                over_limit = self._disk_bytes > self.max_disk_bytes
+            if over_limit:
+                self._prune_disk()
+
+    def invalidate(self, route_id):
+        """Удаляет все записи маршрута (для любой точности цен и любого отпечатка)."""
+        self.invalidate_many([route_id])
+
+    def invalidate_many(self, route_ids):
+        """Удаляет записи нескольких маршрутов: один проход по памяти, на диске — только подкаталоги этих маршрутов."""
+        route_ids = {str(route_id) for route_id in route_ids}
+        if not route_ids:
+            return
+        with self._lock:
+            for key in [k for k in self._entries if k.split("_", 1)[0] in route_ids]:
+                self._memory_bytes -= len(self._entries.pop(key))
+
+        if not self.disk_dir:
+            return
+        removed = 0
+        for route_id in route_ids:
+            route_dir = self._route_dir(route_id)
+            try:
+                entries = list(os.scandir(route_dir))
+            except OSError:
+                continue
+            for entry in entries:
+                size = _file_size(entry.path)
+                with contextlib.suppress(OSError):
+                    os.remove(entry.path)
+                    removed += size
+            with contextlib.suppress(OSError):
+                os.rmdir(route_dir)
+        with self._lock:
+            self._disk_bytes = max(self._disk_bytes - removed, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+
+    def _remember(self, key, data):
+        """Кладёт запись в память и вытесняет самые старые записи сверх лимита. Вызывается под блокировкой."""
+        if len(data) > self.max_memory_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._entries[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _prune_disk(self):
+        """
+        Удаляет с диска давно неиспользуемые файлы, пока суммарный размер не опустится до DISK_PRUNE_TARGET от лимита.
+        Обход каталога заодно уточняет учтённый объём (файлы пишут и другие процессы).
+        """
+        files = self._disk_files()
+        total = sum(size for _, size, _ in files)
+        target = self.max_disk_bytes * DISK_PRUNE_TARGET
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with contextlib.suppress(OSError):
+                os.rmdir(os.path.dirname(path))  # Удаляется, только если каталог маршрута опустел
+        with self._lock:
+            self._disk_bytes = total
+
+    def _disk_files(self):
+        """(время использования, размер, путь) файлов кэша на диске, включая файлы прежней плоской раскладки."""
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            entries = os.scandir(entry.path) if entry.is_dir() else [entry]
+            for file_entry in entries:
+                if not file_entry.name.endswith(".trfz"):
+                    continue
+                try:
+                    stat = file_entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file_entry.path))
+        return files
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def init_route_body_cache(app):
+    if "route_body_cache" in app.extensions:
+        return
+    app.extensions["route_body_cache"] = RouteBodyCache(
+        max_memory_bytes=app.config["ROUTE_BODY_CACHE_MAX_MEMORY"],
+        disk_dir=app.config["ROUTE_BODY_CACHE_DIR"],
+        max_disk_bytes=app.config["ROUTE_BODY_CACHE_MAX_DISK"],
+    )
+
+
+def get_route_body_cache():
+    """Кэш текущего приложения или None, если кэш не настроен или нет контекста приложения."""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("route_body_cache")
+
+
+def invalidate_route_body(route_id):
+    cache = get_route_body_cache()
+    if cache is not None and route_id is not None:
+        cache.invalidate(route_id)
+
+
+def invalidate_route_bodies(route_ids):
+    cache = get_route_body_cache()
+    if cache is not None:
+        cache.invalidate_many(route_ids)
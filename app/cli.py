@@ -0,0 +1,162 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+
+import click
+import sqlalchemy as sa
+from flask.cli import with_appcontext
+
+from app import db
+from app.audit import log_action
+from app.export import format_config_header, iter_bulk_config, iter_route_files, iter_routes
+from app.models import Route, User
+from app.prices import PACKED_MAGIC
+
+
+@click.command("export")
+@click.option("--user", "username", help="Выгрузить маршруты только этого пользователя (логин).")
+@click.option("--region", help="Код региона маршрутов (RR).")
+@click.option("--carrier", help="ID перевозчика маршрутов (TTTT).")
+@click.option("--completed/--all", "completed_only", default=True, show_default=True, help="Только завершённые маршруты или все.")
+@click.option(
+    "-o",
+    "--output",
+    required=True,
+    type=click.Path(dir_okay=True, writable=True),
+    help="Файл объединённой выгрузки или каталог для выгрузки по файлу на маршрут.",
+)
+@click.option("--split", is_flag=True, help="Отдельный файл на маршрут (шапка из настроек маршрута); --output — каталог.")
+@click.option("--unit", "unit_id", help="ID подразделения (DDDD) в шапке объединённого файла.")
+@click.option("--decimal-places", type=click.Choice(["0", "1", "2"]), default="2", show_default=True, help="Точность цен (V) объединённого файла.")
+@click.option("-w", "--workers", type=click.IntRange(min=1), default=1, show_default=True, help="Число процессов для отрисовки маршрутов.")
+@with_appcontext
+def export_command(username, region, carrier, completed_only, output, split, unit_id, decimal_places, workers):
+    """Выгружает конфигурацию маршрутов в файл или каталог без браузера (для cron и больших выгрузок)."""
+    user = None
+    query = sa.select(Route).order_by(Route.id)
+    if username:
+        user = db.session.scalar(sa.select(User).where(User.username == username))
+        if user is None:
+            raise click.ClickException(f"Пользователь {username} не найден.")
+        query = query.where(Route.user_id == user.id)
+    if region:
+        query = query.where(Route.region_code == region.zfill(2))
+    if carrier:
+        query = query.where(Route.carrier_id == carrier.zfill(4))
+    if completed_only:
+        query = query.where(Route.is_completed.is_(True))
+
+    split = split or os.path.isdir(output)
+    current_date = datetime.now().strftime("%y%m%d")
+    counter = _CountingRoutes(iter_routes(query))
+    total_bytes = 0
+    started = time.perf_counter()
+
+    # spawn: дочерние процессы не наследуют соединения с БД
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) if workers > 1 else nullcontext()
+    with pool as executor:
+        if split:
+            os.makedirs(output, exist_ok=True)
+            for name, data in iter_route_files(counter, current_date, executor=executor):
+                _write_atomically(os.path.join(output, name), [data])
+                total_bytes += len(data)
+        else:
+            # Шапка: явные параметры, иначе настройки пользователя по умолчанию
+            header_line = format_config_header(
+                region or (user.default_region_code if user else None) or "00",
+                carrier or (user.default_carrier_id if user else None) or "0000",
+                unit_id or (user.default_unit_id if user else None) or "0000",
+                current_date,
+                decimal_places,
+            )
+            total_bytes = _write_atomically(output, iter_bulk_config(header_line, counter, decimal_places, executor=executor))
+
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    log_action(
+        action="routes_cli_export",
+        entity_type="route",
+        user_id=user.id if user else None,
+        details={"output": os.path.abspath(output), "routes": counter.count, "bytes": total_bytes, "split": split},
+    )
+    db.session.commit()
+
+    megabytes = total_bytes / (1024 * 1024)
+    click.echo(f"Выгружено маршрутов: {counter.count} ({megabytes:.2f} МБ) в {output}")
+    click.echo(f"Время: {elapsed:.2f} с; {counter.count / elapsed:.1f} маршрутов/с; {megabytes / elapsed:.2f} МБ/с; процессов: {workers}")
+
+
+@click.command("pack-prices")
+@click.option("--batch-size", type=click.IntRange(min=1), default=500, show_default=True, help="Маршрутов в одной транзакции.")
+@with_appcontext
+def pack_prices_command(batch_size):
+    """Переупаковывает матрицы цен, сохранённые до упаковки (JSON), в двоичный формат столбца price_matrix."""
+    # Упакованное значение начинается с PACKED_MAGIC; JSON (TEXT или BLOB) — нет
+    legacy = sa.func.substr(Route.price_matrix, 1, len(PACKED_MAGIC)) != sa.literal(PACKED_MAGIC, sa.LargeBinary)
+    converted = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(sa.select(Route.id, Route.price_matrix).where(legacy, Route.id > last_id).order_by(Route.id).limit(batch_size)).all()
+        if not rows:
+            break
+        for route_id, price_matrix in rows:
+            # Содержимое не меняется: версия и время изменения остаются прежними, выгрузки не повторяются
+            db.session.execute(sa.update(Route).where(Route.id == route_id).values(price_matrix=price_matrix, updated_at=Route.updated_at))
+        db.session.commit()
+        converted += len(rows)
+        last_id = rows[-1].id
+    click.echo(f"Переупаковано матриц цен: {converted}")
+
+
+@click.command("backfill-route-counts")
+@click.option("--batch-size", type=click.IntRange(min=1), default=1000, show_default=True, help="Диапазон ID маршрутов в одной транзакции.")
+@with_appcontext
+def backfill_route_counts_command(batch_size):
+    """Заполняет stops_count и tariffs_count маршрутов, созданных до появления счётчиков, по их JSON-полям."""
+    # Счётчики считает SQLite по JSON на месте, без загрузки остановок и тарифов в приложение
+    stops_count = sa.func.coalesce(sa.func.json_array_length(Route.stops), 0)
+    tariffs_count = sa.func.coalesce(sa.func.json_array_length(Route.tariff_tables), 0)
+    max_id = db.session.scalar(sa.select(sa.func.max(Route.id))) or 0
+    updated = 0
+    for first_id in range(1, max_id + 1, batch_size):
+        result = db.session.execute(
+            sa.update(Route)
+            .where(Route.id.between(first_id, first_id + batch_size - 1), sa.or_(Route.stops_count != stops_count, Route.tariffs_count != tariffs_count))
+            # Содержимое маршрута не меняется: время изменения остаётся прежним
+            .values(stops_count=stops_count, tariffs_count=tariffs_count, updated_at=Route.updated_at)
+        )
+        db.session.commit()
+        updated += result.rowcount
+    click.echo(f"Обновлено счётчиков маршрутов: {updated}")
+
+
+class _CountingRoutes:
+    """Итератор-обёртка, считающий отданные маршруты."""
+
+    def __init__(self, routes):
+        self._routes = routes
+        self.count = 0
+
+    def __iter__(self):
+        for route in self._routes:
+            self.count += 1
+            yield route
+
+
+def _write_atomically(path, chunks):
+    """Пишет порции байтов во временный файл и переименовывает его в path. Возвращает размер файла."""
+    tmp_path = path + ".part"
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size
@@ -0,0 +1,66 @@
+import sqlalchemy as sa
+
+from app import db
+
+# Допустимые значения PRAGMA: подставляются в текст запроса, поэтому проверяются по списку
+SQLITE_JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+SQLITE_SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+# Параметры пула из конфигурации -> аргументы create_engine (0 — оставить значение SQLAlchemy по умолчанию)
+POOL_OPTIONS = {
+    "DB_POOL_SIZE": "pool_size",
+    "DB_MAX_OVERFLOW": "max_overflow",
+    "DB_POOL_TIMEOUT": "pool_timeout",
+    "DB_POOL_RECYCLE": "pool_recycle",
+}
+
+
+def init_database(app):
+    """
+    Подключает Flask-SQLAlchemy к приложению: параметры пула берутся из конфигурации (DB_POOL_*),
+    а к каждому новому соединению SQLite применяются PRAGMA из SQLITE_* (журнал WAL, synchronous,
+    ожидание блокировки, кэш страниц, mmap).
+    """
+    options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    for key, option in POOL_OPTIONS.items():
+        if app.config.get(key):
+            options.setdefault(option, app.config[key])
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+    pragmas = sqlite_pragmas(app.config)
+    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == "sqlite":
+                sa.event.listen(engine, "connect", _pragma_listener(pragmas))
+
+
+def sqlite_pragmas(config):
+    """Список (PRAGMA, значение) по конфигурации; неизвестный режим журнала или synchronous — ValueError."""
+    journal_mode = config["SQLITE_JOURNAL_MODE"].upper()
+    synchronous = config["SQLITE_SYNCHRONOUS"].upper()
+    if journal_mode not in SQLITE_JOURNAL_MODES:
+        raise ValueError(f"Неизвестный режим журнала SQLite: {journal_mode}")
+    if synchronous not in SQLITE_SYNCHRONOUS_MODES:
+        raise ValueError(f"Неизвестный режим synchronous SQLite: {synchronous}")
+    return [
+        # busy_timeout — первым: переключение в WAL само может ждать блокировку
+        ("busy_timeout", int(config["SQLITE_BUSY_TIMEOUT"])),
+        ("journal_mode", journal_mode),
+        ("synchronous", synchronous),
+        # Отрицательное значение cache_size — размер в КиБ, а не в страницах
+        ("cache_size", -int(config["SQLITE_CACHE_SIZE_KB"])),
+        ("mmap_size", int(config["SQLITE_MMAP_SIZE"])),
+    ]
+
+
+def _pragma_listener(pragmas):
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+    return set_sqlite_pragmas
@@ -0,0 +1,237 @@
+import atexit
+import hashlib
+import io
+import multiprocessing
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from types import SimpleNamespace
+
+from flask import current_app
+
+from app import db
+from app.cache import get_route_body_cache, route_fingerprint
+from app.models import Route
+from app.utils import write_route_body_to_buffer
+
+# Версия формата тела файла: входит в ETag и отпечаток кэша, чтобы после изменения формата тела отрисовывались заново.
+# 2 — цены переводятся из целых хранимых единиц точно (раньше float с отбрасыванием дробной части терял копейку)
+EXPORT_FORMAT_VERSION = 2
+# Размер порции, которой тело файла отдаётся клиенту при потоковой выгрузке
+EXPORT_CHUNK_SIZE = 64 * 1024
+# Сколько маршрутов за раз забираем из БД при потоковой выгрузке
+EXPORT_ROUTES_PER_FETCH = 50
+# Поля маршрута, от которых зависит тело файла конфигурации
+EXPORT_PAYLOAD_FIELDS = ("route_number", "transport_type", "route_name", "stops", "tariff_tables", "price_matrix")
+
+# Варианты сжатия записей ZIP-архива: (метод, уровень)
+ZIP_COMPRESSION_OPTIONS = {
+    "stored": (zipfile.ZIP_STORED, None),
+    "deflated-1": (zipfile.ZIP_DEFLATED, 1),
+    "deflated-6": (zipfile.ZIP_DEFLATED, 6),
+    "deflated-9": (zipfile.ZIP_DEFLATED, 9),
+}
+
+_executor_lock = threading.Lock()
+
+
+def format_config_header(region_code, carrier_id, unit_id, current_date, decimal_places):
+    """
+    Формирует строку шапки файла конфигурации: RR;TTTT;DDDD;YYMMDD;V.
+    Коды дополняются ведущими нулями до нужной длины.
+    """
+    rr = str(region_code).zfill(2)
+    tttt = str(carrier_id).zfill(4)
+    dddd = str(unit_id).zfill(4)
+    return f"{rr};{tttt};{dddd};{current_date};{decimal_places}"
+
+
+def config_etag(route_id, route_version, header_line):
+    """
+    Сильный ETag файла конфигурации одного маршрута: ревизия маршрута задаёт тело,
+    строка шапки — поля шапки, дату и точность цен.
+    """
+    raw = f"{EXPORT_FORMAT_VERSION}:{route_id}:{route_version}:{header_line}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def route_export_payload(route):
+    """Данные маршрута для выгрузки в виде простого словаря (без ORM), пригодного для передачи в другой процесс."""
+    return {field: getattr(route, field) for field in EXPORT_PAYLOAD_FIELDS}
+
+
+def render_payload(payload, decimal_places):
+    """Отрисовывает тело маршрута из словаря route_export_payload. Выполняется в том числе в процессах пула."""
+    buffer = io.BytesIO()
+    write_route_body_to_buffer(buffer, SimpleNamespace(**payload), decimal_places)
+    return buffer.getvalue()
+
+
+def render_route_bodies(routes, decimal_places, executor=None):
+    """
+    Возвращает тела маршрутов (байты CP866) в том же порядке, что и routes.
+    Если decimal_places равно None, каждый маршрут выгружается со своей точностью цен (route.decimal_places).
+    Тела сохранённых маршрутов берутся из кэша; недостающие отрисовываются в пуле процессов executor,
+    если он передан, иначе последовательно. Порядок результата от пула не зависит.
+    """
+    cache = get_route_body_cache()
+    bodies = [None] * len(routes)
+    misses = []  # (позиция, точность, отпечаток) маршрутов, которых нет в кэше
+
+    for index, route in enumerate(routes):
+        places = route.decimal_places if decimal_places is None else decimal_places
+        fingerprint = None
+        if cache is not None and route.id is not None:
+            fingerprint = route_fingerprint(route, places, EXPORT_FORMAT_VERSION)
+            bodies[index] = cache.get(route.id, places, fingerprint)
+        if bodies[index] is None:
+            misses.append((index, places, fingerprint))
+
+    payloads = [route_export_payload(routes[index]) for index, _, _ in misses]
+    places_list = [places for _, places, _ in misses]
+    if executor is not None and len(payloads) > 1:
+        rendered = executor.map(render_payload, payloads, places_list)
+    else:
+        rendered = map(render_payload, payloads, places_list)
+
+    for (index, places, fingerprint), data in zip(misses, rendered, strict=True):
+        bodies[index] = data
+        if fingerprint is not None:
+            cache.put(routes[index].id, places, fingerprint, data)
+    return bodies
+
+
+def render_route_body(route, decimal_places):
+    """
+    Возвращает тело маршрута (начиная с тега R) в байтах CP866.
+    Для сохранённых маршрутов результат берётся из кэша, если содержимое и точность цен не менялись.
+    """
+    return render_route_bodies([route], decimal_places)[0]
+
+
+def get_export_executor():
+    """
+    Общий для приложения пул процессов для параллельной выгрузки (EXPORT_WORKERS процессов).
+    Возвращает None, если параллельная выгрузка выключена (EXPORT_WORKERS <= 1).
+    """
+    workers = current_app.config["EXPORT_WORKERS"]
+    if workers <= 1:
+        return None
+    with _executor_lock:
+        executor = current_app.extensions.get("export_executor")
+        if executor is None:
+            # spawn: дочерние процессы не наследуют потоки и соединения с БД веб-процесса
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            current_app.extensions["export_executor"] = executor
+            atexit.register(executor.shutdown, wait=False, cancel_futures=True)
+    return executor
+
+
+def iter_route_chunks(query, per_fetch=EXPORT_ROUTES_PER_FETCH):
+    """
+    Отдаёт маршруты запроса списками по per_fetch штук. Запрос должен быть упорядочен по Route.id:
+    каждая порция читается отдельным коротким запросом с условием id > последнего прочитанного
+    (курсор по ключу), поэтому ни размер запроса, ни время жизни курсора БД не растут вместе с выборкой.
+    """
+    last_id = None
+    while True:
+        chunk_query = query if last_id is None else query.where(Route.id > last_id)
+        routes = db.session.scalars(chunk_query.limit(per_fetch)).all()
+        if not routes:
+            return
+        last_id = routes[-1].id
+        yield routes
+        if len(routes) < per_fetch:
+            return
+
+
+def iter_routes(query, per_fetch=EXPORT_ROUTES_PER_FETCH):
+    """
+    Отдаёт маршруты из запроса (упорядоченного по Route.id) порциями по per_fetch штук.
+    Уже выгруженные маршруты удаляются из сессии, чтобы память не росла вместе с выборкой.
+    """
+    for routes in iter_route_chunks(query, per_fetch):
+        for route in routes:
+            yield route
+            db.session.expunge(route)
+
+
+def iter_bulk_config(header_line, routes, decimal_places, chunk_size=EXPORT_CHUNK_SIZE, executor=None, batch_size=EXPORT_ROUTES_PER_FETCH):
+    """
+    Генератор содержимого объединённого файла конфигурации (CP866).
+    Сначала отдаёт шапку, затем тела маршрутов (из кэша, если он есть) порциями примерно по chunk_size байт.
+    Маршруты обрабатываются пачками по batch_size штук (в пуле executor, если он передан),
+    поэтому в памяти одновременно держится не больше одной пачки тел и одной порции вывода.
+    """
+    buffer = io.BytesIO()
+    buffer.write((header_line + "\r\n").encode("cp866", errors="replace"))
+
+    routes = iter(routes)
+    while batch := list(islice(routes, batch_size)):
+        for body in render_route_bodies(batch, decimal_places, executor=executor):
+            buffer.write(body)
+            if buffer.tell() >= chunk_size:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ChunkSink:
+    """Файлоподобный приёмник для zipfile без seek/tell: копит записанные байты, пока их не заберёт генератор."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_route_files(routes, current_date, executor=None, batch_size=EXPORT_ROUTES_PER_FETCH):
+    """
+    Отдаёт пары (имя файла, содержимое) для выгрузки по файлу на маршрут: TRFZ_<номер>_<дата>.txt.
+    Каждый файл совпадает с выгрузкой одного маршрута: своя шапка и своя точность цен.
+    При совпадении номеров к имени добавляется ID маршрута.
+    """
+    used_names = set()
+    routes = iter(routes)
+    while batch := list(islice(routes, batch_size)):
+        for route, body in zip(batch, render_route_bodies(batch, None, executor=executor), strict=True):
+            name = f"TRFZ_{route.route_number}_{current_date}.txt"
+            if name in used_names:
+                name = f"TRFZ_{route.route_number}_{current_date}_{route.id}.txt"
+            used_names.add(name)
+
+            header_line = format_config_header(route.region_code, route.carrier_id, route.unit_id, current_date, route.decimal_places)
+            yield name, (header_line + "\r\n").encode("cp866", errors="replace") + body
+
+
+def iter_zip_config(routes, current_date, compression="deflated-6", executor=None, batch_size=EXPORT_ROUTES_PER_FETCH):
+    """
+    Генератор ZIP-архива, в котором на каждый маршрут приходится отдельный файл (см. iter_route_files).
+    Архив отдаётся по мере записи файлов, целиком в памяти он не собирается.
+    """
+    method, level = ZIP_COMPRESSION_OPTIONS[compression]
+    sink = _ChunkSink()
+
+    with zipfile.ZipFile(sink, "w", compression=method, compresslevel=level) as archive:
+        for name, data in iter_route_files(routes, current_date, executor=executor, batch_size=batch_size):
+            archive.writestr(name, data)
+            if chunk := sink.take():
+                yield chunk
+
+    # Центральный каталог архива записывается при закрытии
+    if chunk := sink.take():
+        yield chunk
@@ -6,6 +6,7 @@ from .import_route import ImportRouteForm
 from .models import BulkGenerateModel, EditProfileModel, LoginModel, RegistrationModel, RouteInfoModel, RoutePricesModel, RouteStopsModel, StopModel, TariffTableEntryModel
 from .profile import EditProfileForm
 from .route import RouteInfoForm, RoutePricesForm, RouteStopsForm
+from .route_filter import RouteFilterForm
 from .stop import StopForm
 from .tariff import TariffTableEntryForm
 
@@ -20,6 +21,7 @@ __all__ = [
     "BulkGenerateForm",
     "EditProfileForm",
     "ImportRouteForm",
+    "RouteFilterForm",
     "LoginModel",
     "RegistrationModel",
     "TariffTableEntryModel",
@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import SelectField, StringField
-from wtforms.validators import DataRequired, Length, Regexp
+from wtforms import DateTimeLocalField, IntegerField, SelectField, StringField
+from wtforms.validators import DataRequired, Length, NumberRange, Optional, Regexp
 
 
 # ФОРМА ДЛЯ МАССОВОЙ ГЕНЕРАЦИИ ФАЙЛА КОНФИГУРАЦИИ (Параметры шапки)
@@ -45,4 +45,23 @@ class BulkGenerateForm(FlaskForm):
         validators=[DataRequired()],
     )
 
+    # Сжатие файлов при выгрузке ZIP-архивом (по файлу на маршрут)
+    zip_compression = SelectField(
+        "Сжатие ZIP-архива",
+        choices=[
+            ("deflated-6", "Обычное"),
+            ("deflated-1", "Быстрое"),
+            ("deflated-9", "Максимальное"),
+            ("stored", "Без сжатия"),
+        ],
+        default="deflated-6",
+    )
+
+    # Инкрементальная выгрузка: только маршруты, изменённые после момента времени
+    # или после предыдущей выгрузки (её номер возвращается в заголовке X-Export-Id)
+    since = DateTimeLocalField("Изменённые после", format="%Y-%m-%dT%H:%M", validators=[Optional()])
+    since_export = IntegerField("Изменённые после выгрузки №", validators=[Optional(), NumberRange(min=1)])
+    # Сохранённая выборка: те же маршруты (ID или фильтры), что и в прошлой выгрузке с этим номером
+    selection_export = IntegerField("Маршруты выгрузки №", validators=[Optional(), NumberRange(min=1)])
+
     # submit-кнопка нам не нужна, так как мы будем использовать существующую кнопку "Создать конфигурацию"
@@ -1,15 +1,17 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileAllowed, FileField, FileRequired
-from wtforms import SubmitField
+from wtforms import BooleanField, SubmitField
 
 
 # Форма импорта маршрута из файла конфигурации
 class ImportRouteForm(FlaskForm):
     route_file = FileField(
-        "Выберите файл конфигурации",
+        "Выберите файл конфигурации или ZIP-архив",
         validators=[
             FileRequired(),
-            FileAllowed(["txt"], "Только текстовые файлы конфигурации!"),
+            FileAllowed(["txt", "zip"], "Только текстовые файлы конфигурации или ZIP-архивы с ними!"),
         ],
     )
+    # Повторная загрузка уже импортированного файла по умолчанию не создаёт копию маршрута
+    force = BooleanField("Импортировать повторно, даже если файл уже загружался")
     submit = SubmitField("Загрузить и импортировать")
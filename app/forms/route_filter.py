@@ -0,0 +1,25 @@
+from flask_wtf import FlaskForm
+from wtforms import HiddenField, SelectField, StringField
+from wtforms.validators import Length, Optional, Regexp
+
+from app.constants import TRANSPORT_TYPE_CHOICES
+
+
+# Фильтры и сортировка списка маршрутов (GET-параметры страницы; поля того же имени
+# передаются скрытыми в форме массовой выгрузки при выборе всех подходящих маршрутов)
+class RouteFilterForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    transport = SelectField("Тип транспорта", choices=[("", "Все")] + list(TRANSPORT_TYPE_CHOICES.items()), validators=[Optional()])
+    region = StringField(
+        "Код региона",
+        validators=[Optional(), Length(max=2), Regexp(r"^\d+$", message="Код должен содержать только цифры.")],
+        filters=[lambda x: x.strip().zfill(2) if x and x.strip() else None],
+    )
+    status = SelectField("Статус", choices=[("", "Все"), ("completed", "Готов"), ("draft", "В работе")], validators=[Optional()])
+    sort = SelectField("Сортировка", choices=[("id", "По дате создания"), ("number", "По номеру маршрута")], default="id")
+
+    # Курсоры постраничного вывода (ключ последней/первой строки соседней страницы)
+    after = HiddenField()
+    before = HiddenField()
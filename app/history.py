@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+from datetime import UTC, datetime
+from types import SimpleNamespace
+from typing import NamedTuple
+
+import sqlalchemy as sa
+from flask import current_app
+
+from app import db
+from app.audit import apply_route_changes, diff_route_snapshots
+from app.export import format_config_header, render_payload, route_export_payload
+from app.models import AuditLog, Route
+
+# Действия журнала, из которых складывается история содержимого маршрута
+ROUTE_HISTORY_ACTIONS = ("route_created", "route_imported", "route_info_updated", "route_stops_updated", "route_prices_updated", "route_deleted")
+
+
+class RouteState(NamedTuple):
+    """Состояние маршрута на момент времени, восстановленное по журналу."""
+
+    snapshot: dict | None  # None — к этому моменту маршрут удалён
+    version: int | None  # None для записей журнала, сделанных до хранения версий
+    changed_at: datetime  # последнее изменение не позже запрошенного момента
+    deltas: int  # сколько изменений применено к ближайшему снимку
+    user_id: int | None  # владелец маршрута в этой жизни маршрута (ID могут повторяться после удаления)
+
+
+def parse_utc(value: str | datetime) -> datetime:
+    """
+    Момент времени в UTC: строки — в формате ISO 8601, наивные значения (из SQLite) считаются UTC,
+    значения со смещением переводятся в UTC — SQLite сравнивает время как строки без смещения.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.astimezone(UTC) if value.tzinfo else value.replace(tzinfo=UTC)
+
+
+def route_state_at(route_id: int, moment: datetime) -> RouteState | None:
+    """
+    Восстанавливает маршрут на момент moment: записи журнала читаются от moment назад (индекс по route_id
+    и created_at) до ближайшего полного снимка, затем изменения после снимка применяются по порядку.
+    Число прочитанных записей ограничено интервалом снимков AUDIT_SNAPSHOT_INTERVAL.
+    Ближайший снимок — не раньше создания маршрута, поэтому записи прежнего маршрута с тем же ID не применяются.
+    None — маршрута тогда ещё не было или его история не содержит снимка.
+    """
+    query = (
+        sa.select(AuditLog.action, AuditLog.details, AuditLog.created_at, AuditLog.user_id)
+        .where(AuditLog.route_id == route_id, AuditLog.action.in_(ROUTE_HISTORY_ACTIONS), AuditLog.created_at <= moment)
+        .order_by(AuditLog.created_at.desc(), AuditLog.id.desc())
+    )
+    page_size = current_app.config["AUDIT_SNAPSHOT_INTERVAL"] * 2
+    pending = []
+    last = None
+    offset = 0
+    while True:
+        rows = db.session.execute(query.limit(page_size).offset(offset)).all()
+        for row in rows:
+            details = row.details or {}
+            if last is None:
+                last = row
+                if row.action == "route_deleted":
+                    # В записях об удалении до хранения владельца — удаливший пользователь (удаляет владелец)
+                    return RouteState(None, details.get("version"), row.created_at, 0, details.get("user_id", row.user_id))
+            snapshot, changes = _history_step(row.action, details)
+            if snapshot is not None:
+                for step in reversed(pending):
+                    snapshot = apply_route_changes(snapshot, step)
+                return RouteState(snapshot, (last.details or {}).get("version"), last.created_at, len(pending), snapshot.get("user_id"))
+            pending.append(changes)
+        if len(rows) < page_size:
+            return None
+        # Снимок дальше ожидаемого (например, журнал до хранения снимков): читаем следующую страницу
+        offset += page_size
+
+
+def route_state_owner(route_id: int, state: RouteState) -> int | None:
+    """
+    Владелец маршрута в жизни, к которой относится state: для нынешнего маршрута — его текущий владелец
+    (маршрут мог передать администратор), для удалённого — владелец по журналу, даже если ID уже у другого маршрута.
+    """
+    if state.snapshot is not None:
+        ended = sa.exists().where(AuditLog.route_id == route_id, AuditLog.action == "route_deleted", AuditLog.created_at >= state.changed_at)
+        owner_id = db.session.scalar(sa.select(Route.user_id).where(Route.id == route_id, ~ended))
+        if owner_id is not None:
+            return owner_id
+    return state.user_id
+
+
+def route_history_rows(route_id: int, state: RouteState | None, limit: int) -> list:
+    """
+    Последние limit записей истории маршрута (действие, детали, время). Для state — только записи той жизни
+    маршрута, к которой он относится (между предыдущим и следующим удалением): SQLite может выдать ID
+    удалённого маршрута новому, и тогда под одним route_id в журнале лежат истории разных маршрутов.
+    """
+    query = sa.select(AuditLog.action, AuditLog.details, AuditLog.created_at).where(AuditLog.route_id == route_id, AuditLog.action.in_(ROUTE_HISTORY_ACTIONS))
+    if state is not None:
+        deletions = sa.select(AuditLog.created_at).where(AuditLog.route_id == route_id, AuditLog.action == "route_deleted")
+        started_after = db.session.scalar(deletions.where(AuditLog.created_at < state.changed_at).order_by(AuditLog.created_at.desc()).limit(1))
+        ended_at = db.session.scalar(deletions.where(AuditLog.created_at >= state.changed_at).order_by(AuditLog.created_at).limit(1))
+        if started_after is not None:
+            query = query.where(AuditLog.created_at > started_after)
+        if ended_at is not None:
+            query = query.where(AuditLog.created_at <= ended_at)
+    return db.session.execute(query.order_by(AuditLog.created_at.desc(), AuditLog.id.desc()).limit(limit)).all()
+
+
+def route_state_trfz(snapshot: dict, moment: datetime) -> bytes:
+    """Файл конфигурации TRFZ (CP866) для восстановленного маршрута; дата в шапке — дата moment."""
+    places = str(snapshot["decimal_places"])
+    header_line = format_config_header(snapshot["region_code"], snapshot["carrier_id"], snapshot["unit_id"], moment.strftime("%y%m%d"), places)
+    return f"{header_line}\r\n".encode("cp866") + render_payload(route_export_payload(SimpleNamespace(**snapshot)), places)
+
+
+def _history_step(action, details):
+    """
+    Снимок состояния после записи (если он есть) и изменения, которые она внесла.
+    Записи до хранения изменений содержат полные значения: они приводятся к тому же виду.
+    """
+    if "snapshot" in details or "changes" in details:
+        return details.get("snapshot"), details.get("changes", {})
+    if action in ("route_created", "route_imported", "route_info_updated"):
+        return details.get("after"), {}
+    if action == "route_stops_updated":
+        before = {"stops": details.get("before_stops") or [], "is_completed": details.get("before_is_completed")}
+        after = {"stops": details.get("after_stops") or [], "stops_set": True, "is_completed": details.get("after_is_completed")}
+        return None, diff_route_snapshots(before, after)
+    if action == "route_prices_updated":
+        before = {"price_matrix": details.get("before_price_matrix") or []}
+        after = {"price_matrix": details.get("after_price_matrix") or [], "is_completed": True}
+        return None, diff_route_snapshots(before, after)
+    return None, {}
@@ -0,0 +1,164 @@
+import io
+import zipfile
+import zlib
+from collections import deque
+from datetime import UTC, datetime
+from types import SimpleNamespace
+
+import sqlalchemy as sa
+
+from app import db
+from app.audit import build_audit_row, serialize_route
+from app.models import AuditLog, Route
+from app.trfz import TrfzBlock, iter_trfz_routes, parse_trfz_blocks, trfz_content_hash
+
+# Маршруты вставляются пачками: в памяти одновременно держится не больше одной пачки разобранных маршрутов
+IMPORT_BATCH_SIZE = 500
+
+
+def find_imported_routes(user_id, import_hash, session=None):
+    """Маршруты пользователя, импортированные из файла с тем же содержимым: [(id, название)] (поиск по индексу)."""
+    query = sa.select(Route.id, Route.route_name).where(Route.user_id == user_id, Route.import_hash == import_hash).order_by(Route.id)
+    return [tuple(row) for row in (session or db.session).execute(query)]
+
+
+def import_trfz_routes(stream, user_id, import_hash=None, batch_size=IMPORT_BATCH_SIZE, audit_row=None, session=None):
+    """
+    Импортирует все блоки маршрутов файла конфигурации в транзакцию session (по умолчанию — текущую, без commit).
+    Маршруты и записи журнала route_imported вставляются пачками многострочными INSERT.
+    Блоки с ошибками разбора пропускаются и возвращаются вместе с импортированными маршрутами:
+    ([(id, название)], [TrfzBlock с ошибкой]). import_hash сохраняется в каждом маршруте файла.
+    audit_row — заготовка записи журнала (build_audit_row), собранная в запросе: в потоке записи его нет.
+    """
+    inserter = _RouteInserter(user_id, batch_size, session or db.session, audit_row)
+    errors = []
+    for block in iter_trfz_routes(stream):
+        if block.error is not None:
+            errors.append(block)
+        else:
+            inserter.add(block.fields, import_hash)
+    inserter.flush()
+    return inserter.imported, errors
+
+
+def import_zip_routes(stream, user_id, max_entry_bytes, executor=None, max_in_flight=1, force=False, batch_size=IMPORT_BATCH_SIZE, audit_row=None, session=None):
+    """
+    Импортирует файлы конфигурации из ZIP-архива в транзакцию session (по умолчанию — текущую, без commit).
+    Файлы читаются из архива по одному и разбираются в пуле процессов executor (если он передан),
+    при этом в работе одновременно не больше max_in_flight файлов. Маршруты вставляются пачками.
+    Уже импортированные файлы и повторы внутри архива пропускаются, если не задан force.
+    Возвращает ([(id, название)], сводку по файлам архива в порядке архива):
+    {"name", "status": imported / skipped / failed, "routes", "errors"}. audit_row — как в import_trfz_routes.
+    """
+    session = session or db.session
+    inserter = _RouteInserter(user_id, batch_size, session, audit_row)
+    summary = []
+    seen_hashes = {}
+
+    def is_duplicate(item, content_hash):
+        if force:
+            return False
+        if content_hash in seen_hashes:
+            item["errors"].append(f"Повторяет файл {seen_hashes[content_hash]}")
+            return True
+        seen_hashes[content_hash] = item["name"]
+        existing = find_imported_routes(user_id, content_hash, session)
+        if existing:
+            item["errors"].append(f"Уже импортирован как маршрут №{existing[0][0]}" if len(existing) == 1 else f"Уже импортирован: маршрутов {len(existing)}")
+            return True
+        return False
+
+    with zipfile.ZipFile(stream) as archive:
+        entries = []
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            item = {"name": info.filename, "status": "skipped", "routes": 0, "errors": []}
+            summary.append(item)
+            if not info.filename.lower().endswith(".txt"):
+                item["errors"].append("Не файл конфигурации (.txt)")
+            elif info.file_size > max_entry_bytes:
+                item["errors"].append(f"Файл больше {max_entry_bytes // (1024 * 1024)} МБ")
+            else:
+                entries.append((info, item))
+
+        for item, content_hash, blocks in _parse_entries(archive, entries, executor, max_in_flight, is_duplicate):
+            for block in blocks:
+                if block.error is not None:
+                    item["errors"].append(f"Маршрут {block.route_number} (блок {block.number}): {block.error}" if block.number else block.error)
+                else:
+                    inserter.add(block.fields, content_hash)
+                    item["routes"] += 1
+            item["status"] = "imported" if item["routes"] else "failed"
+
+    inserter.flush()
+    return inserter.imported, summary
+
+
+def _parse_entries(archive, entries, executor, max_in_flight, is_duplicate):
+    """
+    Отдаёт (элемент сводки, хэш содержимого, блоки) для файлов архива в исходном порядке.
+    Файл распаковывается в память только перед отправкой на разбор, поэтому одновременно
+    в памяти не больше max_in_flight файлов. Файлы, для которых is_duplicate вернул True, не разбираются.
+    """
+    pending = deque()
+    for info, item in entries:
+        try:
+            data = archive.read(info)
+        except (zipfile.BadZipFile, NotImplementedError, RuntimeError, OSError, zlib.error) as e:
+            pending.append((item, None, None, [_entry_error(e)]))
+        else:
+            content_hash = trfz_content_hash(io.BytesIO(data))
+            if is_duplicate(item, content_hash):
+                continue
+            if executor is None:
+                pending.append((item, content_hash, None, parse_trfz_blocks(data)))
+            else:
+                pending.append((item, content_hash, executor.submit(parse_trfz_blocks, data), None))
+
+        while pending and (len(pending) >= max_in_flight or pending[0][2] is None):
+            yield _collect(pending.popleft())
+    while pending:
+        yield _collect(pending.popleft())
+
+
+def _collect(entry):
+    item, content_hash, future, blocks = entry
+    return item, content_hash, blocks if future is None else future.result()
+
+
+def _entry_error(error):
+    return TrfzBlock(0, None, None, f"Не удалось распаковать: {error}")
+
+
+class _RouteInserter:
+    """Копит разобранные маршруты и вставляет их вместе с записями журнала пачками по batch_size."""
+
+    def __init__(self, user_id, batch_size, session, audit_row=None):
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.session = session
+        self.audit_row = audit_row
+        self.imported = []
+        self._rows = []
+
+    def add(self, fields, import_hash=None):
+        # Core-вставка обходит валидаторы модели, поэтому счётчики заполняются здесь
+        counts = {"stops_count": len(fields["stops"]), "tariffs_count": len(fields["tariff_tables"])}
+        self._rows.append({**fields, **counts, "user_id": self.user_id, "stops_set": True, "is_completed": True, "import_hash": import_hash})
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        route_ids = self.session.scalars(sa.insert(Route).returning(Route.id, sort_by_parameter_order=True), rows).all()
+        audit_row = self.audit_row or build_audit_row("route_imported", "route", user_id=self.user_id)
+        # Время записи — момент вставки маршрутов, как у правок маршрутов (см. _update_route)
+        audit_row = {**audit_row, "created_at": datetime.now(UTC)}
+        audit_rows = [
+            {**audit_row, "route_id": route_id, "details": {"version": 1, "snapshot": serialize_route(SimpleNamespace(id=route_id, **row))}} for route_id, row in zip(route_ids, rows, strict=True)
+        ]
+        self.session.execute(sa.insert(AuditLog), audit_rows)
+        self.imported.extend((route_id, row["route_name"]) for route_id, row in zip(route_ids, rows, strict=True))
@@ -0,0 +1,218 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
+from functools import partial
+
+import sqlalchemy as sa
+from flask import current_app
+
+from app import db
+from app.export import EXPORT_ROUTES_PER_FETCH, format_config_header, get_export_executor, iter_route_chunks, render_route_bodies
+from app.models import ExportJob, Route
+from app.selection import export_conditions
+from app.writer import run_write
+
+
+def init_export_jobs(app):
+    if "export_jobs" in app.extensions:
+        return
+    workers = app.config["EXPORT_JOB_WORKERS"]
+    # При EXPORT_JOB_WORKERS = 0 задания выполняются сразу в запросе (удобно для тестов и CLI)
+    app.extensions["export_jobs"] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export-job") if workers > 0 else None
+
+
+def create_export_job(user_id, criteria, total_routes, region_code, carrier_id, unit_id, decimal_places, session):
+    """
+    Создаёт задание фоновой выгрузки для уже проверенной выборки и возвращает его ID; выполняется через run_write.
+    В задании хранятся критерии выборки (см. export_conditions), а не список ID: маршруты находятся при выполнении.
+    """
+    job = ExportJob(
+        user_id=user_id,
+        status="pending",
+        params={
+            "selection": criteria,
+            "region_code": region_code,
+            "carrier_id": carrier_id,
+            "unit_id": unit_id,
+            "decimal_places": decimal_places,
+        },
+        total_routes=total_routes,
+        done_routes=0,
+    )
+    session.add(job)
+    session.flush()
+    return job.id
+
+
+def _update_export_job(job_id, values, session):
+    session.execute(sa.update(ExportJob).where(ExportJob.id == job_id).values(**values))
+
+
+def submit_export_job(job_id):
+    """Ставит задание в очередь пула потоков приложения или выполняет сразу, если пул выключен."""
+    app = current_app._get_current_object()
+    executor = app.extensions.get("export_jobs")
+    if executor is None:
+        run_export_job(app, job_id)
+    else:
+        executor.submit(run_export_job, app, job_id)
+
+
+def run_export_job(app, job_id):
+    """
+    Строит файл выгрузки в каталоге EXPORT_ARTIFACT_DIR, обновляя прогресс задания после каждой пачки маршрутов.
+    Маршруты читаются в сессии потока задания, а состояние задания записывается через run_write.
+    """
+    with app.app_context():
+        job = db.session.get(ExportJob, job_id)
+        if job is None or job.status != "pending":
+            return
+
+        run_write(partial(_update_export_job, job_id, {"status": "running", "started_at": datetime.now(UTC)}))
+
+        artifact_dir = app.config["EXPORT_ARTIFACT_DIR"]
+        artifact_path = os.path.join(artifact_dir, f"export_{job.id}.txt")
+        tmp_path = artifact_path + ".part"
+        params = dict(job.params)
+        user_id = job.user_id
+
+        try:
+            os.makedirs(artifact_dir, exist_ok=True)
+            current_date = datetime.now().strftime("%y%m%d")
+            decimal_places = params["decimal_places"]
+            header_line = format_config_header(params["region_code"], params["carrier_id"], params["unit_id"], current_date, decimal_places)
+            executor = get_export_executor() if job.total_routes >= app.config["EXPORT_PARALLEL_MIN_ROUTES"] else None
+            # Задания, созданные до критериев выборки, хранят список ID
+            criteria = params["selection"] if "selection" in params else {"route_ids": params["route_ids"]}
+            query = sa.select(Route).where(*export_conditions(user_id, criteria)).order_by(Route.id)
+
+            done = 0
+            with open(tmp_path, "wb") as f:
+                f.write((header_line + "\r\n").encode("cp866", errors="replace"))
+                for routes in iter_route_chunks(query, EXPORT_ROUTES_PER_FETCH):
+                    for body in render_route_bodies(routes, decimal_places, executor=executor):
+                        f.write(body)
+
+                    done += len(routes)
+                    run_write(partial(_update_export_job, job_id, {"done_routes": done}))
+                    db.session.expunge_all()
+
+            os.replace(tmp_path, artifact_path)
+            done_values = {
+                "status": "done",
+                "artifact_path": artifact_path,
+                "total_routes": done,
+                "filename": f"TRFZ_BULK_{current_date}_({done}routes).txt",
+                "size_bytes": os.path.getsize(artifact_path),
+                "finished_at": datetime.now(UTC),
+            }
+            run_write(partial(_update_export_job, job_id, done_values))
+
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception("Ошибка фоновой выгрузки %s", job_id)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            run_write(partial(_update_export_job, job_id, {"status": "failed", "error": str(e)[:512], "finished_at": datetime.now(UTC)}))
+
+
+# Сообщение для заданий, которые перестали выполняться вместе с процессом приложения
+STALE_EXPORT_JOB_ERROR = "Выгрузка прервана: приложение было перезапущено. Запустите выгрузку заново."
+
+ACTIVE_EXPORT_JOB_STATUSES = ("pending", "running")
+
+
+def _as_utc(value):
+    return value if value.tzinfo else value.replace(tzinfo=UTC)
+
+
+def _stale_cutoff():
+    return datetime.now(UTC) - timedelta(seconds=current_app.config["EXPORT_JOB_STALE_AFTER"])
+
+
+def export_job_is_stale(job):
+    """Задание pending/running, которое не менялось дольше EXPORT_JOB_STALE_AFTER секунд."""
+    if job.status not in ACTIVE_EXPORT_JOB_STATUSES:
+        return False
+    return _as_utc(job.updated_at or job.created_at) < _stale_cutoff()
+
+
+def fail_stale_export_jobs():
+    """
+    Помечает как failed задания pending/running, брошенные при перезапуске (см. export_job_is_stale),
+    и удаляет их недописанные файлы. Отдельного обхода при старте нет: другие воркеры в это время
+    могут ещё выполнять свои задания. Возвращает число таких заданий.
+    """
+    cutoff = _stale_cutoff()
+    activity = sa.func.coalesce(ExportJob.updated_at, ExportJob.created_at)
+    job_ids = db.session.scalars(sa.select(ExportJob.id).where(ExportJob.status.in_(ACTIVE_EXPORT_JOB_STATUSES), activity < cutoff)).all()
+    if not job_ids:
+        return 0
+
+    failed_ids = run_write(partial(_fail_stale_export_jobs, job_ids, cutoff))
+    artifact_dir = current_app.config["EXPORT_ARTIFACT_DIR"]
+    for job_id in failed_ids:
+        tmp_path = os.path.join(artifact_dir, f"export_{job_id}.txt.part")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return len(failed_ids)
+
+
+def _fail_stale_export_jobs(job_ids, cutoff, session):
+    # Условие повторяется при записи: задание могло ожить, пока запись ждала в очереди
+    activity = sa.func.coalesce(ExportJob.updated_at, ExportJob.created_at)
+    stale = sa.and_(ExportJob.id.in_(job_ids), ExportJob.status.in_(ACTIVE_EXPORT_JOB_STATUSES), activity < cutoff)
+    failed_ids = session.scalars(sa.select(ExportJob.id).where(stale)).all()
+    if failed_ids:
+        values = {"status": "failed", "error": STALE_EXPORT_JOB_ERROR, "finished_at": datetime.now(UTC)}
+        session.execute(sa.update(ExportJob).where(ExportJob.id.in_(failed_ids)).values(**values))
+    return failed_ids
+
+
+def cleanup_export_artifacts():
+    """
+    Удаляет готовые файлы выгрузок старше EXPORT_ARTIFACT_MAX_AGE секунд, а затем самые старые,
+    пока суммарный размер не уложится в EXPORT_ARTIFACT_MAX_BYTES. Задания помечаются как expired,
+    брошенные при перезапуске — как failed (см. fail_stale_export_jobs).
+    Возвращает число удалённых файлов.
+    """
+    fail_stale_export_jobs()
+    max_age = timedelta(seconds=current_app.config["EXPORT_ARTIFACT_MAX_AGE"])
+    max_bytes = current_app.config["EXPORT_ARTIFACT_MAX_BYTES"]
+    cutoff = datetime.now(UTC) - max_age
+
+    done_jobs = db.session.scalars(sa.select(ExportJob).where(ExportJob.status == "done").order_by(ExportJob.finished_at.desc(), ExportJob.id.desc())).all()
+
+    expired = []
+    total = 0
+    for job in done_jobs:
+        finished_at = _as_utc(job.finished_at)
+        total += job.size_bytes or 0
+        if finished_at < cutoff or total > max_bytes:
+            expired.append(job)
+
+    for job in expired:
+        if job.artifact_path and os.path.exists(job.artifact_path):
+            os.remove(job.artifact_path)
+    if expired:
+        run_write(partial(_expire_export_jobs, [job.id for job in expired]))
+    return len(expired)
+
+
+def _expire_export_jobs(job_ids, session):
+    session.execute(sa.update(ExportJob).where(ExportJob.id.in_(job_ids)).values(status="expired", artifact_path=None))
+
+
+def export_job_status(job):
+    """Состояние задания для ответа на опрос прогресса."""
+    percent = 100 if job.total_routes == 0 else int(job.done_routes * 100 / job.total_routes)
+    return {
+        "id": job.id,
+        "status": job.status,
+        "done_routes": job.done_routes,
+        "total_routes": job.total_routes,
+        "percent": percent,
+        "filename": job.filename,
+        "size_bytes": job.size_bytes,
+        "error": job.error,
+    }
@@ -7,6 +7,7 @@ from sqlalchemy.types import JSON
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from app import db, login
+from app.prices import PackedPriceMatrix
 
 
 class User(UserMixin, db.Model):
@@ -54,15 +55,84 @@ class Route(db.Model):
     # JSON-поля
     tariff_tables = db.Column(db.JSON, default=list)
     stops: so.Mapped[list] = so.mapped_column(JSON)
-    price_matrix: so.Mapped[list] = so.mapped_column(JSON)
+    # Матрица цен хранится упакованной (верхний треугольник, целые числа), читается как PriceMatrix
+    price_matrix: so.Mapped[list] = so.mapped_column(PackedPriceMatrix)
+
+    # Число остановок и тарифных таблиц: обновляются при присваивании stops / tariff_tables,
+    # чтобы список маршрутов не загружал сами JSON-поля
+    stops_count: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default=sa.text("0"), nullable=False)
+    tariffs_count: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default=sa.text("0"), nullable=False)
 
     # Статус завершенности заполнения всех шагов
     stops_set: so.Mapped[bool] = so.mapped_column(sa.Boolean, default=False)
     is_completed: so.Mapped[bool] = so.mapped_column(sa.Boolean, default=False)
 
+    # Номер ревизии (увеличивается SQLAlchemy при каждом UPDATE) и время последнего изменения.
+    # Позволяют проверить актуальность выгрузки, не загружая JSON-поля.
+    version: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False, server_default=sa.text("1"))
+    updated_at: so.Mapped[datetime] = so.mapped_column(
+        sa.DateTime(timezone=True),
+        default=lambda: datetime.now(UTC),
+        onupdate=lambda: datetime.now(UTC),
+        server_default=sa.func.current_timestamp(),
+        nullable=False,
+    )
+
+    # Хэш нормализованного содержимого файла, из которого импортирован маршрут (повторная загрузка того же файла)
+    import_hash: so.Mapped[str | None] = so.mapped_column(sa.String(64), nullable=True)
+
+    __mapper_args__ = {"version_id_col": version}
+    __table_args__ = (
+        # Выборка маршрутов пользователя, изменённых после заданного момента (инкрементальная выгрузка)
+        sa.Index("ix_route_user_id_updated_at", "user_id", "updated_at"),
+        sa.Index("ix_route_user_id_import_hash", "user_id", "import_hash"),
+        # Постраничный вывод списка маршрутов по ключу сортировки и фильтр по статусу
+        sa.Index("ix_route_user_id_id", "user_id", "id"),
+        sa.Index("ix_route_user_id_route_number", "user_id", "route_number"),
+        sa.Index("ix_route_user_id_is_completed", "user_id", "is_completed"),
+        # AUTOINCREMENT: ID удалённого маршрута не выдаётся новому, иначе его история и выгрузки смешиваются с прежними
+        {"sqlite_autoincrement": True},
+    )
+
     def __repr__(self):
         return f"<Route {self.route_name}>"
 
+    @so.validates("stops", "tariff_tables")
+    def _update_counts(self, key, value):
+        count = len(value) if value else 0
+        if key == "stops":
+            self.stops_count = count
+        else:
+            self.tariffs_count = count
+        return value
+
+
+def defer_route_payload(relationship=None):
+    """
+    Опции запроса, откладывающие загрузку тяжёлых полей маршрута (остановки, тарифы, матрица цен)
+    для списков, где нужны только название, статус и счётчики. relationship — связь, через которую
+    маршрут подгружается (например, AuditLog.route); без неё опции относятся к самому запросу маршрутов.
+    """
+    deferred = [so.defer(Route.stops), so.defer(Route.tariff_tables), so.defer(Route.price_matrix)]
+    if relationship is None:
+        return deferred
+    return [so.joinedload(relationship).options(*deferred)]
+
+
+class DeletedRoute(db.Model):
+    """Запись об удалённом маршруте: по ней инкрементальная выгрузка сообщает, какие маршруты пропали."""
+
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    route_id: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id))
+    route_number: so.Mapped[str | None] = so.mapped_column(sa.String(10))
+    deleted_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), default=lambda: datetime.now(UTC), nullable=False)
+
+    __table_args__ = (sa.Index("ix_deleted_route_user_id_deleted_at", "user_id", "deleted_at"),)
+
+    def __repr__(self):
+        return f"<DeletedRoute {self.route_id}>"
+
 
 class AuditLog(db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
@@ -80,5 +150,40 @@ class AuditLog(db.Model):
     user: so.Mapped[User | None] = so.relationship(User, lazy="joined")
     route: so.Mapped[Route | None] = so.relationship(Route, lazy="joined")
 
+    # История маршрута на момент времени читается от этого момента назад до ближайшего снимка
+    __table_args__ = (sa.Index("ix_audit_log_route_id_created_at", "route_id", "created_at"),)
+
     def __repr__(self):
         return f"<AuditLog {self.action} user={self.user_id} route={self.route_id}>"
+
+
+class ExportJob(db.Model):
+    """Фоновая массовая выгрузка конфигурации: состояние хранится в БД, чтобы его мог отдать любой воркер."""
+
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), index=True)
+    # pending -> running -> done / failed; готовый файл после истечения срока хранения -> expired
+    status: so.Mapped[str] = so.mapped_column(sa.String(16), default="pending", nullable=False, index=True)
+
+    # Параметры выгрузки (ID маршрутов и поля шапки)
+    params = db.Column(db.JSON, default=dict)
+
+    # Прогресс (в маршрутах)
+    total_routes: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, nullable=False)
+    done_routes: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, nullable=False)
+
+    # Результат
+    filename: so.Mapped[str | None] = so.mapped_column(sa.String(256), nullable=True)
+    artifact_path: so.Mapped[str | None] = so.mapped_column(sa.String(512), nullable=True)
+    size_bytes: so.Mapped[int | None] = so.mapped_column(sa.BigInteger, nullable=True)
+    error: so.Mapped[str | None] = so.mapped_column(sa.String(512), nullable=True)
+
+    created_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime(timezone=True), default=lambda: datetime.now(UTC), nullable=False, index=True)
+    started_at: so.Mapped[datetime | None] = so.mapped_column(sa.DateTime(timezone=True), nullable=True)
+    finished_at: so.Mapped[datetime | None] = so.mapped_column(sa.DateTime(timezone=True), nullable=True, index=True)
+    # Последнее изменение задания: поток выгрузки обновляет его после каждой пачки маршрутов,
+    # поэтому давно не менявшееся задание pending/running никем не выполняется (см. fail_stale_export_jobs)
+    updated_at: so.Mapped[datetime | None] = so.mapped_column(sa.DateTime(timezone=True), default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC), nullable=True)
+
+    def __repr__(self):
+        return f"<ExportJob {self.id} {self.status} {self.done_routes}/{self.total_routes}>"
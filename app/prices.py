@@ -0,0 +1,280 @@
+import hashlib
+import json
+import math
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import Sequence
+from decimal import Decimal, InvalidOperation
+
+import sqlalchemy as sa
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: без него значения сужаются построчным циклом
+    np = None
+
+# Цены хранятся целыми числами в тысячных долях рубля: этого хватает для любой точности выгрузки (V = 0..3)
+PRICE_SCALE = 1000
+# Предел хранимого значения: дальше int64 может переполниться при масштабировании
+PRICE_LIMIT = 2**62
+# Ширина значения (байт) -> тип array; пометка «цены для тарифа в ячейке нет» — наименьшее значение типа
+ITEM_TYPECODES = {4: "i", 8: "q"}
+MISSING_PRICES = {4: -(2**31), 8: -(2**63)}
+
+# Шапка упакованной матрицы: метка, версия формата, ширина значения, число зон, длина списка тарифов в байтах.
+# После шапки — номера тарифов и значения, сжатые zlib (цены маршрута обычно сильно повторяются).
+PACKED_MAGIC = b"PM"
+PACKED_VERSION = 1
+PACKED_COMPRESS_LEVEL = 1
+_HEADER = struct.Struct("<2sBBIH")
+# Разделитель номеров тарифов в шапке
+_TABS_SEPARATOR = "\x1f"
+
+
+class PriceMatrix(Sequence):
+    """
+    Матрица цен маршрута в упакованном виде: верхний треугольник (j >= i) построчно,
+    для каждой ячейки — по одному целому на тариф (цена × PRICE_SCALE или пометка отсутствия цены).
+    Значения хранятся как int32, если все цены в него помещаются, иначе как int64.
+    Прочитанная из БД матрица распаковывается (zlib) только при первом обращении к значениям.
+
+    Для остального кода ведёт себя как прежний список списков словарей: matrix[i][j] — словарь
+    {номер тарифа: цена}, ячейки [i][j] и [j][i] — один и тот же словарь. Списочное представление
+    строится при первом обращении к строкам; выгрузка читает упакованные значения напрямую.
+    """
+
+    __slots__ = ("zones", "tabs", "itemsize", "_data", "_compressed", "_rows")
+
+    def __init__(self, zones, tabs, itemsize, data=None, compressed=None):
+        self.zones = zones
+        self.tabs = tuple(tabs)
+        self.itemsize = itemsize
+        self._data = bytes(data) if data is not None else None
+        self._compressed = compressed
+        self._rows = None
+
+    @property
+    def data(self):
+        """Значения в порядке little-endian, zones * (zones + 1) / 2 * len(tabs) штук."""
+        if self._data is None:
+            self._data = zlib.decompress(self._compressed)
+        return self._data
+
+    @property
+    def compressed(self):
+        if self._compressed is None:
+            self._compressed = zlib.compress(self._data, PACKED_COMPRESS_LEVEL)
+        return self._compressed
+
+    @property
+    def missing(self):
+        """Значение-пометка «цены нет» для ширины этой матрицы."""
+        return MISSING_PRICES[self.itemsize]
+
+    @classmethod
+    def from_list(cls, matrix):
+        """
+        Упаковывает матрицу из списка списков словарей. Читается только верхний треугольник;
+        ячейки, которые не являются словарями, считаются пустыми. Нечисловая цена — ValueError.
+        """
+        zones = len(matrix)
+        tab_positions = {}
+        cells = []
+        for i in range(zones):
+            row = matrix[i] or ()
+            for j in range(i, zones):
+                cell = row[j] if j < len(row) else None
+                if not isinstance(cell, dict):
+                    cell = {}
+                cells.append(cell)
+                for key in cell:
+                    tab_positions.setdefault(str(key), len(tab_positions))
+
+        tabs_count = len(tab_positions)
+        values = array("q", [MISSING_PRICES[8]]) * (len(cells) * tabs_count)
+        for index, cell in enumerate(cells):
+            base = index * tabs_count
+            for key, price in cell.items():
+                values[base + tab_positions[str(key)]] = price_to_stored(price)
+        return cls.from_values(zones, tab_positions, values)
+
+    @classmethod
+    def from_values(cls, zones, tabs, values):
+        """
+        Матрица из готовых хранимых значений: array int64 в порядке упаковки, отсутствие цены — MISSING_PRICES[8].
+        Если все цены помещаются в int32, значения сужаются.
+        """
+        missing_wide, missing_narrow = MISSING_PRICES[8], MISSING_PRICES[4]
+        if np is not None:
+            wide = np.frombuffer(values, dtype=np.int64)
+            present = wide != missing_wide
+            if np.all(np.abs(wide[present]) < -missing_narrow):
+                return cls(zones, tabs, 4, np.where(present, wide, missing_narrow).astype("<i4").tobytes())
+            return cls(zones, tabs, 8, wide.astype("<i8").tobytes())
+
+        if all(missing_narrow < value < -missing_narrow or value == missing_wide for value in values):
+            values = array("i", (missing_narrow if value == missing_wide else value for value in values))
+        return cls(zones, tabs, values.itemsize, _to_little_endian(values))
+
+    @staticmethod
+    def cell_position(i, j, zones):
+        """Номер ячейки (i, j) в упаковке верхнего треугольника; (j, i) — та же ячейка."""
+        if i > j:
+            i, j = j, i
+        if i < 0 or j >= zones:
+            raise IndexError("list index out of range")
+        return i * zones - i * (i - 1) // 2 + (j - i)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        """
+        Распаковывает значение столбца. Матрица, сохранённая до упаковки (JSON), разбирается как список:
+        SQLite отдаёт такие значения строкой (столбец был TEXT) или байтами.
+        """
+        if isinstance(blob, str):
+            return cls.from_list(json.loads(blob))
+        blob = bytes(blob)
+        if not blob.startswith(PACKED_MAGIC):
+            return cls.from_list(json.loads(blob))
+        magic, version, itemsize, zones, tabs_length = _HEADER.unpack_from(blob)
+        if version != PACKED_VERSION or itemsize not in ITEM_TYPECODES:
+            raise ValueError(f"Неизвестный формат упакованной матрицы цен: версия {version}, ширина {itemsize}")
+        tabs_end = _HEADER.size + tabs_length
+        tabs_text = blob[_HEADER.size : tabs_end].decode("utf-8")
+        return cls(zones, tabs_text.split(_TABS_SEPARATOR) if tabs_text else (), itemsize, compressed=blob[tabs_end:])
+
+    def to_bytes(self):
+        tabs = _TABS_SEPARATOR.join(self.tabs).encode("utf-8")
+        header = _HEADER.pack(PACKED_MAGIC, PACKED_VERSION, self.itemsize, self.zones, len(tabs))
+        return header + tabs + self.compressed
+
+    def values(self):
+        """Хранимые значения (array int32 или int64) в порядке упаковки."""
+        values = array(ITEM_TYPECODES[self.itemsize])
+        values.frombytes(self.data)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    def digest(self):
+        """SHA-256 упакованного представления (для отпечатков содержимого маршрута); значения не распаковываются."""
+        return hashlib.sha256(self.to_bytes()).hexdigest()
+
+    def tolist(self):
+        """Новый список списков словарей; симметричные ячейки — один словарь."""
+        zones, tabs, missing = self.zones, self.tabs, self.missing
+        tabs_count = len(tabs)
+        values = self.values()
+        matrix = [[None] * zones for _ in range(zones)]
+        position = 0
+        for i in range(zones):
+            row = matrix[i]
+            for j in range(i, zones):
+                cell_values = values[position : position + tabs_count]
+                position += tabs_count
+                cell = {tab: value / PRICE_SCALE for tab, value in zip(tabs, cell_values, strict=True) if value != missing}
+                row[j] = cell
+                matrix[j][i] = cell
+        return matrix
+
+    def __len__(self):
+        return self.zones
+
+    def __getitem__(self, index):
+        if self._rows is None:
+            self._rows = self.tolist()
+        return self._rows[index]
+
+    def __eq__(self, other):
+        if isinstance(other, PriceMatrix):
+            if (self.zones, self.tabs, self.itemsize, self.data) == (other.zones, other.tabs, other.itemsize, other.data):
+                return True
+            other = other.tolist()
+        if isinstance(other, list):
+            return self.tolist() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # В другой процесс передаётся сжатое представление: оно в разы меньше
+        return PriceMatrix, (self.zones, self.tabs, self.itemsize, None, self.compressed)
+
+    def __repr__(self):
+        return f"<PriceMatrix zones={self.zones} tabs={len(self.tabs)}>"
+
+
+def price_matrix_as_list(value):
+    """Матрица цен в виде списков словарей (для JSON): PriceMatrix разворачивается, остальное возвращается как есть."""
+    if isinstance(value, PriceMatrix):
+        return value.tolist()
+    return value
+
+
+class PackedPriceMatrix(sa.types.TypeDecorator):
+    """Столбец матрицы цен: принимает PriceMatrix или список списков словарей, хранит упакованные байты."""
+
+    impl = sa.LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, PriceMatrix):
+            value = PriceMatrix.from_list(value)
+        return value.to_bytes()
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return PriceMatrix.from_bytes(value)
+
+
+def price_to_stored(price, scale=PRICE_SCALE):
+    """
+    Цена в хранимых единицах: price × scale, округлённое до целого (по умолчанию — тысячные доли рубля).
+    Целые и строки переводятся точно (строки — через Decimal), float — с округлением. Нечисловая цена — ValueError.
+    """
+    if isinstance(price, int):
+        stored = price * scale
+    elif isinstance(price, str):
+        try:
+            number = Decimal(price.strip())
+        except InvalidOperation as e:
+            raise ValueError(f"Цена должна быть числом: {price!r}") from e
+        if not number.is_finite():
+            raise ValueError(f"Цена должна быть числом: {price!r}")
+        stored = round(number * scale)
+    else:
+        try:
+            number = float(price)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Цена должна быть числом: {price!r}") from e
+        if not math.isfinite(number):
+            raise ValueError(f"Цена должна быть числом: {price!r}")
+        stored = round(number * scale)
+    if not -PRICE_LIMIT < stored < PRICE_LIMIT:
+        raise ValueError(f"Цена вне допустимого диапазона: {price!r}")
+    return stored
+
+
+def units_divisor(multiplier):
+    """Во сколько раз хранимая единица мельче единицы выгрузки с множителем multiplier (10 ** V)."""
+    if multiplier > PRICE_SCALE or PRICE_SCALE % multiplier:
+        raise ValueError(f"Точность цен больше {len(str(PRICE_SCALE)) - 1} знаков не поддерживается")
+    return PRICE_SCALE // multiplier
+
+
+def stored_to_units(stored, multiplier):
+    """Хранимая цена в единицах выгрузки (multiplier = 10 ** V): точное целочисленное деление, дробная часть отбрасывается."""
+    divisor = units_divisor(multiplier)
+    return stored // divisor if stored >= 0 else -(-stored // divisor)
+
+
+def _to_little_endian(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
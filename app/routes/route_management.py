@@ -1,30 +1,133 @@
 # ruff: disable[ERA001]
 import io
 import json
-from copy import deepcopy
-from datetime import datetime
+import os
+import zipfile
+from datetime import UTC, datetime
+from functools import partial
 from urllib.parse import parse_qs
 
 import sqlalchemy as sa
-from flask import Blueprint, abort, current_app, flash, redirect, render_template, request, send_file, url_for
+from flask import Blueprint, Response, abort, current_app, flash, jsonify, redirect, render_template, request, send_file, stream_with_context, url_for
 from flask_login import current_user, login_required
 from flask_wtf.csrf import generate_csrf
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.http import is_resource_modified
 
 from app import db
-from app.audit import log_action, serialize_route
-from app.forms import BulkGenerateForm, ImportRouteForm, RouteInfoForm, RoutePricesForm, RouteStopsForm
-from app.models import Route
-from app.utils import write_route_body_to_buffer
+from app.audit import build_audit_row, log_action, route_change_details, route_snapshot_details, serialize_route
+from app.cache import invalidate_route_bodies, invalidate_route_body
+from app.export import config_etag, format_config_header, get_export_executor, iter_bulk_config, iter_routes, iter_zip_config, render_route_body
+from app.forms import BulkGenerateForm, ImportRouteForm, RouteFilterForm, RouteInfoForm, RoutePricesForm, RouteStopsForm
+from app.history import parse_utc, route_state_at, route_state_owner, route_state_trfz
+from app.importer import find_imported_routes, import_trfz_routes, import_zip_routes
+from app.jobs import cleanup_export_artifacts, create_export_job, export_job_is_stale, export_job_status, fail_stale_export_jobs, submit_export_job
+from app.models import AuditLog, DeletedRoute, ExportJob, Route, defer_route_payload
+from app.prices import PriceMatrix
+from app.selection import count_routes, criteria_from_filter_form, export_conditions, filter_conditions_from_form, keyset_page, selection_conditions
+from app.trfz import trfz_content_hash
+from app.writer import insert_audit_rows, run_write
 
 bp = Blueprint("route_management", __name__)
 
+# Сколько ошибок разбора показывать пользователю после импорта
+IMPORT_ERRORS_SHOWN = 10
+# Сколько незаполненных маршрутов перечислять в сообщении о массовой выгрузке
+INCOMPLETE_ROUTES_SHOWN = 10
+# Массовые выгрузки в журнале: от выгрузок файлом отсчитывается инкрементальная выгрузка,
+# выборку любой из них можно повторить
+SNAPSHOT_EXPORT_ACTIONS = ("routes_bulk_config_generated", "routes_bulk_zip_generated")
+BULK_EXPORT_ACTIONS = (*SNAPSHOT_EXPORT_ACTIONS, "routes_bulk_export_job_created")
+# Сколько удалённых маршрутов перечислять в заголовке X-Deleted-Routes и в журнале выгрузки;
+# полный список отдаёт GET /routes/deleted?since=... (ссылка — в заголовке X-Deleted-Routes-Url)
+DELETED_ROUTES_LISTED = 100
+
+
+# --- Изменения маршрутов: выполняются через run_write (в режиме одного писателя — в потоке записи),
+# поэтому получают сессию последним аргументом и находят маршрут по ID.
+# Детали записей журнала дополняются здесь: версия маршрута и изменения (или снимок) по его состоянию в этой сессии.
+# Время записей ставится здесь же, а не в запросе: поток записи применяет изменения в порядке очереди,
+# и только так порядок времени в журнале совпадает с порядком версий (по нему route_state_at воспроизводит историю) ---
+def _written_audit_rows(audit_rows, details):
+    changed_at = datetime.now(UTC)
+    return [{**row, "created_at": changed_at, "details": {**row["details"], **details}} for row in audit_rows]
+
+
+def _create_route(values, audit_row, session):
+    route = Route(**values)
+    session.add(route)
+    session.flush()
+    insert_audit_rows([{**row, "route_id": route.id} for row in _written_audit_rows([audit_row], route_snapshot_details(route))], session)
+    return route.id
+
+
+def _update_route(route_id, values, audit_rows, session):
+    route = session.get_one(Route, route_id)
+    before = serialize_route(route)
+    for key, value in values.items():
+        setattr(route, key, value)
+    session.flush()
+    insert_audit_rows(_written_audit_rows(audit_rows, route_change_details(before, route)), session)
+
+
+def _save_route_changes(route_id, values, audit_rows):
+    """
+    Сохраняет изменения маршрута через run_write. UPDATE проверяет версию маршрута (version_id_col): если маршрут
+    успел изменить другой запрос, изменения не записываются — иначе история строилась бы от устаревшего состояния.
+    Возвращает False, если сохранение отклонено (сообщение уже показано через flash).
+    """
+    try:
+        run_write(partial(_update_route, route_id, values, audit_rows))
+    except StaleDataError:
+        db.session.rollback()
+        flash("Маршрут уже изменён в другом окне или другим пользователем. Изменения не сохранены: проверьте данные и повторите.", "warning")
+        return False
+    return True
+
+
+def _delete_route(route_id, audit_rows, session):
+    route = session.get_one(Route, route_id)
+    # Состояние до удаления восстанавливается по истории изменений, снимок не нужен
+    details = {"version": route.version, "route_number": route.route_number, "user_id": route.user_id}
+    session.delete(route)
+    session.add(DeletedRoute(route_id=route.id, user_id=route.user_id, route_number=route.route_number))
+    insert_audit_rows(_written_audit_rows(audit_rows, details), session)
+
+
+# Импорт целиком выполняется одной транзакцией записи; при повторе функции потоком записи файл читается с начала
+def _import_file(stream, user_id, import_hash, audit_row, session):
+    stream.seek(0)
+    return import_trfz_routes(stream, user_id, import_hash=import_hash, audit_row=audit_row, session=session)
+
+
+def _import_archive(stream, user_id, options, audit_row, session):
+    stream.seek(0)
+    return import_zip_routes(stream, user_id, **options, audit_row=audit_row, session=session)
+
 
 @bp.route("/routes")
 @login_required
 def route_list():
     # routes = Route.query.filter_by(user_id=current_user.id).all()
     # return render_template('route_list.html', routes=routes)
-    routes = Route.query.filter_by(user_id=current_user.id).all()
+    # Фильтры, сортировка и курсор страницы приходят GET-параметрами; неверные значения фильтров сбрасываются
+    filter_form = RouteFilterForm(request.args)
+    if not filter_form.validate():
+        filter_form = RouteFilterForm(formdata=None)
+    conditions = filter_conditions_from_form(current_user.id, filter_form)
+
+    # Остановки, тарифы и матрица цен списку не нужны: счётчики хранятся в отдельных столбцах
+    query = sa.select(Route).where(*conditions).options(*defer_route_payload())
+    try:
+        page = keyset_page(query, filter_form.sort.data, filter_form.after.data, filter_form.before.data, current_app.config["ROUTES_PER_PAGE"])
+    except ValueError:
+        # Испорченный курсор — показываем первую страницу
+        page = keyset_page(query, filter_form.sort.data, per_page=current_app.config["ROUTES_PER_PAGE"])
+    routes = page.routes
+    matching_count = count_routes(conditions)
+    # Параметры фильтра для ссылок на соседние страницы (пустые не передаём)
+    filter_args = {name: filter_form[name].data for name in ("transport", "region", "status", "sort") if filter_form[name].data}
+    has_routes = bool(routes) or db.session.scalar(sa.select(Route.id).where(Route.user_id == current_user.id).limit(1)) is not None
 
     # Явно передаем CSRF-токен в шаблон
     # Используем функцию generate_csrf(), чтобы получить строковое значение токена.
@@ -57,6 +160,11 @@ def route_list():
         #    TRANSPORT_TYPES=TRANSPORT_TYPE_CHOICES,
         csrf_token=csrf_token,  # Это нужно для формы
         bulk_form=bulk_form,
+        filter_form=filter_form,
+        page=page,
+        filter_args=filter_args,
+        matching_count=matching_count,
+        has_routes=has_routes,
     )  # <-- ПЕРЕДАЕМ НОВУЮ ФОРМУ
 
     # return render_template('route_list.html', routes=routes, csrf_token=csrf_token)
@@ -142,53 +250,42 @@ def create_or_edit_route_info(route_id):
 
         if route is None:
             # --- Создание нового объекта Route ---
-            new_route = Route(user_id=current_user.id, stops=[], price_matrix=[], **data_to_save)
-            db.session.add(new_route)
-            db.session.flush()
-            log_action(
-                action="route_created",
-                entity_type="route",
-                route_id=new_route.id,
-                details={"after": serialize_route(new_route)},
-            )
-            db.session.commit()
+            values = {"user_id": current_user.id, "stops": [], "price_matrix": [], **data_to_save}
+            new_route_id = run_write(partial(_create_route, values, build_audit_row("route_created", "route")))
 
             flash(
                 "Общая информация сохранена. Перейдите к добавлению остановок.",
                 "success",
             )
             # Переход к Шагу 2
-            return redirect(url_for("route_management.edit_route_stops", route_id=new_route.id))
+            return redirect(url_for("route_management.edit_route_stops", route_id=new_route_id))
 
         else:
             # --- Обновление существующего объекта Route ---
 
             # 1. Запоминаем критические состояния ДО обновления
-            before_snapshot = serialize_route(route)
             old_transport_type = route.transport_type
             old_tariffs = route.tariff_tables  # Это список словарей JSON
 
-            # 2. Обновляем поля
-            for key, value in data_to_save.items():
-                setattr(route, key, value)
-
-            # 3. ЛОГИКА УМНОГО СБРОСА
+            # 2. ЛОГИКА УМНОГО СБРОСА
             # Сравниваем тип транспорта и состав тарифных таблиц
             # В Python списки словарей (tariff_tables_data vs old_tariffs) сравниваются глубоко по значениям
             if old_transport_type != form.transport_type.data or old_tariffs != tariff_tables_data:
-                route.is_completed = False  # Матрица цен теперь требует перепроверки
+                data_to_save["is_completed"] = False  # Матрица цен теперь требует перепроверки
                 flash(
                     "Структура тарифов или тип транспорта изменились. Пожалуйста, проверьте цены на Шаге 3.",
                     "info",
                 )
 
-            log_action(
+            # 3. Обновляем поля
+            audit_row = build_audit_row(
                 action="route_info_updated",
                 entity_type="route",
                 route_id=route.id,
-                details={"before": before_snapshot, "after": serialize_route(route)},
             )
-            db.session.commit()
+            if not _save_route_changes(route.id, data_to_save, [audit_row]):
+                return redirect(request.url)
+            invalidate_route_body(route.id)
             flash("Изменения сохранены.", "success")
             # Переход к Шагу 2
             return redirect(url_for("route_management.edit_route_stops", route_id=route.id))
@@ -248,26 +345,19 @@ def edit_route_stops(route_id):
             new_stop_data.append({"name": name, "km": f"{km:.2f}"})
 
         # ЛОГИКА УМНОГО СБРОСА
-        before_stops = deepcopy(route.stops)
-        before_is_completed = route.is_completed
+        after_is_completed = route.is_completed
         if route.stops != new_stop_data:
-            route.is_completed = False
+            after_is_completed = False
             flash("Состав остановок изменился. Пожалуйста, проверьте цены.", "warning")
 
-        route.stops = new_stop_data
-        route.stops_set = True
-        log_action(
+        audit_row = build_audit_row(
             action="route_stops_updated",
             entity_type="route",
             route_id=route.id,
-            details={
-                "before_stops": before_stops,
-                "after_stops": new_stop_data,
-                "before_is_completed": before_is_completed,
-                "after_is_completed": route.is_completed,
-            },
         )
-        db.session.commit()
+        if not _save_route_changes(route.id, {"stops": new_stop_data, "stops_set": True, "is_completed": after_is_completed}, [audit_row]):
+            return redirect(request.url)
+        invalidate_route_body(route.id)
 
         flash("Остановки сохранены.", "success")
         return redirect(url_for("route_management.edit_route_prices", route_id=route.id))
@@ -412,17 +502,17 @@ def edit_route_prices(route_id):
             new_matrix = json.loads(cleaned_string)
 
             if isinstance(new_matrix, list):
-                before_matrix = deepcopy(route.price_matrix)
-                route.price_matrix = new_matrix
-                route.is_completed = True
+                # Упаковка проверяет цены до записи: нечисловое значение — ValueError
+                price_matrix = PriceMatrix.from_list(new_matrix)
 
-                log_action(
+                audit_row = build_audit_row(
                     action="route_prices_updated",
                     entity_type="route",
                     route_id=route.id,
-                    details={"before_price_matrix": before_matrix, "after_price_matrix": new_matrix},
                 )
-                db.session.commit()
+                if not _save_route_changes(route.id, {"price_matrix": price_matrix, "is_completed": True}, [audit_row]):
+                    return redirect(request.url)
+                invalidate_route_body(route.id)
                 flash("Цены успешно сохранены!", "success")
                 return redirect(url_for("route_management.route_list"))
             else:
@@ -436,6 +526,9 @@ def edit_route_prices(route_id):
                 (cleaned_string[:200] if "cleaned_string" in locals() else ""),
             )
             flash("Ошибка при обработке данных цен. Пожалуйста, проверьте ввод.", "danger")
+        except ValueError as e:
+            current_app.logger.error("DEBUG (PY): Неверная цена в матрице: %s", e)
+            flash("Цены должны быть числами. Пожалуйста, проверьте ввод.", "danger")
         except Exception as e:
             current_app.logger.exception("DEBUG (PY): Общая ошибка при сохранении цен: %s", e)
             flash("Произошла непредвиденная ошибка при сохранении цен.", "danger")
@@ -475,15 +568,9 @@ def delete_route(route_id):
 
     # 3. Удаление из базы данных
     try:
-        before_snapshot = serialize_route(route)
-        db.session.delete(route)
-        log_action(
-            action="route_deleted",
-            entity_type="route",
-            route_id=before_snapshot["id"],
-            details={"before": before_snapshot},
-        )
-        db.session.commit()
+        audit_row = build_audit_row(action="route_deleted", entity_type="route", route_id=route.id)
+        run_write(partial(_delete_route, route.id, [audit_row]))
+        invalidate_route_body(route_id)
         flash(f'Маршрут "{route.route_name}" успешно удален.', "success")
     except Exception as e:
         db.session.rollback()
@@ -497,47 +584,71 @@ def delete_route(route_id):
 @bp.route("/route/<int:route_id>/generate_config")
 @login_required
 def generate_config(route_id):
-    # 1. Загружаем маршрут
-    route = db.session.scalar(sa.select(Route).where(Route.id == route_id, Route.user_id == current_user.id))
-    if not route:
+    # 1. Загружаем только поля шапки и ревизию: этого достаточно, чтобы ответить 304 без чтения JSON-полей
+    meta = db.session.execute(
+        sa.select(
+            Route.id,
+            Route.is_completed,
+            Route.version,
+            Route.updated_at,
+            Route.region_code,
+            Route.carrier_id,
+            Route.unit_id,
+            Route.decimal_places,
+        ).where(Route.id == route_id, Route.user_id == current_user.id)
+    ).first()
+    if not meta:
         flash("Маршрут не найден.", "danger")
         return redirect(url_for("route_management.route_list"))
 
     # Проверка завершённости маршрута
-    if not route.is_completed:
+    if not meta.is_completed:
         flash(
             "Маршрут не готов к экспорту. Пожалуйста, заполните все шаги (Остановки и Цены) перед генерацией файла.",
             "danger",
         )
         # Перенаправляем на страницу редактирования остановок, чтобы пользователь видел, что нужно завершить работу
-        return redirect(url_for("route_management.edit_route_stops", route_id=route.id))
+        return redirect(url_for("route_management.edit_route_stops", route_id=meta.id))
+
+    now = datetime.now()
+    current_date = now.strftime("%y%m%d")
+    # ==========================================
+    # 1. ЗАГОЛОВОК ФАЙЛА
+    # RR;TTTT;DDDD;YYMMDD;V
+    # ==========================================
+    # RR - Код региона (2 знака)
+    # TTTT - Код оператора (4 знака)
+    # DDDD - Код подразделения (4 знака)
+    # YYMMDD - Текущая дата
+    # V - Кол-во знаков после запятой (decimal_places)
+
+    # Форматируем с ведущими нулями (zfill)
+    v = str(meta.decimal_places)
+    header_line = format_config_header(meta.region_code, meta.carrier_id, meta.unit_id, current_date, v)
+
+    # Условный GET: файл меняется при изменении маршрута и со сменой даты в шапке
+    etag = config_etag(meta.id, meta.version, header_line)
+    updated_at = meta.updated_at if meta.updated_at.tzinfo else meta.updated_at.replace(tzinfo=UTC)
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0).astimezone(UTC)
+    last_modified = max(updated_at, day_start)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    route = db.session.get(Route, meta.id)
 
     # Создаем буфер в памяти для записи байтов
     buffer = io.BytesIO()
 
     try:
-        current_date = datetime.now().strftime("%y%m%d")
-        # ==========================================
-        # 1. ЗАГОЛОВОК ФАЙЛА
-        # RR;TTTT;DDDD;YYMMDD;V
-        # ==========================================
-        # RR - Код региона (2 знака)
-        # TTTT - Код оператора (4 знака)
-        # DDDD - Код подразделения (4 знака)
-        # YYMMDD - Текущая дата
-        # V - Кол-во знаков после запятой (decimal_places)
-
-        # Форматируем с ведущими нулями (zfill)
-        rr = str(route.region_code).zfill(2)
-        tttt = str(route.carrier_id).zfill(4)
-        dddd = str(route.unit_id).zfill(4)
-        v = str(route.decimal_places)
-
-        # Пишем шапку вручную (или создайте write_line внутри)
-        buffer.write(f"{rr};{tttt};{dddd};{current_date};{v}\r\n".encode("cp866"))
-
-        # Тело (используем общую функцию)
-        write_route_body_to_buffer(buffer, route, v)
+        buffer.write(f"{header_line}\r\n".encode("cp866"))
+
+        # Тело (используем общую функцию, с кэшем отрисованных тел)
+        buffer.write(render_route_body(route, v))
 
         # Подготовка к отправке
         buffer.seek(0)
@@ -552,22 +663,24 @@ def generate_config(route_id):
         )
         db.session.commit()
 
-        return send_file(buffer, as_attachment=True, download_name=filename, mimetype="text/plain")
+        response = send_file(buffer, as_attachment=True, download_name=filename, mimetype="text/plain", etag=etag, last_modified=last_modified)
+        # Клиент может хранить файл, но обязан перепроверять его актуальность
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
 
     except Exception as e:
         flash(f"Ошибка: {e}", "danger")
         return redirect(url_for("route_management.route_list"))
 
 
-# --- Генерация файла конфигурации для нескольких маршрутов ---
-@bp.route("/routes/generate_bulk_config", methods=["POST"])
-@login_required
-def generate_bulk_config():
-    # 1. Получаем список ID выбранных маршрутов из формы
-    # В HTML чекбоксы будут иметь name="route_ids"
-    route_ids = request.form.getlist("route_ids")
-
-    # 2. Инициализируем и валидируем форму шапки
+def _validate_bulk_selection():
+    """
+    Проверяет параметры шапки и выбранные маршруты массовой выгрузки.
+    Выборка задаётся отмеченными ID, фильтрами списка (select_all) или выборкой прошлой выгрузки (selection_export).
+    Возвращает (bulk_form, criteria, routes_count) или None, если выгрузка невозможна (сообщение уже показано через flash).
+    """
+    # 1. Инициализируем и валидируем форму шапки
     # Если форма не пройдет валидацию, мы не сможем получить ее данные (data)
     bulk_form = BulkGenerateForm(request.form)
 
@@ -576,72 +689,195 @@ def generate_bulk_config():
         # Сохраняем сообщение об ошибке (например, для первой ошибки)
         first_error = next(iter(bulk_form.errors.values()))[0]
         flash(f"Ошибка в параметрах шапки: {first_error}", "danger")
+        return None
+
+    # 2. Критерии выборки: маршруты находятся на сервере, список ID всех подходящих маршрутов не передаётся
+    if bulk_form.selection_export.data:
+        criteria = _saved_selection(bulk_form.selection_export.data)
+        if criteria is None:
+            return None
+    elif request.form.get("select_all") == "1":
+        # «Выбрать все подходящие под фильтр»: вместо списка ID приходят фильтры страницы
+        filter_form = RouteFilterForm(request.form)
+        if not filter_form.validate():
+            flash("Неверные параметры фильтра.", "danger")
+            return None
+        criteria = criteria_from_filter_form(filter_form)
+    else:
+        # В HTML чекбоксы будут иметь name="route_ids"
+        route_ids = request.form.getlist("route_ids")
+        if not route_ids:
+            flash("Не выбрано ни одного маршрута.", "warning")
+            return None
+        try:
+            criteria = {"route_ids": sorted({int(route_id) for route_id in route_ids})}
+        except ValueError:
+            flash("Маршруты не найдены.", "danger")
+            return None
 
-        # Перенаправляем обратно на список маршрутов (GET)
-        return redirect(url_for("route_management.route_list"))
-
-    if not route_ids:
-        flash("Не выбрано ни одного маршрута.", "warning")
-        return redirect(url_for("route_management.route_list"))
-
-    # 3. Загружаем маршруты из БД (проверяя, что они принадлежат user_id)
-    # Используем .in_(route_ids) для фильтрации
-    query = sa.select(Route).where(Route.id.in_(route_ids), Route.user_id == current_user.id)
-    routes = db.session.scalars(query).all()
+    # 3. Проверяем выбранные маршруты (принадлежат user_id) запросами COUNT, не читая сами маршруты
+    conditions = selection_conditions(current_user.id, criteria)
+    routes_count = count_routes(conditions)
 
-    if not routes:
+    if not routes_count:
         flash("Маршруты не найдены.", "danger")
-        return redirect(url_for("route_management.route_list"))
+        return None
 
     # 4. Валидация: Проверяем флаг is_completed
-    incomplete_routes = [r.route_name for r in routes if not r.is_completed]
-
-    if incomplete_routes:
+    incomplete = [*conditions, Route.is_completed.is_not(True)]
+    incomplete_count = count_routes(incomplete)
+
+    if incomplete_count:
+        incomplete_routes = db.session.scalars(sa.select(Route.route_name).where(*incomplete).order_by(Route.id).limit(INCOMPLETE_ROUTES_SHOWN)).all()
+        names = ", ".join(incomplete_routes)
+        if incomplete_count > INCOMPLETE_ROUTES_SHOWN:
+            names += f" и ещё {incomplete_count - INCOMPLETE_ROUTES_SHOWN}"
         flash(
-            f"Ошибка! Следующие маршруты не заполнены до конца: {', '.join(incomplete_routes)}. Заполните их перед генерацией.",
+            f"Ошибка! Следующие маршруты не заполнены до конца: {names}. Заполните их перед генерацией.",
             "danger",
         )
+        return None
+
+    return bulk_form, criteria, routes_count
+
+
+def _find_bulk_export(export_id):
+    """Запись журнала о массовой выгрузке текущего пользователя или None."""
+    return db.session.scalar(
+        sa.select(AuditLog).where(
+            AuditLog.id == export_id,
+            AuditLog.user_id == current_user.id,
+            AuditLog.action.in_(BULK_EXPORT_ACTIONS),
+        )
+    )
+
+
+def _saved_selection(export_id):
+    """Критерии выборки прошлой выгрузки (для выгрузок до появления критериев — её список ID) или None."""
+    previous = _find_bulk_export(export_id)
+    details = (previous.details or {}) if previous is not None else {}
+    if "selection" in details:
+        return details["selection"]
+    if "route_ids" in details:
+        return {"route_ids": details["route_ids"]}
+    flash(f"Выгрузка №{export_id} не найдена.", "danger")
+    return None
+
+
+def _resolve_since(bulk_form):
+    """
+    Граница инкрементальной выгрузки (UTC) по полям since / since_export формы.
+    Возвращает (True, since) — since=None означает полную выгрузку — или (False, None), если
+    предыдущая выгрузка не найдена (сообщение уже показано через flash).
+    """
+    bounds = []
+    if bulk_form.since.data:
+        # Поле datetime-local приходит в локальном времени сервера
+        bounds.append(bulk_form.since.data.astimezone(UTC))
+
+    if bulk_form.since_export.data:
+        previous = _find_bulk_export(bulk_form.since_export.data)
+        if previous is None or previous.action not in SNAPSHOT_EXPORT_ACTIONS:
+            flash(f"Выгрузка №{bulk_form.since_export.data} не найдена.", "danger")
+            return False, None
+        bounds.append(parse_utc((previous.details or {}).get("snapshot_at") or previous.created_at))
+
+    return True, max(bounds, default=None)
+
+
+def _incremental_selection(criteria, routes_count, since):
+    """
+    Условия выборки завершённых маршрутов с учётом since (только изменённые после него), число выгружаемых маршрутов,
+    число маршрутов пользователя, удалённых после since, и ID первых DELETED_ROUTES_LISTED из них.
+    """
+    conditions = export_conditions(current_user.id, criteria, since)
+    if since is None:
+        return conditions, routes_count, 0, []
+    deleted_filter = (DeletedRoute.user_id == current_user.id, DeletedRoute.deleted_at > since)
+    deleted_count = db.session.scalar(sa.select(sa.func.count()).select_from(DeletedRoute).where(*deleted_filter))
+    deleted_ids = db.session.scalars(sa.select(DeletedRoute.route_id).where(*deleted_filter).order_by(DeletedRoute.deleted_at, DeletedRoute.id).limit(DELETED_ROUTES_LISTED)).all()
+    return conditions, count_routes(conditions), deleted_count, deleted_ids
+
+
+def _set_export_headers(response, export_log, snapshot_at, since, deleted_count, deleted_ids):
+    """
+    Номер выгрузки (для следующей инкрементальной) и, при инкрементальной выгрузке, удалённые маршруты:
+    их число и ссылка на полный список, а сам список — только если он не длиннее DELETED_ROUTES_LISTED.
+    """
+    response.headers["X-Export-Id"] = str(export_log.id)
+    response.headers["X-Export-Snapshot"] = snapshot_at.isoformat()
+    if since is not None:
+        response.headers["X-Export-Since"] = since.isoformat()
+        response.headers["X-Deleted-Routes-Count"] = str(deleted_count)
+        response.headers["X-Deleted-Routes-Url"] = url_for("route_management.deleted_routes", since=since.isoformat())
+        if deleted_count <= DELETED_ROUTES_LISTED:
+            response.headers["X-Deleted-Routes"] = ",".join(map(str, deleted_ids))
+
+
+# --- Генерация файла конфигурации для нескольких маршрутов ---
+@bp.route("/routes/generate_bulk_config", methods=["POST"])
+@login_required
+def generate_bulk_config():
+    # Момент среза фиксируем до чтения маршрутов: изменения после него попадут в следующую инкрементальную выгрузку
+    snapshot_at = datetime.now(UTC)
+    validated = _validate_bulk_selection()
+    if validated is None:
+        # Перенаправляем обратно на список маршрутов (GET)
         return redirect(url_for("route_management.route_list"))
+    bulk_form, criteria, routes_count = validated
+
+    found, since = _resolve_since(bulk_form)
+    if not found:
+        return redirect(url_for("route_management.route_list"))
+    conditions, routes_count, deleted_count, deleted_ids = _incremental_selection(criteria, routes_count, since)
 
     # Получаем значение точности цен из формы для использования в шапке и теле
     decimal_places_value = bulk_form.decimal_places.data  # Значение V (0, 1 или 2)
 
-    # 5. Генерация файла
-    buffer = io.BytesIO()
-
-    # Вспомогательная функция для записи одной строки (для шапки)
-    def write_line(text):
-        buffer.write((text + "\r\n").encode("cp866", errors="replace"))
-
+    # 5. Генерация файла: шапка и тела маршрутов отдаются клиенту потоково,
+    # маршруты подгружаются из БД порциями по мере отправки
     try:
         # --- ШАПКА ФАЙЛА (Берем данные из bulk_form.data) ---
         current_date = datetime.now().strftime("%y%m%d")
 
         # ИСПОЛЬЗУЕМ ДАННЫЕ ИЗ ФОРМЫ (ОНИ УЖЕ ОТФИЛЬТРОВАНЫ и ВАЛИДИРОВАНЫ)
-        rr = bulk_form.region_code.data
-        tttt = bulk_form.carrier_id.data
-        dddd = bulk_form.unit_id.data
-        v = decimal_places_value
-
-        header_line = f"{rr};{tttt};{dddd};{current_date};{v}"
-        write_line(header_line)
-
-        # --- ТЕЛА МАРШРУТОВ ---
-        for route in routes:
-            # Используем нашу функцию рефакторинга
-            write_route_body_to_buffer(buffer, route, decimal_places_value)
+        header_line = format_config_header(
+            bulk_form.region_code.data,
+            bulk_form.carrier_id.data,
+            bulk_form.unit_id.data,
+            current_date,
+            decimal_places_value,
+        )
 
-        # --- ОТПРАВКА ---
-        buffer.seek(0)
-        filename = f"TRFZ_BULK_{current_date}_({len(routes)}routes).txt"
-        log_action(
+        filename = f"TRFZ_BULK_{current_date}_({routes_count}routes).txt"
+        export_log = log_action(
             action="routes_bulk_config_generated",
             entity_type="route",
-            details={"filename": filename, "route_ids": [route.id for route in routes]},
+            details={
+                "filename": filename,
+                "selection": criteria,
+                "routes_count": routes_count,
+                "snapshot_at": snapshot_at.isoformat(),
+                "since": since.isoformat() if since else None,
+                "deleted_routes_count": deleted_count,
+                "deleted_route_ids": deleted_ids,
+            },
+            # Номер выгрузки нужен сразу (X-Export-Id), поэтому запись синхронная
+            sync=True,
         )
         db.session.commit()
 
-        return send_file(buffer, as_attachment=True, download_name=filename, mimetype="text/plain")
+        # --- ТЕЛА МАРШРУТОВ ---
+        # Большие выборки отрисовываются в пуле процессов (если он включён), порядок маршрутов сохраняется
+        executor = get_export_executor() if routes_count >= current_app.config["EXPORT_PARALLEL_MIN_ROUTES"] else None
+        routes_query = sa.select(Route).where(*conditions).order_by(Route.id)
+        body = iter_bulk_config(header_line, iter_routes(routes_query), decimal_places_value, executor=executor)
+
+        # --- ОТПРАВКА ---
+        response = Response(stream_with_context(body), mimetype="text/plain")
+        response.headers.set("Content-Disposition", "attachment", filename=filename)
+        _set_export_headers(response, export_log, snapshot_at, since, deleted_count, deleted_ids)
+        return response
 
     except Exception as e:
         print(f"Error generating bulk config: {e}")
@@ -649,125 +885,221 @@ def generate_bulk_config():
         return redirect(url_for("route_management.route_list"))
 
 
-# Импорт маршрута
-@bp.route("/route/import", methods=["GET", "POST"])
+# --- Выгрузка ZIP-архивом: отдельный файл конфигурации на каждый маршрут ---
+@bp.route("/routes/generate_bulk_zip", methods=["POST"])
 @login_required
-def import_route():
-    form = ImportRouteForm()
-    if form.validate_on_submit():
-        file = form.route_file.data
-        try:
-            raw_data = file.read()
+def generate_bulk_zip():
+    snapshot_at = datetime.now(UTC)
+    validated = _validate_bulk_selection()
+    if validated is None:
+        return redirect(url_for("route_management.route_list"))
+    bulk_form, criteria, routes_count = validated
 
-            # --- ОПРЕДЕЛЕНИЕ КОДИРОВКИ ---
-            # Пробуем декодировать как UTF-8, если не выйдет — берем CP866
-            try:
-                content = raw_data.decode("utf-8")
-            except UnicodeDecodeError:
-                content = raw_data.decode("cp866", errors="replace")
+    found, since = _resolve_since(bulk_form)
+    if not found:
+        return redirect(url_for("route_management.route_list"))
+    conditions, routes_count, deleted_count, deleted_ids = _incremental_selection(criteria, routes_count, since)
+
+    current_date = datetime.now().strftime("%y%m%d")
+    filename = f"TRFZ_BULK_{current_date}_({routes_count}routes).zip"
+    export_log = log_action(
+        action="routes_bulk_zip_generated",
+        entity_type="route",
+        details={
+            "filename": filename,
+            "selection": criteria,
+            "routes_count": routes_count,
+            "compression": bulk_form.zip_compression.data,
+            "snapshot_at": snapshot_at.isoformat(),
+            "since": since.isoformat() if since else None,
+            "deleted_routes_count": deleted_count,
+            "deleted_route_ids": deleted_ids,
+        },
+        sync=True,
+    )
+    db.session.commit()
 
-            lines = [line.strip() for line in content.splitlines() if line.strip()]
+    # Шапка и точность цен в каждом файле берутся из самого маршрута, как при выгрузке одного маршрута
+    executor = get_export_executor() if routes_count >= current_app.config["EXPORT_PARALLEL_MIN_ROUTES"] else None
+    routes_query = sa.select(Route).where(*conditions).order_by(Route.id)
+    body = iter_zip_config(iter_routes(routes_query), current_date, compression=bulk_form.zip_compression.data, executor=executor)
 
-            if len(lines) < 2:
-                flash("Файл пуст или имеет неверный формат", "danger")
-                return redirect(request.url)
+    response = Response(stream_with_context(body), mimetype="application/zip")
+    response.headers.set("Content-Disposition", "attachment", filename=filename)
+    _set_export_headers(response, export_log, snapshot_at, since, deleted_count, deleted_ids)
+    return response
 
-            # --- 1. ПАРСИНГ ШАПКИ ---
-            header = lines[0].split(";")
-            dec_places = int(header[4])
-            multiplier = 10**dec_places
-
-            # --- 2. ПАРСИНГ R-СТРОКИ ---
-            r_line = lines[1].split(";")
-            r_number = r_line[1]
-            # Убираем возможные артефакты кодировки из названия
-            r_name = r_line[4].strip()
-            zones_count = int(r_line[3])
-            tabs_count = int(r_line[5])
-
-            # --- 3. ИНИЦИАЛИЗАЦИЯ МАРШРУТА ---
-            new_route = Route(
-                user_id=current_user.id,
-                route_name=r_name,
-                route_number=r_number,
-                region_code=header[0],
-                carrier_id=header[1],
-                unit_id=header[2],
-                transport_type=f"0x{r_line[2]}" if not r_line[2].startswith("0x") else r_line[2],
-                decimal_places=dec_places,
-                stops=[],
-                tariff_tables=[],
-                price_matrix=[],
-                stops_set=True,
-                is_completed=True,
-            )
 
-            # --- 4. ОСТАНОВКИ ---
-            stop_lines = lines[2 : 2 + zones_count]
-            for sl in stop_lines:
-                parts = sl.split(";")
-                new_route.stops.append({"name": parts[2], "km": parts[1]})
-
-            # --- 5. ТАРИФНЫЕ ТАБЛИЦЫ ---
-            tabs_start = 2 + zones_count
-            tab_lines = lines[tabs_start : tabs_start + tabs_count]
-            tab_ids = []
-
-            new_route.tariff_tables = []
-
-            for index, tl in enumerate(tab_lines, start=1):
-                parts = tl.split(";")
-                tab_no = int(parts[0])
-                raw_ss_string = parts[2]
-
-                # Парсим список кодов для поля parsed_ss_codes_list
-                ss_list = [c.strip() for c in raw_ss_string.split(";") if c.strip()]
-
-                # Формируем словарь строго по структуре "Шага 1"
-                new_route.tariff_tables.append(
-                    {
-                        "tab_number": tab_no,
-                        "tariff_name": f"Тариф {index}",
-                        "table_type_code": parts[1],
-                        "ss_series_codes": raw_ss_string,
-                        "parsed_ss_codes_list": ss_list,
-                    }
-                )
-                tab_ids.append(str(tab_no))
+# --- Маршруты, удалённые после заданного момента (для сверки на стороне получателя выгрузок) ---
+@bp.route("/routes/deleted")
+@login_required
+def deleted_routes():
+    since_arg = request.args.get("since")
+    try:
+        since = parse_utc(since_arg) if since_arg else None
+    except ValueError:
+        return jsonify({"error": "Параметр since должен быть в формате ISO 8601."}), 400
+
+    query = sa.select(DeletedRoute).where(DeletedRoute.user_id == current_user.id)
+    if since is not None:
+        query = query.where(DeletedRoute.deleted_at > since)
+    deleted = db.session.scalars(query.order_by(DeletedRoute.deleted_at, DeletedRoute.id)).all()
+    return jsonify(
+        {
+            "since": since.isoformat() if since else None,
+            "deleted": [{"route_id": d.route_id, "route_number": d.route_number, "deleted_at": parse_utc(d.deleted_at).isoformat()} for d in deleted],
+        }
+    )
 
-            # --- 6. МАТРИЦА ЦЕН ---
-            matrix = [[{} for _ in range(zones_count)] for _ in range(zones_count)]
-            price_lines = lines[tabs_start + tabs_count :]
 
-            for ml in price_lines:
-                parts = ml.split(";")
-                if len(parts) < 3:
-                    continue
+# --- Маршрут на заданный момент, восстановленный по журналу аудита (JSON или файл TRFZ) ---
+@bp.route("/route/<int:route_id>/history")
+@login_required
+def route_history(route_id):
+    at_arg = request.args.get("at")
+    try:
+        moment = parse_utc(at_arg) if at_arg else datetime.now(UTC)
+    except ValueError:
+        return jsonify({"error": "Параметр at должен быть в формате ISO 8601."}), 400
+
+    # Владелец проверяется для той жизни маршрута, к которой относится состояние, а не по текущему маршруту
+    # с этим ID: SQLite мог выдать ID удалённого маршрута другому пользователю
+    state = route_state_at(route_id, moment)
+    if state is None or (route_state_owner(route_id, state) != current_user.id and not current_user.is_admin):
+        return jsonify({"error": "Нет истории маршрута на этот момент."}), 404
+
+    if request.args.get("format") == "trfz":
+        if state.snapshot is None:
+            return jsonify({"error": "К этому моменту маршрут удалён."}), 404
+        filename = f"TRFZ_{state.snapshot['route_number']}_{moment.strftime('%y%m%d')}_v{state.version or 0}.txt"
+        return send_file(io.BytesIO(route_state_trfz(state.snapshot, moment)), as_attachment=True, download_name=filename, mimetype="text/plain")
+
+    return jsonify(
+        {
+            "route_id": route_id,
+            "at": moment.isoformat(),
+            "changed_at": parse_utc(state.changed_at).isoformat(),
+            "version": state.version,
+            "deleted": state.snapshot is None,
+            "route": state.snapshot,
+        }
+    )
 
-                i, j = int(parts[0]), int(parts[1])
-                prices = parts[2:]
 
-                cell_data = {}
-                for idx, p_val in enumerate(prices):
-                    if idx < len(tab_ids):
-                        t_id = tab_ids[idx]
-                        cell_data[t_id] = float(p_val) / multiplier
+# --- Фоновая массовая выгрузка: задание, опрос прогресса и скачивание результата ---
+@bp.route("/routes/export_jobs", methods=["POST"])
+@login_required
+def create_bulk_export_job():
+    validated = _validate_bulk_selection()
+    if validated is None:
+        return redirect(url_for("route_management.route_list"))
+    bulk_form, criteria, routes_count = validated
+
+    # Заодно освобождаем место от устаревших файлов прошлых выгрузок
+    cleanup_export_artifacts()
+
+    job_id = run_write(
+        partial(
+            create_export_job,
+            current_user.id,
+            criteria,
+            routes_count,
+            bulk_form.region_code.data,
+            bulk_form.carrier_id.data,
+            bulk_form.unit_id.data,
+            bulk_form.decimal_places.data,
+        )
+    )
+    log_action(
+        action="routes_bulk_export_job_created",
+        entity_type="route",
+        details={"job_id": job_id, "selection": criteria, "routes_count": routes_count},
+    )
+    db.session.commit()
 
-                matrix[i][j] = cell_data
-                matrix[j][i] = cell_data
+    submit_export_job(job_id)
+    return redirect(url_for("route_management.export_job_page", job_id=job_id))
 
-            new_route.price_matrix = matrix
 
-            db.session.add(new_route)
-            db.session.flush()
-            log_action(
-                action="route_imported",
-                entity_type="route",
-                route_id=new_route.id,
-                details={"after": serialize_route(new_route)},
-            )
-            db.session.commit()
-            flash(f'Маршрут "{r_name}" успешно импортирован!', "success")
+def _get_own_export_job(job_id):
+    job = db.session.get(ExportJob, job_id)
+    if job is None or job.user_id != current_user.id:
+        abort(404)
+    return job
+
+
+def _get_active_export_job(job_id):
+    # Задание, брошенное при перезапуске, помечается failed, чтобы страница перестала опрашивать прогресс
+    job = _get_own_export_job(job_id)
+    if export_job_is_stale(job):
+        fail_stale_export_jobs()
+        db.session.refresh(job)
+    return job
+
+
+@bp.route("/routes/export_jobs/<int:job_id>")
+@login_required
+def export_job_page(job_id):
+    job = _get_active_export_job(job_id)
+    return render_template("export_job.html", job=job, status=export_job_status(job), title=f"Выгрузка №{job.id}")
+
+
+@bp.route("/routes/export_jobs/<int:job_id>/status")
+@login_required
+def export_job_status_view(job_id):
+    job = _get_active_export_job(job_id)
+    return jsonify(export_job_status(job))
+
+
+@bp.route("/routes/export_jobs/<int:job_id>/download")
+@login_required
+def download_export_job(job_id):
+    job = _get_own_export_job(job_id)
+    if job.status != "done" or not job.artifact_path or not os.path.exists(job.artifact_path):
+        flash("Файл выгрузки ещё не готов или уже удалён.", "warning")
+        return redirect(url_for("route_management.export_job_page", job_id=job.id))
+
+    return send_file(job.artifact_path, as_attachment=True, download_name=job.filename, mimetype="text/plain")
+
+
+# Импорт маршрута
+@bp.route("/route/import", methods=["GET", "POST"])
+@login_required
+def import_route():
+    form = ImportRouteForm()
+    if form.validate_on_submit():
+        file = form.route_file.data
+        if file.filename.lower().endswith(".zip"):
+            return _import_zip(file, force=form.force.data)
+        try:
+            # Повторная загрузка того же файла: отвечаем ссылкой на уже созданные маршруты, не разбирая файл
+            content_hash = trfz_content_hash(file.stream)
+            if not form.force.data and (existing := find_imported_routes(current_user.id, content_hash)):
+                if len(existing) == 1:
+                    flash(f'Файл уже импортирован как маршрут "{existing[0][1]}" (№{existing[0][0]}). Чтобы создать копию, отметьте «Импортировать повторно».', "info")
+                else:
+                    route_ids = ", ".join(str(route_id) for route_id, _ in existing[:10])
+                    flash(f"Файл уже импортирован: маршрутов {len(existing)} (№{route_ids}). Чтобы создать копии, отметьте «Импортировать повторно».", "info")
+                return redirect(url_for("route_management.route_list"))
+
+            # Все блоки маршрутов файла (один маршрут или объединённая выгрузка) — одной транзакцией
+            imported, errors = run_write(partial(_import_file, file.stream, current_user.id, content_hash, build_audit_row("route_imported", "route")))
+            if imported:
+                # SQLite может повторно выдать ID удалённого маршрута — сбрасываем возможные старые записи
+                invalidate_route_bodies(route_id for route_id, _ in imported)
+
+            for block in errors[:IMPORT_ERRORS_SHOWN]:
+                flash(f"Маршрут {block.route_number or '?'} (блок {block.number}) не импортирован: {block.error}", "warning")
+            if len(errors) > IMPORT_ERRORS_SHOWN:
+                flash(f"И ещё ошибок: {len(errors) - IMPORT_ERRORS_SHOWN}.", "warning")
+
+            if not imported:
+                flash("Ошибка импорта: в файле нет корректных маршрутов.", "danger")
+                return redirect(request.url)
+            if len(imported) == 1:
+                flash(f'Маршрут "{imported[0][1]}" успешно импортирован!', "success")
+            else:
+                flash(f"Импортировано маршрутов: {len(imported)}.", "success")
             return redirect(url_for("route_management.route_list"))
 
         except Exception as e:
@@ -776,3 +1108,26 @@ def import_route():
             return redirect(request.url)
 
     return render_template("import_route.html", form=form)
+
+
+def _import_zip(file, force=False):
+    """Импорт всех файлов конфигурации из ZIP-архива одной транзакцией (через run_write) со сводкой по файлам."""
+    try:
+        with zipfile.ZipFile(file.stream) as archive:
+            files_count = sum(1 for info in archive.infolist() if not info.is_dir())
+        executor = get_export_executor() if files_count >= current_app.config["IMPORT_PARALLEL_MIN_FILES"] else None
+        options = {
+            "max_entry_bytes": current_app.config["IMPORT_MAX_ENTRY_BYTES"],
+            "executor": executor,
+            "max_in_flight": 2 * current_app.config["EXPORT_WORKERS"] if executor is not None else 1,
+            "force": force,
+        }
+        imported, summary = run_write(partial(_import_archive, file.stream, current_user.id, options, build_audit_row("route_imported", "route")))
+        if imported:
+            invalidate_route_bodies(route_id for route_id, _ in imported)
+    except Exception as e:
+        db.session.rollback()
+        flash(f"Ошибка импорта: {str(e)}", "danger")
+        return redirect(request.url)
+
+    return render_template("import_summary.html", archive_name=file.filename, imported_count=len(imported), summary=summary)
@@ -0,0 +1,112 @@
+from typing import NamedTuple
+
+import sqlalchemy as sa
+
+from app import db
+from app.models import Route
+
+# Порядок сортировки списка маршрутов: столбцы ключа постраничного вывода (ID в конце делает ключ уникальным)
+ROUTE_SORTS = {
+    "id": (Route.id,),
+    "number": (Route.route_number, Route.id),
+}
+
+
+class RoutePage(NamedTuple):
+    """Страница списка маршрутов и курсоры соседних страниц (None — страницы нет)."""
+
+    routes: list
+    next_cursor: str | None
+    prev_cursor: str | None
+
+
+def route_filter_conditions(user_id, transport_type=None, region_code=None, status=None):
+    """Условия WHERE для маршрутов пользователя по фильтрам списка (пустой фильтр не ограничивает выборку)."""
+    conditions = [Route.user_id == user_id]
+    if transport_type:
+        conditions.append(Route.transport_type == transport_type)
+    if region_code:
+        conditions.append(Route.region_code == region_code)
+    if status == "completed":
+        conditions.append(Route.is_completed.is_(True))
+    elif status == "draft":
+        conditions.append(Route.is_completed.is_not(True))
+    return conditions
+
+
+def filter_conditions_from_form(user_id, filter_form):
+    """route_filter_conditions по данным RouteFilterForm."""
+    return route_filter_conditions(user_id, filter_form.transport.data, filter_form.region.data, filter_form.status.data)
+
+
+def criteria_from_filter_form(filter_form):
+    """Критерии выборки (JSON) по фильтрам списка: сохраняются в задании и журнале вместо списка ID."""
+    return {name: filter_form[name].data for name in ("transport", "region", "status") if filter_form[name].data}
+
+
+def selection_conditions(user_id, criteria, since=None):
+    """
+    Условия WHERE для выборки массовой выгрузки. criteria — {"route_ids": [...]} (отмеченные вручную)
+    или фильтры списка {"transport", "region", "status"}; since — только изменённые после этого момента.
+    """
+    if "route_ids" in criteria:
+        conditions = [Route.user_id == user_id, Route.id.in_(criteria["route_ids"])]
+    else:
+        conditions = route_filter_conditions(user_id, criteria.get("transport"), criteria.get("region"), criteria.get("status"))
+    if since is not None:
+        conditions.append(Route.updated_at > since)
+    return conditions
+
+
+def export_conditions(user_id, criteria, since=None):
+    """
+    selection_conditions для чтения выгружаемых маршрутов: только завершённые. Завершённость проверяется
+    при создании выгрузки, но маршрут может стать незавершённым, пока выгрузка читается или ждёт в очереди.
+    """
+    return [*selection_conditions(user_id, criteria, since), Route.is_completed.is_(True)]
+
+
+def count_routes(conditions):
+    return db.session.scalar(sa.select(sa.func.count(Route.id)).where(*conditions))
+
+
+def encode_cursor(route, sort):
+    """Курсор строки: значения ключа сортировки через «:» (ID всегда последний)."""
+    return ":".join(str(getattr(route, column.key)) for column in ROUTE_SORTS[sort])
+
+
+def decode_cursor(cursor, sort):
+    """Значения ключа сортировки из курсора. Неверный курсор — ValueError."""
+    if sort == "number":
+        route_number, _, route_id = cursor.rpartition(":")
+        return route_number, int(route_id)
+    return (int(cursor),)
+
+
+def keyset_page(query, sort="id", after=None, before=None, per_page=50):
+    """
+    Страница запроса маршрутов по ключу сортировки без OFFSET: after — курсор последней строки предыдущей
+    страницы, before — первой строки следующей (для перехода назад). Стоимость не зависит от номера страницы.
+    """
+    columns = ROUTE_SORTS[sort]
+    key = sa.tuple_(*columns)
+
+    if before:
+        page_query = query.where(key < sa.tuple_(*decode_cursor(before, sort))).order_by(*(column.desc() for column in columns))
+    else:
+        if after:
+            query = query.where(key > sa.tuple_(*decode_cursor(after, sort)))
+        page_query = query.order_by(*columns)
+
+    routes = list(db.session.scalars(page_query.limit(per_page + 1)))
+    has_more = len(routes) > per_page
+    routes = routes[:per_page]
+
+    if before:
+        routes.reverse()
+        next_cursor = encode_cursor(routes[-1], sort) if routes else None
+        prev_cursor = encode_cursor(routes[0], sort) if has_more else None
+    else:
+        next_cursor = encode_cursor(routes[-1], sort) if has_more else None
+        prev_cursor = encode_cursor(routes[0], sort) if after and routes else None
+    return RoutePage(routes, next_cursor, prev_cursor)
@@ -0,0 +1,283 @@
+import codecs
+import hashlib
+import io
+from array import array
+from itertools import islice
+from typing import NamedTuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: без него цены разбираются построчно
+    np = None
+
+from app.prices import MISSING_PRICES, PRICE_LIMIT, PriceMatrix, price_to_stored, units_divisor
+
+# Строки цен читаются и разбираются порциями, чтобы в памяти не держать весь текст файла
+PRICE_LINES_PER_CHUNK = 8192
+# Порции меньше этого размера быстрее разобрать построчно, чем через NumPy
+VECTORIZE_MIN_LINES = 64
+
+
+# Размер порции байтов при проверке кодировки
+DECODE_CHUNK_SIZE = 64 * 1024
+
+
+class TrfzParseError(ValueError):
+    """Файл конфигурации не удалось разобрать."""
+
+
+class TrfzBlock(NamedTuple):
+    """Результат разбора одного блока маршрута (от строки R до следующей): поля маршрута или текст ошибки."""
+
+    number: int
+    route_number: str | None
+    fields: dict | None
+    error: str | None
+
+
+def trfz_content_hash(stream):
+    """
+    SHA-256 нормализованного содержимого файла: непустые строки без пробелов по краям, разделённые LF.
+    Повторная загрузка того же файла (в том числе с другими окончаниями строк) даёт тот же хэш.
+    Поток возвращается в исходную позицию.
+    """
+    start = stream.tell()
+    digest = hashlib.sha256()
+    for line in stream:
+        line = line.strip()
+        if line:
+            digest.update(line)
+            digest.update(b"\n")
+    stream.seek(start)
+    return digest.hexdigest()
+
+
+def parse_trfz(stream):
+    """
+    Разбирает файл конфигурации одного маршрута (шапка, тег R, остановки, тарифы, матрица цен)
+    из бинарного потока загрузки и возвращает словарь полей первого маршрута.
+    Матрица цен — PriceMatrix (ячейки [i][j] и [j][i] — одна ячейка).
+    """
+    block = next(iter_trfz_routes(stream))
+    if block.error is not None:
+        raise TrfzParseError(block.error)
+    return block.fields
+
+
+def parse_trfz_blocks(data):
+    """
+    Разбирает все блоки файла конфигурации из байтов и возвращает их списком.
+    Ошибка шапки или пустой файл возвращаются как единственный блок с ошибкой.
+    Функция верхнего уровня: её можно выполнять в пуле процессов.
+    """
+    try:
+        return list(iter_trfz_routes(io.BytesIO(data)))
+    except TrfzParseError as e:
+        return [TrfzBlock(0, None, None, str(e))]
+
+
+def iter_trfz_routes(stream):
+    """
+    Разбирает файл конфигурации с одним или несколькими блоками маршрутов после общей шапки
+    (как в объединённой выгрузке) и отдаёт TrfzBlock по мере чтения. Ошибка в блоке не прерывает
+    разбор: остаток блока пропускается до следующей строки R. Текст декодируется по мере чтения
+    как UTF-8 или, если файл не является корректным UTF-8, как CP866.
+    Ошибки шапки и пустой файл — TrfzParseError.
+    """
+    if not stream.seekable():
+        stream = io.BytesIO(stream.read())
+    encoding, errors = _detect_encoding(stream)
+    reader = _BlockReader(_iter_lines(stream, encoding, errors))
+
+    header_line = reader.next_line()
+    r_line = reader.next_line()
+    if header_line is None or r_line is None:
+        raise TrfzParseError("Файл пуст или имеет неверный формат")
+
+    header = header_line.split(";")
+    try:
+        dec_places = int(header[4])
+        region_code, carrier_id, unit_id = header[0], header[1], header[2]
+    except (IndexError, ValueError) as e:
+        raise TrfzParseError(f"Неверная шапка файла: {e}") from e
+    header_fields = {"region_code": region_code, "carrier_id": carrier_id, "unit_id": unit_id, "decimal_places": dec_places}
+
+    number = 0
+    while r_line is not None:
+        number += 1
+        parts = r_line.split(";")
+        block_lines = reader.block_lines()
+        try:
+            result = TrfzBlock(number, parts[1] if len(parts) > 1 else None, _parse_block(header_fields, parts, block_lines), None)
+        except (IndexError, ValueError) as e:
+            result = TrfzBlock(number, parts[1] if len(parts) > 1 else None, None, str(e))
+        # Недочитанный остаток блока (например, после ошибки) пропускаем
+        for _ in block_lines:
+            pass
+        yield result
+        r_line = reader.next_r_line
+
+
+def _detect_encoding(stream):
+    """Проверяет, что поток целиком декодируется как UTF-8 (без хранения текста), и возвращает кодировку разбора."""
+    start = stream.tell()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        while chunk := stream.read(DECODE_CHUNK_SIZE):
+            decoder.decode(chunk)
+        decoder.decode(b"", final=True)
+        return "utf-8", "strict"
+    except UnicodeDecodeError:
+        return "cp866", "replace"
+    finally:
+        stream.seek(start)
+
+
+def _iter_lines(stream, encoding, errors):
+    """Непустые строки потока без пробелов по краям."""
+    text = io.TextIOWrapper(stream, encoding=encoding, errors=errors, newline=None)
+    try:
+        for line in text:
+            line = line.strip()
+            if line:
+                yield line
+    finally:
+        # Поток загрузки остаётся открытым: он принадлежит вызывающему коду
+        text.detach()
+
+
+class _BlockReader:
+    """Делит поток строк на блоки маршрутов: блок продолжается до следующей строки, начинающейся с «R;»."""
+
+    def __init__(self, lines):
+        self._lines = lines
+        self.next_r_line = None
+
+    def next_line(self):
+        return next(self._lines, None)
+
+    def block_lines(self):
+        self.next_r_line = None
+        for line in self._lines:
+            if line.startswith("R;"):
+                self.next_r_line = line
+                return
+            yield line
+
+
+def _parse_block(header_fields, r_line, lines):
+    """Поля маршрута из строки R и строк его блока (остановки, тарифы, матрица цен)."""
+    multiplier = 10 ** header_fields["decimal_places"]
+
+    # --- 1. R-СТРОКА ---
+    r_number = r_line[1]
+    # Убираем возможные артефакты кодировки из названия
+    r_name = r_line[4].strip()
+    zones_count = int(r_line[3])
+    tabs_count = int(r_line[5])
+
+    # --- 2. ОСТАНОВКИ ---
+    stops = []
+    for sl in islice(lines, zones_count):
+        parts = sl.split(";")
+        stops.append({"name": parts[2], "km": parts[1]})
+
+    # --- 3. ТАРИФНЫЕ ТАБЛИЦЫ ---
+    tariff_tables = []
+    tab_ids = []
+    for index, tl in enumerate(islice(lines, tabs_count), start=1):
+        parts = tl.split(";")
+        tab_no = int(parts[0])
+        raw_ss_string = parts[2]
+        tariff_tables.append(
+            {
+                "tab_number": tab_no,
+                "tariff_name": f"Тариф {index}",
+                "table_type_code": parts[1],
+                "ss_series_codes": raw_ss_string,
+                "parsed_ss_codes_list": [c.strip() for c in raw_ss_string.split(";") if c.strip()],
+            }
+        )
+        tab_ids.append(str(tab_no))
+
+    # --- 4. МАТРИЦА ЦЕН ---
+    price_matrix = _parse_price_matrix(lines, zones_count, tab_ids, multiplier)
+
+    return {
+        "route_name": r_name,
+        "route_number": r_number,
+        **header_fields,
+        "transport_type": r_line[2] if r_line[2].startswith("0x") else f"0x{r_line[2]}",
+        "stops": stops,
+        "tariff_tables": tariff_tables,
+        "price_matrix": price_matrix,
+    }
+
+
+def _parse_price_matrix(lines, zones_count, tab_ids, multiplier):
+    """
+    Строит упакованную матрицу цен из строк i;j;p1;p2;... Строки читаются порциями. Цены в файле —
+    целые числа в единицах точности шапки; в хранимые единицы они переводятся точным целочисленным
+    умножением. Ячейки (i, j) и (j, i) совпадают; цен, которых нет в файле, нет и в матрице.
+    """
+    factor = units_divisor(multiplier)
+    tabs_count = len(tab_ids)
+    values = array("q", [MISSING_PRICES[8]]) * (zones_count * (zones_count + 1) // 2 * tabs_count)
+
+    while chunk := list(islice(lines, PRICE_LINES_PER_CHUNK)):
+        vectorized = np is not None and len(chunk) >= VECTORIZE_MIN_LINES
+        if not (vectorized and _fill_price_chunk_vectorized(values, chunk, zones_count, tabs_count, factor)):
+            _fill_price_chunk(values, chunk, zones_count, tabs_count, factor)
+
+    return PriceMatrix.from_values(zones_count, tab_ids, values)
+
+
+def _fill_price_chunk(values, chunk, zones_count, tabs_count, factor):
+    """Построчный разбор порции строк цен. Строки короче трёх полей пропускаются."""
+    for ml in chunk:
+        parts = ml.split(";")
+        if len(parts) < 3:
+            continue
+        base = PriceMatrix.cell_position(int(parts[0]), int(parts[1]), zones_count) * tabs_count
+        for offset, p_val in enumerate(parts[2 : 2 + tabs_count]):
+            values[base + offset] = _file_price_to_stored(p_val, factor)
+
+
+def _file_price_to_stored(p_val, factor):
+    """Цена из файла в хранимых единицах. Обычная цена — целое число; дробная переводится точно через Decimal."""
+    try:
+        stored = int(p_val) * factor
+    except ValueError:
+        return price_to_stored(p_val, factor)
+    if not -PRICE_LIMIT < stored < PRICE_LIMIT:
+        raise ValueError(f"Цена вне допустимого диапазона: {p_val!r}")
+    return stored
+
+
+def _fill_price_chunk_vectorized(values, chunk, zones_count, tabs_count, factor):
+    """
+    Разбор порции строк цен одним вызовом NumPy с записью прямо в массив values. Возвращает False,
+    если строки разной длины или содержат что-то кроме целых чисел, — тогда порция разбирается построчно.
+    """
+    try:
+        table = np.loadtxt(chunk, delimiter=";", dtype=np.int64, comments=None, ndmin=2)
+    except (ValueError, OverflowError):
+        return False
+    if table.shape[1] < 3:
+        return False
+
+    # Лишние столбцы (цен больше, чем тарифов) отбрасываются, как и при построчном разборе
+    width = min(table.shape[1] - 2, tabs_count)
+    prices = table[:, 2 : 2 + width]
+    if np.abs(prices).max(initial=0) >= PRICE_LIMIT // factor:
+        return False
+
+    rows_i = np.minimum(table[:, 0], table[:, 1])
+    rows_j = np.maximum(table[:, 0], table[:, 1])
+    if (rows_i < 0).any() or (rows_j >= zones_count).any():
+        raise IndexError("list index out of range")
+    cells = rows_i * zones_count - rows_i * (rows_i - 1) // 2 + (rows_j - rows_i)
+
+    target = np.frombuffer(values, dtype=np.int64)
+    target[(cells * tabs_count)[:, None] + np.arange(width)] = prices * factor
+    return True
@@ -1,8 +1,17 @@
-def normalize_for_cp866(text):
-    """Заменяет спецсимволы Unicode на аналоги, доступные в CP866."""
-    if not text:
-        return ""
-    replacements = {
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: без него матрица цен выгружается построчным циклом
+    np = None
+
+from app.prices import PRICE_LIMIT, PRICE_SCALE, PriceMatrix, price_to_stored, stored_to_units, units_divisor
+
+# С какого числа ячеек (пар зон × тарифов) матрица цен переводится в массив NumPy
+VECTORIZE_MIN_CELLS = 256
+
+# Замены спецсимволов Unicode на аналоги, доступные в CP866.
+# Таблица строится один раз и применяется через str.translate за один проход по строке.
+CP866_TRANSLATION = str.maketrans(
+    {
         "—": "-",  # Длинное тире
         "–": "-",  # Среднее тире
         "«": '"',  # Кавычки
@@ -11,21 +20,37 @@ def normalize_for_cp866(text):
         "“": '"',
         "№": "No",  # Номер
     }
-    for search, replace in replacements.items():
-        text = text.replace(search, replace)
-    return text
+)
+
+
+def normalize_for_cp866(text):
+    """Заменяет спецсимволы Unicode на аналоги, доступные в CP866."""
+    if not text:
+        return ""
+    return text.translate(CP866_TRANSLATION)
+
+
+def encode_cp866_lines(lines):
+    """
+    Кодирует блок строк в CP866 одним вызовом: строки склеиваются через CRLF,
+    нормализуются общей таблицей замен и кодируются целиком.
+    Результат побайтно совпадает с построчным normalize_for_cp866 + encode.
+    """
+    if not lines:
+        return b""
+    text = "\r\n".join(lines) + "\r\n"
+    if text.isascii():
+        # Блок цен состоит из цифр и ';' — замены не нужны, а ASCII совпадает с CP866
+        return text.encode("ascii")
+    return text.translate(CP866_TRANSLATION).encode("cp866", errors="replace")
 
 
 def write_route_body_to_buffer(buffer, route, decimal_places_for_config):
     """
     Записывает информацию о маршруте (начиная с тега R) в переданный буфер, используя указанную точность цен.
-    Кодировка CP866.
+    Кодировка CP866. Каждый раздел кодируется одним блоком через encode_cp866_lines.
     """
 
-    def write_line(text):
-        clean_text = normalize_for_cp866(text)
-        buffer.write((clean_text + "\r\n").encode("cp866", errors="replace"))
-
     # ==========================================
     # 2. ОПИСАНИЕ МАРШРУТА (Тэг R)
     # ==========================================
@@ -35,51 +60,129 @@ def write_route_body_to_buffer(buffer, route, decimal_places_for_config):
     route_name = route.route_name[:30]
     tabs_count = len(route.tariff_tables)
 
-    r_line = f"R;{route_id_str};{trans_type};{zones_count};{route_name};{tabs_count}"
-    write_line(r_line)
+    lines = [f"R;{route_id_str};{trans_type};{zones_count};{route_name};{tabs_count}"]
 
     # ==========================================
     # 3. СПИСОК ОСТАНОВОК (ЗОН)
     # ==========================================
-    for i, stop in enumerate(route.stops):
-        zone_no = str(i)
-        km_val = stop["km"]
-        zone_name = stop["name"][:19]
-        s_line = f"{zone_no};{km_val};{zone_name}"
-        write_line(s_line)
+    lines.extend(f"{i};{stop['km']};{stop['name'][:19]}" for i, stop in enumerate(route.stops))
 
     # ==========================================
     # 4. ТАРИФНЫЕ ТАБЛИЦЫ (Tabs)
     # ==========================================
-    for table in route.tariff_tables:
-        tab_n = table["tab_number"]
-        ss_codes = table["ss_series_codes"]
-        t_line = f"{tab_n};{table['table_type_code']};{ss_codes}"
-        write_line(t_line)
+    lines.extend(f"{table['tab_number']};{table['table_type_code']};{table['ss_series_codes']}" for table in route.tariff_tables)
+
+    buffer.write(encode_cp866_lines(lines))
 
     # ==========================================
     # 5. МАТРИЦА ЦЕН
     # ==========================================
     # ИСПОЛЬЗУЕМ ПЕРЕДАННЫЙ ПАРАМЕТР ТОЧНОСТИ
     multiplier = 10 ** int(decimal_places_for_config)
+    tab_ids = [str(table["tab_number"]) for table in route.tariff_tables]
+
+    buffer.write(encode_cp866_lines(format_price_lines(route.price_matrix, tab_ids, zones_count, multiplier)))
 
-    zones_count = len(route.stops)
 
+def format_price_lines(price_matrix, tab_ids, zones_count, multiplier):
+    """
+    Строки матрицы цен i;j;p1;p2;... для верхнего треугольника (j >= i).
+    Для больших матриц используется векторный путь через NumPy, результат совпадает с построчным.
+    """
+    cells_count = zones_count * (zones_count + 1) // 2 * len(tab_ids)
+    if np is not None and cells_count >= VECTORIZE_MIN_CELLS:
+        prices = price_matrix_to_array(price_matrix, tab_ids, zones_count, multiplier)
+        if prices is not None:
+            rows_i, rows_j = np.triu_indices(zones_count)
+            table = np.column_stack([rows_i, rows_j, prices[rows_i, rows_j]])
+            # Каждое различное число переводим в строку один раз, строки собираем выборкой по индексам
+            unique_values, positions = np.unique(table, return_inverse=True)
+            words = np.array([str(value) for value in unique_values.tolist()], dtype=object)
+            return [";".join(row) for row in words[positions.reshape(table.shape)].tolist()]
+
+    m_lines = []
+    for i in range(zones_count):
+        for j in range(i, zones_count):
+            prices_list = []
+            for tab_id_str in tab_ids:
+                try:
+                    raw_price = price_matrix[i][j].get(tab_id_str, 0)
+
+                    # ПРЕОБРАЗОВАНИЕ В ЦЕЛОЕ ЧИСЛО: через хранимые единицы, без ошибок округления float
+                    prices_list.append(str(stored_to_units(price_to_stored(raw_price), multiplier)))
+                except (IndexError, AttributeError, ValueError):
+                    prices_list.append("0")
+
+            m_lines.append(f"{i};{j};{';'.join(prices_list)}")
+    return m_lines
+
+
+def price_matrix_to_array(price_matrix, tab_ids, zones_count, multiplier):
+    """
+    Переводит матрицу цен в целочисленный массив NumPy (зоны × зоны × тарифы) за один проход.
+    Заполняется только верхний треугольник (j >= i). Цены переводятся так же, как построчным путём:
+    в хранимые единицы (округление) и затем точным целочисленным делением в единицы multiplier.
+    Возвращает None, если в матрице есть значения, которые нельзя перевести так же, как построчным путём
+    (строки, None, бесконечности, слишком большие числа).
+    """
+    if isinstance(price_matrix, PriceMatrix):
+        return packed_prices_to_array(price_matrix, tab_ids, zones_count, multiplier)
+
+    tabs_count = len(tab_ids)
+    zero_cell = [0] * tabs_count
+    raw_prices = []
     for i in range(zones_count):
-        for j in range(zones_count):
-            if j >= i:
-                prices_list = []
-                for table in route.tariff_tables:
-                    tab_id_str = str(table["tab_number"])
-                    try:
-                        raw_price = route.price_matrix[i][j].get(tab_id_str, 0)
-
-                        # ПРЕОБРАЗОВАНИЕ В ЦЕЛОЕ ЧИСЛО С УЧЕТОМ НОВОГО МНОЖИТЕЛЯ
-                        price_int = int(float(raw_price) * multiplier)
-                        prices_list.append(str(price_int))
-                    except (IndexError, AttributeError, ValueError):
-                        prices_list.append("0")
-
-                prices_str = ";".join(prices_list)
-                m_line = f"{i};{j};{prices_str}"
-                write_line(m_line)
+        try:
+            row = price_matrix[i]
+        except IndexError:
+            row = ()
+        for j in range(i, zones_count):
+            try:
+                get_price = row[j].get
+            except (IndexError, AttributeError):
+                raw_prices.extend(zero_cell)
+                continue
+            raw_prices.extend(map(get_price, tab_ids, zero_cell))
+
+    values = np.asarray(raw_prices)
+    if values.dtype.kind not in "biuf":
+        return None
+    stored = np.rint(values.astype(np.float64) * PRICE_SCALE)
+    if not np.isfinite(stored).all() or np.abs(stored).max(initial=0.0) >= PRICE_LIMIT:
+        return None
+
+    prices = np.zeros((zones_count, zones_count, tabs_count), dtype=np.int64)
+    rows_i, rows_j = np.triu_indices(zones_count)
+    prices[rows_i, rows_j] = _stored_to_units_array(stored.astype(np.int64), multiplier).reshape(-1, tabs_count)
+    return prices
+
+
+def packed_prices_to_array(price_matrix, tab_ids, zones_count, multiplier):
+    """
+    То же, что price_matrix_to_array, но прямо из упакованной матрицы, без построения словарей
+    и без арифметики с плавающей точкой.
+    """
+    prices = np.zeros((zones_count, zones_count, len(tab_ids)), dtype=np.int64)
+    packed_tabs = price_matrix.tabs
+    if not packed_tabs or not price_matrix.zones:
+        return prices
+
+    stored = np.frombuffer(price_matrix.data, dtype=f"<i{price_matrix.itemsize}").reshape(-1, len(packed_tabs))
+    rows_i, rows_j = np.triu_indices(price_matrix.zones)
+    # Зоны сверх числа остановок в выгрузку не попадают (i <= j, поэтому достаточно проверить j)
+    inside = rows_j < zones_count
+    stored, rows_i, rows_j = stored[inside], rows_i[inside], rows_j[inside]
+
+    for k, tab_id in enumerate(tab_ids):
+        if tab_id not in packed_tabs:
+            continue
+        values = stored[:, packed_tabs.index(tab_id)].astype(np.int64)
+        values[values == price_matrix.missing] = 0
+        prices[rows_i, rows_j, k] = _stored_to_units_array(values, multiplier)
+    return prices
+
+
+def _stored_to_units_array(stored, multiplier):
+    """stored_to_units для массива int64: точное деление с отбрасыванием дробной части."""
+    divisor = units_divisor(multiplier)
+    return np.where(stored >= 0, stored // divisor, -(-stored // divisor))
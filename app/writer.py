@@ -0,0 +1,287 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+
+import sqlalchemy as sa
+from flask import current_app, has_app_context
+
+from app import db
+from app.models import AuditLog
+
+# Ключ session.info: записи журнала, отложенные до фиксации транзакции запроса
+PENDING_AUDIT_ROWS = "pending_audit_rows"
+# Ключ session.info: записи асинхронного журнала, которые после фиксации транзакции запроса уйдут в очередь
+QUEUED_AUDIT_ROWS = "queued_audit_rows"
+
+
+def init_write_coordinator(app):
+    if "write_coordinator" in app.extensions:
+        return
+    # Без DB_SINGLE_WRITER запись идёт как раньше: каждый запрос фиксирует свою транзакцию сам
+    coordinator = None
+    if app.config["DB_SINGLE_WRITER"]:
+        coordinator = WriteCoordinator(app, app.config["DB_WRITER_BATCH_SIZE"], app.config["DB_WRITER_BATCH_WAIT_MS"] / 1000)
+        atexit.register(coordinator.stop)
+        if not sa.event.contains(db.session, "after_commit", _write_pending_audit_rows):
+            sa.event.listen(db.session, "after_commit", _write_pending_audit_rows)
+            sa.event.listen(db.session, "after_soft_rollback", _drop_pending_audit_rows)
+    app.extensions["write_coordinator"] = coordinator
+
+
+def get_write_coordinator():
+    return current_app.extensions.get("write_coordinator") if has_app_context() else None
+
+
+def init_audit_writer(app):
+    if "audit_writer" in app.extensions:
+        return
+    # Без AUDIT_ASYNC журнал пишется синхронно, в транзакции запроса
+    audit_writer = None
+    if app.config["AUDIT_ASYNC"]:
+        audit_writer = AuditWriter(app, app.config["AUDIT_BATCH_SIZE"], app.config["AUDIT_FLUSH_INTERVAL_MS"] / 1000)
+        atexit.register(audit_writer.stop)
+        if not sa.event.contains(db.session, "after_commit", _queue_committed_audit_rows):
+            sa.event.listen(db.session, "after_commit", _queue_committed_audit_rows)
+            sa.event.listen(db.session, "after_soft_rollback", _drop_queued_audit_rows)
+    app.extensions["audit_writer"] = audit_writer
+
+
+def get_audit_writer():
+    return current_app.extensions.get("audit_writer") if has_app_context() else None
+
+
+class WriteCoordinator:
+    """
+    Единственный поток записи в БД. Изменения приходят функциями func(session) и выполняются в сессии
+    этого потока; очередь разбирается пачками (до batch_size функций, ожидание следующей — до batch_wait секунд),
+    каждая пачка фиксируется одной короткой транзакцией. Если пачка не фиксируется, её функции
+    выполняются заново по одной, чтобы ошибка одной записи не отменяла остальные.
+    Чтение по-прежнему идёт параллельно в сессиях запросов.
+    """
+
+    def __init__(self, app, batch_size=64, batch_wait=0.002):
+        self.app = app
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, func):
+        """Ставит func(session) в очередь записи; Future получает её результат после фиксации транзакции."""
+        future = Future()
+        self._queue.put((func, future))
+        return future
+
+    def stop(self, timeout=None):
+        """Дописывает уже поставленные изменения и останавливает поток."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        with self.app.app_context():
+            while (batch := _next_batch(self._queue, self.batch_size, self.batch_wait)) is not None:
+                try:
+                    self._write_batch(batch)
+                finally:
+                    db.session.close()
+
+    def _write_batch(self, batch):
+        batch = [(func, future) for func, future in batch if future.set_running_or_notify_cancel()]
+        try:
+            results = [func(db.session) for func, _ in batch]
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            for func, future in batch:
+                self._write_one(func, future)
+            return
+        for (_, future), result in zip(batch, results, strict=True):
+            future.set_result(result)
+
+    def _write_one(self, func, future):
+        try:
+            result = func(db.session)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+
+class AuditWriter:
+    """
+    Асинхронная запись журнала аудита: запросы ставят в очередь готовые словари записей, фоновый поток
+    вставляет их пачками одним executemany (до batch_size записей, следующую ждёт до batch_wait секунд).
+    Если пачка не записывается, её записи повторяются по одной; потерянные записи попадают в лог приложения.
+    """
+
+    def __init__(self, app, batch_size=500, batch_wait=0.2):
+        self.app = app
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, rows):
+        for row in rows:
+            self._queue.put(row)
+
+    def flush(self, timeout=None):
+        """Ждёт, пока записи, поставленные до вызова, окажутся в БД."""
+        if self._thread.is_alive():
+            written = threading.Event()
+            self._queue.put(written)
+            written.wait(timeout)
+
+    def stop(self, timeout=None):
+        """Дописывает очередь и останавливает поток."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        with self.app.app_context():
+            while (batch := _next_batch(self._queue, self.batch_size, self.batch_wait)) is not None:
+                rows = []
+                try:
+                    for item in batch:
+                        if isinstance(item, threading.Event):
+                            # flush(): всё, что стояло в очереди до него, записывается сейчас
+                            self._write(rows)
+                            rows = []
+                            item.set()
+                        else:
+                            rows.append(item)
+                    self._write(rows)
+                finally:
+                    db.session.close()
+
+    def _write(self, rows):
+        if not rows:
+            return
+        try:
+            run_write(partial(insert_audit_batch, rows))
+        except Exception:
+            if len(rows) > 1:
+                for row in rows:
+                    self._write([row])
+                return
+            self.app.logger.exception("Не удалось записать журнал аудита: %s", rows[0]["action"])
+
+
+def _next_batch(items, batch_size, batch_wait):
+    """
+    Ждёт первый элемент очереди и добирает к нему следующие (всего до batch_size, ожидание — до batch_wait секунд).
+    None в очереди — сигнал остановки: собранная пачка возвращается, а следующий вызов вернёт None.
+    """
+    item = items.get()
+    if item is None:
+        return None
+    batch = [item]
+    deadline = time.monotonic() + batch_wait
+    while len(batch) < batch_size:
+        try:
+            item = items.get(timeout=max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            break
+        if item is None:
+            # Остановка: сначала записываем собранную пачку
+            items.put(None)
+            break
+        batch.append(item)
+    return batch
+
+
+def run_write(func):
+    """
+    Выполняет изменение func(session) и фиксирует его; возвращает результат func.
+    В режиме одного писателя func выполняется в потоке записи (в его сессии, вместе с изменениями
+    других запросов), поэтому она должна сама загружать нужные объекты по ID и возвращать простые значения.
+    Без него — в сессии текущего запроса с обычным commit (при ошибке сессия откатывается).
+    """
+    coordinator = get_write_coordinator()
+    if coordinator is None:
+        try:
+            result = func(db.session)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return result
+    return coordinator.submit(func).result()
+
+
+def insert_audit_rows(rows, session):
+    """Добавляет записи журнала (словари build_audit_row) в сессию и возвращает их ID."""
+    logs = [AuditLog(**row) for row in rows]
+    session.add_all(logs)
+    session.flush()
+    return [log.id for log in logs]
+
+
+def insert_audit_batch(rows, session):
+    """Вставляет записи журнала (словари build_audit_row) одним executemany, без загрузки ID."""
+    session.execute(sa.insert(AuditLog), rows)
+
+
+def defer_audit_log(log, row):
+    """
+    Откладывает запись журнала до фиксации транзакции запроса: её вставит поток записи вместе с записями
+    других запросов. После вставки у log появляется ID. При откате транзакции запроса запись отбрасывается.
+    """
+    _session_rows(PENDING_AUDIT_ROWS).append((log, row))
+
+
+def _session_rows(key):
+    # Откат без начатой транзакции не вызывает событий: начинаем её, чтобы записи отбросились вместе с ней
+    session = db.session()
+    if not session.in_transaction():
+        session.begin()
+    return session.info.setdefault(key, [])
+
+
+def _write_pending_audit_rows(session):
+    pending = session.info.pop(PENDING_AUDIT_ROWS, None)
+    coordinator = get_write_coordinator()
+    if not pending or coordinator is None:
+        return
+    try:
+        ids = coordinator.submit(partial(insert_audit_rows, [row for _, row in pending])).result()
+    except Exception:
+        # Транзакция запроса уже зафиксирована: потерю записей журнала только логируем
+        current_app.logger.exception("Не удалось записать журнал аудита: %s записей", len(pending))
+        return
+    for (log, _), log_id in zip(pending, ids, strict=True):
+        log.id = log_id
+
+
+def _drop_pending_audit_rows(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(PENDING_AUDIT_ROWS, None)
+
+
+def queue_audit_row(row):
+    """Ставит запись в асинхронный журнал: в очередь она попадёт после фиксации транзакции запроса, при откате — отбрасывается."""
+    _session_rows(QUEUED_AUDIT_ROWS).append(row)
+
+
+def _queue_committed_audit_rows(session):
+    rows = session.info.pop(QUEUED_AUDIT_ROWS, None)
+    audit_writer = get_audit_writer()
+    if rows and audit_writer is not None:
+        audit_writer.put(rows)
+
+
+def _drop_queued_audit_rows(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(QUEUED_AUDIT_ROWS, None)
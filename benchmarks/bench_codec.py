@@ -0,0 +1,206 @@
+"""
+Бенчмарк кодека файлов конфигурации: выгрузка тела маршрута, перекодировка в CP866,
+разбор файла и импорт целиком (через представление, с записью в БД).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_codec [--quick] [--output results.json]
+
+Результаты (маршрутов/с, МБ/с, пиковая память) сохраняются в JSON, чтобы сравнивать прогоны между собой.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import UTC, datetime
+
+from app import create_app, db
+from app.models import User
+from app.trfz import parse_trfz
+from app.utils import normalize_for_cp866, write_route_body_to_buffer
+from benchmarks.synthetic import STOP_COUNTS, TABLE_COUNTS, routes_for_case
+from config import Config
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+MB = 1024 * 1024
+
+
+class BenchConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    WTF_CSRF_ENABLED = False
+    EXPORT_JOB_WORKERS = 0
+
+
+def measure(func, repeat):
+    """Лучшее время из repeat запусков и пиковая память (байт) отдельного запуска под tracemalloc."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def result_row(case, stops_count, tables_count, routes_count, payload_bytes, seconds, peak):
+    return {
+        "case": case,
+        "stops": stops_count,
+        "tables": tables_count,
+        "routes": routes_count,
+        "bytes": payload_bytes,
+        "seconds": round(seconds, 6),
+        "routes_per_s": round(routes_count / seconds, 2),
+        "mb_per_s": round(payload_bytes / MB / seconds, 3),
+        "peak_memory_kib": round(peak / 1024, 1),
+    }
+
+
+def render_config(route):
+    """Полный файл конфигурации одного маршрута, как его отдаёт выгрузка."""
+    buffer = io.BytesIO()
+    buffer.write(b"01;1234;5678;240101;2\r\n")
+    write_route_body_to_buffer(buffer, route, "2")
+    return buffer.getvalue()
+
+
+def bench_export(routes, repeat):
+    def run():
+        buffer = io.BytesIO()
+        for route in routes:
+            write_route_body_to_buffer(buffer, route, "2")
+        return buffer
+
+    payload_bytes = run().tell()
+    return payload_bytes, *measure(run, repeat)
+
+
+def bench_normalize(routes, repeat):
+    # Строки, которые проходят через normalize_for_cp866 при выгрузке: названия маршрутов, остановок и тарифов
+    texts = []
+    for route in routes:
+        texts.append(route.route_name)
+        texts.extend(stop["name"] for stop in route.stops)
+        texts.extend(table["tariff_name"] for table in route.tariff_tables)
+
+    def run():
+        for text in texts:
+            normalize_for_cp866(text)
+
+    payload_bytes = sum(len(text.encode("utf-8")) for text in texts)
+    return payload_bytes, *measure(run, repeat)
+
+
+def bench_parse(routes, repeat):
+    files = [render_config(route) for route in routes]
+
+    def run():
+        for data in files:
+            parse_trfz(io.BytesIO(data))
+
+    return sum(len(data) for data in files), *measure(run, repeat)
+
+
+def bench_import(client, routes, repeat):
+    files = [render_config(route) for route in routes]
+
+    def run():
+        for data in files:
+            # force: иначе со второго прогона повторный файл отклоняется по хэшу, не доходя до разбора и вставки
+            response = client.post("/route/import", data={"route_file": (io.BytesIO(data), "route.txt"), "force": "y"}, content_type="multipart/form-data")
+            if response.status_code != 302:
+                raise RuntimeError(f"Импорт завершился с кодом {response.status_code}")
+
+    return sum(len(data) for data in files), *measure(run, repeat)
+
+
+def run_benchmarks(stop_counts=STOP_COUNTS, table_counts=TABLE_COUNTS, repeat=3, target_cells=200_000, include_import=True):
+    """Прогоняет все сценарии по сетке размеров и возвращает результаты в виде словаря для JSON."""
+    app = create_app(BenchConfig)
+    results = []
+    with app.app_context():
+        db.create_all()
+        user = User(username="bench", email="bench@example.com")
+        user.set_password("bench")
+        db.session.add(user)
+        db.session.commit()
+
+        client = app.test_client()
+        client.post("/login", data={"username": "bench", "password": "bench"})
+
+        for stops_count in stop_counts:
+            for tables_count in table_counts:
+                routes = routes_for_case(stops_count, tables_count, target_cells)
+                cases = [
+                    ("export_body", bench_export(routes, repeat)),
+                    ("normalize_cp866", bench_normalize(routes, repeat)),
+                    ("parse_trfz", bench_parse(routes, repeat)),
+                ]
+                if include_import:
+                    cases.append(("import_route", bench_import(client, routes, repeat)))
+                for case, (payload_bytes, seconds, peak) in cases:
+                    results.append(result_row(case, stops_count, tables_count, len(routes), payload_bytes, seconds, peak))
+
+        db.drop_all()
+
+    return {
+        "timestamp": datetime.now(UTC).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__ if np is not None else None,
+        "repeat": repeat,
+        "target_cells": target_cells,
+        "results": results,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк выгрузки и импорта файлов конфигурации")
+    parser.add_argument("--output", help="Файл JSON с результатами (по умолчанию benchmarks/results/codec_<время>.json)")
+    parser.add_argument("--repeat", type=int, default=3, help="Число повторов; берётся лучшее время")
+    parser.add_argument("--target-cells", type=int, help="Примерное число цен на один размер маршрута (по умолчанию 200000, с --quick 20000)")
+    parser.add_argument("--quick", action="store_true", help="Сокращённая сетка размеров")
+    parser.add_argument("--skip-import", action="store_true", help="Не измерять импорт")
+    args = parser.parse_args()
+
+    stop_counts, table_counts = ((1, 10, 50), (1, 5)) if args.quick else (STOP_COUNTS, TABLE_COUNTS)
+    target_cells = args.target_cells or (20_000 if args.quick else 200_000)
+    report = run_benchmarks(stop_counts, table_counts, repeat=args.repeat, target_cells=target_cells, include_import=not args.skip_import)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"codec_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"{'сценарий':<16} {'ост.':>5} {'табл.':>5} {'маршр.':>6} {'маршр./с':>10} {'МБ/с':>8} {'пик, КиБ':>10}")
+    for row in report["results"]:
+        print(f"{row['case']:<16} {row['stops']:>5} {row['tables']:>5} {row['routes']:>6} {row['routes_per_s']:>10.1f} {row['mb_per_s']:>8.2f} {row['peak_memory_kib']:>10.1f}")
+    print(f"Результаты сохранены в {output}")
+
+
+if __name__ == "__main__":
+    main()
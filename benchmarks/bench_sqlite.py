@@ -0,0 +1,136 @@
+"""
+Бенчмарк записи в SQLite при одновременных клиентах: несколько процессов (как воркеры gunicorn)
+пишут записи журнала аудита, как log_action при входе и правке маршрута, каждая — отдельной транзакцией.
+Сравниваются настройки SQLite по умолчанию (журнал DELETE, synchronous=FULL) и настройки из Config (WAL, NORMAL).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_sqlite [--quick] [--output results.json]
+
+Результаты (записей/с, задержка p50/p99, ошибки «database is locked») сохраняются в JSON.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sqlite3
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import UTC, datetime
+
+import sqlalchemy as sa
+
+from app import create_app, db
+from app.audit import log_action
+from benchmarks.bench_codec import BenchConfig, _git_commit
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# Сравниваемые настройки: PRAGMA, которые применяет init_database
+MODES = {
+    "default": {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL"},
+    "tuned": {},
+}
+
+
+def make_config(path, mode, busy_timeout=None):
+    overrides = {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}", **MODES[mode]}
+    if busy_timeout is not None:
+        overrides["SQLITE_BUSY_TIMEOUT"] = busy_timeout
+    return type("SqliteBenchConfig", (BenchConfig,), overrides)
+
+
+def write_audit_rows(path, mode, writes, busy_timeout=None):
+    """Процесс-клиент: writes транзакций с одной записью журнала. Возвращает задержки (с) и число ошибок блокировки."""
+    app = create_app(make_config(path, mode, busy_timeout))
+    latencies = []
+    locked = 0
+    with app.app_context():
+        for number in range(writes):
+            started = time.perf_counter()
+            try:
+                log_action(action="route_info_updated", entity_type="route", details={"number": number, "fields": {"route_name": "x" * 200}})
+                db.session.commit()
+            except sa.exc.OperationalError:
+                db.session.rollback()
+                locked += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+        db.engine.dispose()
+    return latencies, locked
+
+
+def bench_mode(mode, clients, writes, busy_timeout=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        app = create_app(make_config(path, mode, busy_timeout))
+        with app.app_context():
+            db.create_all()
+            db.engine.dispose()
+
+        # spawn: дочерние процессы не наследуют соединения с БД
+        with ProcessPoolExecutor(max_workers=clients, mp_context=multiprocessing.get_context("spawn")) as pool:
+            # Первый прогон пула только запускает процессы, чтобы импорт не попал в замер
+            list(pool.map(time.sleep, [0] * clients))
+            started = time.perf_counter()
+            results = list(pool.map(write_audit_rows, [path] * clients, [mode] * clients, [writes] * clients, [busy_timeout] * clients))
+            seconds = time.perf_counter() - started
+
+    latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+    committed = len(latencies)
+    return {
+        "mode": mode,
+        "clients": clients,
+        "writes": committed,
+        "locked_errors": sum(locked for _, locked in results),
+        "seconds": round(seconds, 6),
+        "writes_per_s": round(committed / seconds, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3) if latencies else None,
+        "p99_ms": round(latencies[min(committed - 1, int(committed * 0.99))] * 1000, 3) if latencies else None,
+    }
+
+
+def run_benchmarks(client_counts=(1, 4, 8), writes=200, busy_timeout=None):
+    """Прогоняет оба режима для каждого числа клиентов и возвращает результаты в виде словаря для JSON."""
+    results = [bench_mode(mode, clients, writes, busy_timeout) for clients in client_counts for mode in MODES]
+    return {
+        "timestamp": datetime.now(UTC).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sqlite": sqlite3.sqlite_version,
+        "writes_per_client": writes,
+        "busy_timeout_ms": busy_timeout,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк записи в SQLite при одновременных клиентах")
+    parser.add_argument("--output", help="Файл JSON с результатами (по умолчанию benchmarks/results/sqlite_<время>.json)")
+    parser.add_argument("--clients", type=int, nargs="+", help="Числа одновременных клиентов (по умолчанию 1 4 8)")
+    parser.add_argument("--writes", type=int, help="Транзакций на клиента (по умолчанию 200, с --quick 50)")
+    parser.add_argument("--busy-timeout", type=int, help="Ожидание блокировки, мс (по умолчанию из Config)")
+    parser.add_argument("--quick", action="store_true", help="Сокращённый прогон")
+    args = parser.parse_args()
+
+    client_counts = args.clients or ((1, 4) if args.quick else (1, 4, 8))
+    writes = args.writes or (50 if args.quick else 200)
+    report = run_benchmarks(client_counts, writes, args.busy_timeout)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"sqlite_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"{'режим':<8} {'клиенты':>7} {'записей':>8} {'зап./с':>9} {'p50, мс':>9} {'p99, мс':>9} {'locked':>7}")
+    for row in report["results"]:
+        print(f"{row['mode']:<8} {row['clients']:>7} {row['writes']:>8} {row['writes_per_s']:>9.1f} {row['p50_ms'] or 0:>9.2f} {row['p99_ms'] or 0:>9.2f} {row['locked_errors']:>7}")
+    print(f"Результаты сохранены в {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Нагрузочный бенчмарк записи из потоков одного процесса (как воркер gunicorn с потоками):
+каждый поток-клиент сохраняет цены своего маршрута через /route/edit/<id>/prices.
+Сравниваются обычная запись (каждый запрос фиксирует свою транзакцию) и режим одного писателя
+(DB_SINGLE_WRITER: изменения сериализуются через очередь и фиксируются пачками).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_writer [--quick] [--busy-timeout 50] [--output results.json]
+
+Результаты (сохранений/с, задержка p50/p99 успешных сохранений, неудачные запросы и ошибки «database is locked»)
+сохраняются в JSON.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import UTC, datetime
+
+import sqlalchemy as sa
+
+from app import create_app, db
+from app.models import User
+from benchmarks.bench_codec import BenchConfig, _git_commit
+from benchmarks.synthetic import make_route
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+MODES = {
+    "direct": {"DB_SINGLE_WRITER": False},
+    "single_writer": {"DB_SINGLE_WRITER": True},
+}
+
+STOPS_COUNT = 10
+TABLES_COUNT = 2
+
+
+def make_config(path, mode, busy_timeout=None):
+    overrides = {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}", **MODES[mode]}
+    if busy_timeout is not None:
+        overrides["SQLITE_BUSY_TIMEOUT"] = busy_timeout
+    return type("WriterBenchConfig", (BenchConfig,), overrides)
+
+
+def prepare_database(app, clients):
+    """Создаёт пользователя и по маршруту на клиента; возвращает ID маршрутов."""
+    with app.app_context():
+        db.create_all()
+        user = User(username="bench", email="bench@example.com")
+        user.set_password("password")
+        db.session.add(user)
+        db.session.flush()
+        routes = [make_route(STOPS_COUNT, TABLES_COUNT) for _ in range(clients)]
+        for route in routes:
+            route.user_id = user.id
+        db.session.add_all(routes)
+        db.session.commit()
+        return [route.id for route in routes]
+
+
+def price_matrix_json(number):
+    return json.dumps([[{str(table): number + row + column for table in range(1, TABLES_COUNT + 1)} for column in range(STOPS_COUNT)] for row in range(STOPS_COUNT)])
+
+
+def save_prices(app, route_id, writes, start, latencies, failed):
+    """Поток-клиент: входит и writes раз сохраняет матрицу цен своего маршрута; неудачные запросы считаются в failed."""
+    client = app.test_client()
+    client.post("/login", data={"username": "bench", "password": "password"})
+    start.wait()
+    for number in range(writes):
+        started = time.perf_counter()
+        try:
+            response = client.post(f"/route/edit/{route_id}/prices", data={"price_matrix_data": price_matrix_json(number)})
+        except sa.exc.OperationalError:
+            # TESTING: необработанная ошибка БД доходит до клиента вместо ответа 500
+            failed.append(route_id)
+            continue
+        if response.status_code != 302:
+            failed.append(route_id)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+def bench_mode(mode, clients, writes, busy_timeout=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(make_config(os.path.join(tmp, "bench.db"), mode, busy_timeout))
+        route_ids = prepare_database(app, clients)
+
+        locked = []
+        failed = []
+        with app.app_context():
+            engine = db.engine
+
+        def count_locked(context):
+            if "locked" in str(context.original_exception):
+                locked.append(context.original_exception)
+
+        sa.event.listen(engine, "handle_error", count_locked)
+        start = threading.Barrier(clients + 1)
+        latencies = [[] for _ in route_ids]
+        threads = [threading.Thread(target=save_prices, args=(app, route_id, writes, start, client_latencies, failed)) for route_id, client_latencies in zip(route_ids, latencies, strict=True)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+
+        coordinator = app.extensions["write_coordinator"]
+        if coordinator is not None:
+            coordinator.stop()
+        engine.dispose()
+
+    latencies = sorted(latency for client_latencies in latencies for latency in client_latencies)
+    total = len(latencies)
+    return {
+        "mode": mode,
+        "clients": clients,
+        "requests": total,
+        "failed_requests": len(failed),
+        "locked_errors": len(locked),
+        "seconds": round(seconds, 6),
+        "requests_per_s": round(total / seconds, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(latencies[min(total - 1, int(total * 0.99))] * 1000, 3),
+    }
+
+
+def run_benchmarks(client_counts=(1, 4, 8), writes=100, busy_timeout=None):
+    """Прогоняет оба режима для каждого числа клиентов и возвращает результаты в виде словаря для JSON."""
+    results = [bench_mode(mode, clients, writes, busy_timeout) for clients in client_counts for mode in MODES]
+    return {
+        "timestamp": datetime.now(UTC).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sqlite": sqlite3.sqlite_version,
+        "writes_per_client": writes,
+        "busy_timeout_ms": busy_timeout,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк записи в SQLite из потоков")
+    parser.add_argument("--output", help="Файл JSON с результатами (по умолчанию benchmarks/results/writer_<время>.json)")
+    parser.add_argument("--clients", type=int, nargs="+", help="Числа потоков-клиентов (по умолчанию 1 4 8)")
+    parser.add_argument("--writes", type=int, help="Сохранений на клиента (по умолчанию 100, с --quick 25)")
+    parser.add_argument("--busy-timeout", type=int, help="Ожидание блокировки, мс (по умолчанию из Config)")
+    parser.add_argument("--quick", action="store_true", help="Сокращённый прогон")
+    args = parser.parse_args()
+
+    client_counts = args.clients or ((1, 4) if args.quick else (1, 4, 8))
+    writes = args.writes or (25 if args.quick else 100)
+    report = run_benchmarks(client_counts, writes, args.busy_timeout)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"writer_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"{'режим':<14} {'клиенты':>7} {'запросов':>8} {'ошибок':>7} {'запр./с':>9} {'p50, мс':>9} {'p99, мс':>9} {'locked':>7}")
+    for row in report["results"]:
+        print(
+            f"{row['mode']:<14} {row['clients']:>7} {row['requests']:>8} {row['failed_requests']:>7} {row['requests_per_s']:>9.1f}"
+            f" {row['p50_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['locked_errors']:>7}"
+        )
+    print(f"Результаты сохранены в {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import random
+
+from app.models import Route
+
+# Сетка размеров маршрутов: число остановок и число тарифных таблиц
+STOP_COUNTS = (1, 10, 50, 100, 200)
+TABLE_COUNTS = (1, 5, 15)
+
+STOP_NAMES = ("Центральный рынок", "Вокзал «Северный»", "ул. Ленина – Дом культуры", "Школа №5", "Больница", "Завод", "Микрорайон")
+
+
+def make_route(stops_count, tables_count, seed=0, route_number="001"):
+    """
+    Несохранённый маршрут заданного размера со случайными (но воспроизводимыми по seed) ценами.
+    Названия остановок содержат кириллицу и типографские символы, чтобы нагружать перекодировку в CP866.
+    """
+    rnd = random.Random(seed)
+    tab_ids = [str(n) for n in range(1, tables_count + 1)]
+
+    matrix = [[{} for _ in range(stops_count)] for _ in range(stops_count)]
+    for i in range(stops_count):
+        for j in range(i, stops_count):
+            cell = {tab_id: 0.0 if i == j else round(rnd.uniform(10, 500), 2) for tab_id in tab_ids}
+            matrix[i][j] = cell
+            matrix[j][i] = cell
+
+    return Route(
+        user_id=1,
+        route_name=f"Маршрут «{route_number}» – синтетический",
+        transport_type="0x02",
+        carrier_id="1234",
+        unit_id="5678",
+        route_number=route_number,
+        region_code="01",
+        decimal_places="2",
+        stops=[{"name": f"{rnd.choice(STOP_NAMES)} {i}", "km": f"{i * 1.5:.2f}"} for i in range(stops_count)],
+        tariff_tables=[
+            {
+                "tab_number": int(tab_id),
+                "tariff_name": f"Тариф {tab_id}",
+                "table_type_code": "02",
+                "ss_series_codes": "01",
+                "parsed_ss_codes_list": ["01"],
+            }
+            for tab_id in tab_ids
+        ],
+        price_matrix=matrix,
+        stops_set=True,
+        is_completed=True,
+    )
+
+
+def routes_for_case(stops_count, tables_count, target_cells):
+    """Набор маршрутов одного размера: примерно target_cells цен в сумме, но не меньше трёх маршрутов."""
+    cells = stops_count * (stops_count + 1) // 2 * tables_count
+    count = max(3, min(100, target_cells // cells))
+    return [make_route(stops_count, tables_count, seed=n, route_number=f"{n % 1000:03d}") for n in range(count)]
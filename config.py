@@ -6,3 +6,67 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 class Config:
     SECRET_KEY = os.environ.get("SECRET_KEY") or "you-will-never-guess"
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL") or "sqlite:///" + os.path.join(basedir, "app.db")
+
+    # PRAGMA для каждого нового соединения SQLite: журнал WAL (чтение не блокирует запись),
+    # synchronous=NORMAL (в режиме WAL fsync только при контрольной точке), ожидание снятия блокировки (мс),
+    # кэш страниц соединения (КиБ) и отображение файла БД в память (байт)
+    SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE") or "WAL"
+    SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS") or "NORMAL"
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get("SQLITE_BUSY_TIMEOUT") or 5000)
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB") or 64 * 1024)
+    SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE") or 256 * 1024 * 1024)
+
+    # Пул соединений SQLAlchemy: размер, дополнительные соединения сверх него, ожидание свободного соединения (с)
+    # и время жизни соединения (с). 0 — значение SQLAlchemy по умолчанию
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE") or 0)
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW") or 0)
+    DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT") or 0)
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE") or 0)
+
+    # Режим одного писателя (для запуска в потоках): изменения и импорт маршрутов, задания выгрузки и записи
+    # журнала выполняет один поток, объединяя их в короткие транзакции — не больше DB_WRITER_BATCH_SIZE изменений,
+    # следующее изменение пачка ждёт не дольше DB_WRITER_BATCH_WAIT_MS миллисекунд
+    DB_SINGLE_WRITER = os.environ.get("DB_SINGLE_WRITER", "").lower() in ("1", "true", "yes")
+    DB_WRITER_BATCH_SIZE = int(os.environ.get("DB_WRITER_BATCH_SIZE") or 64)
+    DB_WRITER_BATCH_WAIT_MS = float(os.environ.get("DB_WRITER_BATCH_WAIT_MS") or 2)
+
+    # Асинхронный журнал аудита: записи log_action после фиксации транзакции запроса уходят в очередь,
+    # фоновый поток вставляет их пачками — до AUDIT_BATCH_SIZE записей, следующую ждёт не дольше
+    # AUDIT_FLUSH_INTERVAL_MS миллисекунд. Выключен — журнал пишется в транзакции запроса
+    AUDIT_ASYNC = os.environ.get("AUDIT_ASYNC", "").lower() in ("1", "true", "yes")
+    AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE") or 500)
+    AUDIT_FLUSH_INTERVAL_MS = float(os.environ.get("AUDIT_FLUSH_INTERVAL_MS") or 200)
+
+    # Журнал изменений маршрута хранит только изменившиеся поля и ячейки, а каждая
+    # AUDIT_SNAPSHOT_INTERVAL-я версия маршрута — ещё и полный снимок для восстановления истории
+    AUDIT_SNAPSHOT_INTERVAL = int(os.environ.get("AUDIT_SNAPSHOT_INTERVAL") or 20)
+
+    # Кэш отрисованных тел маршрутов для выгрузки конфигураций (лимиты в байтах).
+    # Дисковый уровень включается, только если задан каталог.
+    ROUTE_BODY_CACHE_MAX_MEMORY = int(os.environ.get("ROUTE_BODY_CACHE_MAX_MEMORY") or 64 * 1024 * 1024)
+    ROUTE_BODY_CACHE_DIR = os.environ.get("ROUTE_BODY_CACHE_DIR") or None
+    ROUTE_BODY_CACHE_MAX_DISK = int(os.environ.get("ROUTE_BODY_CACHE_MAX_DISK") or 512 * 1024 * 1024)
+
+    # Число маршрутов на странице списка
+    ROUTES_PER_PAGE = int(os.environ.get("ROUTES_PER_PAGE") or 50)
+
+    # Параллельная выгрузка: число процессов пула (0 или 1 — последовательно)
+    # и минимальный размер выборки, начиная с которого пул имеет смысл
+    EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS") or 0)
+    EXPORT_PARALLEL_MIN_ROUTES = int(os.environ.get("EXPORT_PARALLEL_MIN_ROUTES") or 200)
+
+    # Фоновые выгрузки: число потоков (0 — выполнять сразу в запросе), каталог готовых файлов
+    # и ограничения их хранения (возраст в секундах и суммарный размер в байтах)
+    EXPORT_JOB_WORKERS = int(os.environ.get("EXPORT_JOB_WORKERS") or 2)
+    EXPORT_ARTIFACT_DIR = os.environ.get("EXPORT_ARTIFACT_DIR") or os.path.join(basedir, "exports")
+    EXPORT_ARTIFACT_MAX_AGE = int(os.environ.get("EXPORT_ARTIFACT_MAX_AGE") or 24 * 60 * 60)
+    EXPORT_ARTIFACT_MAX_BYTES = int(os.environ.get("EXPORT_ARTIFACT_MAX_BYTES") or 2 * 1024 * 1024 * 1024)
+
+    # Задание pending/running, которое не менялось дольше этого времени (в секундах), считается брошенным:
+    # пул потоков заданий живёт в памяти процесса, и после перезапуска его никто не продолжит
+    EXPORT_JOB_STALE_AFTER = int(os.environ.get("EXPORT_JOB_STALE_AFTER") or 60 * 60)
+
+    # Импорт ZIP-архивов: предельный размер файла внутри архива (байт)
+    # и число файлов, начиная с которого разбор идёт в пуле процессов выгрузки (EXPORT_WORKERS)
+    IMPORT_MAX_ENTRY_BYTES = int(os.environ.get("IMPORT_MAX_ENTRY_BYTES") or 64 * 1024 * 1024)
+    IMPORT_PARALLEL_MIN_FILES = int(os.environ.get("IMPORT_PARALLEL_MIN_FILES") or 16)
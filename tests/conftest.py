@@ -9,6 +9,7 @@ class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
     WTF_CSRF_ENABLED = False  # Disable CSRF for easier testing
+    EXPORT_JOB_WORKERS = 0  # Run background export jobs inline
 
 
 @pytest.fixture(scope="function")
@@ -0,0 +1,60 @@
+import json
+
+import sqlalchemy as sa
+
+from app import db
+from app.audit import apply_route_changes, diff_route_snapshots, serialize_route
+from app.models import AuditLog
+from tests.test_export import make_route
+
+
+def route_snapshot(stops_count, **overrides):
+    return {**serialize_route(make_route(stops_count=stops_count)), "id": 1, **overrides}
+
+
+def test_diff_keeps_only_changed_cells_and_replays_to_after():
+    before = route_snapshot(30)
+    after = json.loads(json.dumps(before))
+    after["price_matrix"][3][7] = {"1": 99.5}
+    after["route_name"] = "Новое имя"
+
+    changes = diff_route_snapshots(before, after)
+
+    assert changes == {"fields": {"route_name": ["Route 001", "Новое имя"]}, "price_matrix": {"cells": [[3, 7, {"1": 10.0}, {"1": 99.5}]]}}
+    assert apply_route_changes(before, changes) == after
+    assert len(json.dumps(changes)) * 50 < len(json.dumps(before))
+
+
+def test_diff_replays_resized_stops_and_matrix():
+    before = route_snapshot(4)
+    shrunk = route_snapshot(2, price_matrix=[])
+    grown = route_snapshot(5)
+
+    for old, new in ((before, shrunk), (shrunk, grown), (before, grown)):
+        changes = diff_route_snapshots(old, new)
+        assert apply_route_changes(old, changes) == new
+    assert diff_route_snapshots(before, shrunk)["stops"]["length"] == [4, 2]
+    assert diff_route_snapshots(before, before) == {}
+
+
+def test_price_edits_store_changes_and_periodic_snapshots(logged_in_client):
+    logged_in_client.application.config["AUDIT_SNAPSHOT_INTERVAL"] = 3
+    with logged_in_client.application.app_context():
+        route = make_route(stops_count=2)
+        db.session.add(route)
+        db.session.commit()
+        route_id = route.id
+        history = [serialize_route(route)]
+
+    for price in (5, 6):
+        matrix = [[{"1": 0.0}, {"1": price}], [{"1": price}, {"1": 2.0}]]
+        logged_in_client.post(f"/route/edit/{route_id}/prices", data={"price_matrix_data": json.dumps(matrix)})
+
+    with logged_in_client.application.app_context():
+        logs = db.session.scalars(sa.select(AuditLog).where(AuditLog.action == "route_prices_updated").order_by(AuditLog.id)).all()
+        assert [log.details["version"] for log in logs] == [2, 3]
+        assert "snapshot" not in logs[0].details
+        assert logs[0].details["changes"]["price_matrix"]["cells"] == [[0, 1, {"1": 1.0}, {"1": 5.0}], [1, 0, {"1": 1.0}, {"1": 5.0}]]
+        for log in logs:
+            history.append(apply_route_changes(history[-1], log.details["changes"]))
+        assert history[-1] == logs[1].details["snapshot"]
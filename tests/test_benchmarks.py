@@ -0,0 +1,59 @@
+import sqlalchemy as sa
+
+from app import db
+from app.models import Route
+from benchmarks.bench_codec import bench_import, run_benchmarks
+from benchmarks.bench_sqlite import run_benchmarks as run_sqlite_benchmarks
+from benchmarks.bench_writer import run_benchmarks as run_writer_benchmarks
+from benchmarks.synthetic import make_route, routes_for_case
+
+
+def test_make_route_is_symmetric_and_sized():
+    route = make_route(4, 3)
+
+    assert len(route.stops) == 4
+    assert len(route.tariff_tables) == 3
+    assert route.price_matrix[1][3] is route.price_matrix[3][1]
+    assert set(route.price_matrix[0][2]) == {"1", "2", "3"}
+
+
+def test_routes_for_case_keeps_at_least_three_routes():
+    assert len(routes_for_case(50, 5, target_cells=1000)) == 3
+
+
+def test_run_benchmarks_reports_every_case():
+    report = run_benchmarks(stop_counts=(2,), table_counts=(1,), repeat=1, target_cells=3)
+
+    assert [row["case"] for row in report["results"]] == ["export_body", "normalize_cp866", "parse_trfz", "import_route"]
+    for row in report["results"]:
+        assert row["routes"] == 3
+        assert row["routes_per_s"] > 0
+        assert row["peak_memory_kib"] >= 0
+
+
+def test_import_benchmark_inserts_routes_on_every_run(logged_in_client):
+    routes = routes_for_case(2, 1, target_cells=3)
+    bench_import(logged_in_client, routes, repeat=2)
+
+    # Два замера и прогон под tracemalloc: повторные файлы не отклоняются как уже импортированные
+    with logged_in_client.application.app_context():
+        assert db.session.scalar(sa.select(sa.func.count(Route.id))) == 3 * len(routes)
+
+
+def test_sqlite_benchmark_reports_both_modes():
+    report = run_sqlite_benchmarks(client_counts=(1,), writes=3)
+
+    assert [row["mode"] for row in report["results"]] == ["default", "tuned"]
+    for row in report["results"]:
+        assert row["writes"] == 3
+        assert row["locked_errors"] == 0
+        assert row["writes_per_s"] > 0
+
+
+def test_writer_benchmark_reports_both_modes():
+    report = run_writer_benchmarks(client_counts=(2,), writes=2)
+
+    assert [row["mode"] for row in report["results"]] == ["direct", "single_writer"]
+    for row in report["results"]:
+        assert row["requests"] == 4
+        assert row["failed_requests"] == 0
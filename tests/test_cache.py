@@ -0,0 +1,116 @@
+import os
+
+from app.cache import RouteBodyCache, route_fingerprint
+from app.export import EXPORT_FORMAT_VERSION, render_route_body
+from app.models import Route
+
+
+def make_route(route_name="Test"):
+    return Route(
+        id=7,
+        user_id=1,
+        route_name=route_name,
+        transport_type="0x02",
+        carrier_id="1234",
+        unit_id="5678",
+        route_number="001",
+        region_code="01",
+        decimal_places="2",
+        stops=[{"name": "Stop1", "km": "0.00"}],
+        price_matrix=[[{"1": 10.0}]],
+        tariff_tables=[{"tab_number": 1, "tariff_name": "T1", "table_type_code": "02", "ss_series_codes": "01", "parsed_ss_codes_list": ["01"]}],
+    )
+
+
+class TestRouteFingerprint:
+    def test_depends_on_content_and_decimal_places(self):
+        route = make_route()
+        assert route_fingerprint(route, "2") == route_fingerprint(make_route(), "2")
+        assert route_fingerprint(route, "2") != route_fingerprint(route, "1")
+        assert route_fingerprint(route, "2") != route_fingerprint(make_route("Other"), "2")
+        assert route_fingerprint(route, "2", 1) != route_fingerprint(route, "2", 2)
+
+
+class TestRouteBodyCache:
+    def test_memory_lru_eviction(self):
+        cache = RouteBodyCache(max_memory_bytes=10)
+        cache.put(1, "2", "a", b"12345")
+        cache.put(2, "2", "b", b"12345")
+        cache.get(1, "2", "a")  # Маршрут 1 становится самым свежим
+        cache.put(3, "2", "c", b"12345")
+
+        assert cache.get(1, "2", "a") == b"12345"
+        assert cache.get(2, "2", "b") is None
+        assert cache.get(3, "2", "c") == b"12345"
+
+    def test_invalidate_drops_all_entries_of_route(self):
+        cache = RouteBodyCache(max_memory_bytes=1024)
+        cache.put(1, "2", "a", b"x")
+        cache.put(1, "1", "a", b"y")
+        cache.put(11, "2", "a", b"z")
+
+        cache.invalidate(1)
+
+        assert cache.get(1, "2", "a") is None
+        assert cache.get(1, "1", "a") is None
+        assert cache.get(11, "2", "a") == b"z"
+
+    def test_invalidate_many(self, tmp_path):
+        cache = RouteBodyCache(max_memory_bytes=1024, disk_dir=str(tmp_path), max_disk_bytes=1024)
+        for route_id in (1, 2, 3):
+            cache.put(route_id, "2", "a", b"x")
+
+        cache.invalidate_many([1, 3])
+
+        assert [cache.get(route_id, "2", "a") for route_id in (1, 2, 3)] == [None, b"x", None]
+        assert os.listdir(tmp_path) == ["2"]
+        assert os.listdir(tmp_path / "2") == ["2_2_a.trfz"]
+
+    def test_disk_tier_survives_memory_eviction(self, tmp_path):
+        cache = RouteBodyCache(max_memory_bytes=0, disk_dir=str(tmp_path), max_disk_bytes=1024)
+        cache.put(1, "2", "a", b"body")
+
+        assert cache.get(1, "2", "a") == b"body"
+
+        cache.invalidate(1)
+        assert cache.get(1, "2", "a") is None
+        assert os.listdir(tmp_path) == []
+
+    def test_disk_tier_prunes_oldest_files_only_over_limit(self, tmp_path, monkeypatch):
+        cache = RouteBodyCache(max_memory_bytes=0, disk_dir=str(tmp_path), max_disk_bytes=20)
+        scans = []
+        scandir = os.scandir
+        monkeypatch.setattr(os, "scandir", lambda path: scans.append(path) or scandir(path))
+        for route_id in (1, 2, 3, 4):
+            cache.put(route_id, "2", "a", b"12345")
+            os.utime(tmp_path / str(route_id) / f"{route_id}_2_a.trfz", (route_id, route_id))
+        assert scans == []
+
+        cache.put(5, "2", "a", b"12345")
+
+        # Сверх лимита удаляются самые старые файлы, пока объём не опустится до 90% лимита
+        assert [cache.get(route_id, "2", "a") for route_id in (1, 2, 3, 4, 5)] == [None, None, b"12345", b"12345", b"12345"]
+        assert sorted(os.listdir(tmp_path)) == ["3", "4", "5"]
+        assert cache._disk_bytes == 15
+
+    def test_disk_usage_is_counted_on_start(self, tmp_path):
+        RouteBodyCache(max_memory_bytes=0, disk_dir=str(tmp_path), max_disk_bytes=1024).put(1, "2", "a", b"12345")
+
+        cache = RouteBodyCache(max_memory_bytes=0, disk_dir=str(tmp_path), max_disk_bytes=1024)
+        cache.put(1, "2", "a", b"123")
+        cache.put(2, "2", "a", b"1")
+
+        assert cache._disk_bytes == 4
+
+
+class TestRenderRouteBody:
+    def test_reuses_cached_body_until_content_changes(self, app):
+        route = make_route()
+        cache = app.extensions["route_body_cache"]
+
+        first = render_route_body(route, "2")
+        assert cache.get(route.id, "2", route_fingerprint(route, "2", EXPORT_FORMAT_VERSION)) == first
+        assert render_route_body(route, "2") is first
+
+        route.route_name = "Renamed"
+        assert b"Renamed" in render_route_body(route, "2")
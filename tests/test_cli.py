@@ -0,0 +1,111 @@
+import io
+import json
+
+import sqlalchemy as sa
+
+from app import db
+from app.cli import backfill_route_counts_command, export_command, pack_prices_command
+from app.models import Route, User
+from app.prices import price_matrix_as_list
+from app.utils import write_route_body_to_buffer
+
+
+def add_route(user_id, route_number, region_code="01", is_completed=True):
+    route = Route(
+        user_id=user_id,
+        route_name=f"Route {route_number}",
+        transport_type="0x02",
+        carrier_id="1234",
+        unit_id="5678",
+        route_number=route_number,
+        region_code=region_code,
+        decimal_places="1",
+        stops=[{"name": "Stop1", "km": "0.00"}, {"name": "Stop2", "km": "1.00"}],
+        price_matrix=[[{"1": 0.0}, {"1": 10.5}], [{"1": 10.5}, {"1": 0.0}]],
+        tariff_tables=[{"tab_number": 1, "tariff_name": "T1", "table_type_code": "02", "ss_series_codes": "01", "parsed_ss_codes_list": ["01"]}],
+        stops_set=True,
+        is_completed=is_completed,
+    )
+    db.session.add(route)
+    db.session.commit()
+    return route
+
+
+def test_export_single_file(app, test_user, tmp_path):
+    other = User(username="other", email="other@example.com")
+    db.session.add(other)
+    db.session.commit()
+    first = add_route(test_user.id, "001")
+    add_route(test_user.id, "002", is_completed=False)
+    add_route(test_user.id, "003", region_code="02")
+    add_route(other.id, "004")
+
+    expected = io.BytesIO()
+    write_route_body_to_buffer(expected, first, "2")
+    output = tmp_path / "bulk.txt"
+
+    result = app.test_cli_runner().invoke(export_command, ["--user", "testuser", "--region", "1", "--unit", "42", "-o", str(output)])
+
+    assert result.exit_code == 0, result.output
+    assert "Выгружено маршрутов: 1" in result.output
+    assert "маршрутов/с" in result.output
+    header, body = output.read_bytes().split(b"\r\n", 1)
+    assert header.startswith(b"01;0000;0042;")
+    assert header.endswith(b";2")
+    assert body == expected.getvalue()
+
+
+def test_export_split_into_directory(app, test_user, tmp_path):
+    add_route(test_user.id, "001")
+    add_route(test_user.id, "002")
+
+    result = app.test_cli_runner().invoke(export_command, ["--split", "-o", str(tmp_path / "out")])
+
+    assert result.exit_code == 0, result.output
+    files = sorted(path.name for path in (tmp_path / "out").iterdir())
+    assert len(files) == 2
+    assert files[0].startswith("TRFZ_001_")
+    assert (tmp_path / "out" / files[0]).read_bytes().startswith(b"01;1234;5678;")
+
+
+def test_export_unknown_user(app, tmp_path):
+    result = app.test_cli_runner().invoke(export_command, ["--user", "nobody", "-o", str(tmp_path / "bulk.txt")])
+
+    assert result.exit_code != 0
+    assert "nobody" in result.output
+
+
+def test_pack_prices_converts_legacy_rows(app, test_user):
+    legacy = add_route(test_user.id, "001")
+    packed = add_route(test_user.id, "002")
+    matrix = [[{"1": 0.0}, {"1": 7.0}], [{"1": 7.0}, {"1": 0.0}]]
+    db.session.execute(sa.update(Route.__table__).where(Route.id == legacy.id).values(price_matrix=sa.literal(json.dumps(matrix), sa.Text)))
+    db.session.commit()
+    updated_at = db.session.scalars(sa.select(Route.updated_at).order_by(Route.id)).all()
+
+    result = app.test_cli_runner().invoke(pack_prices_command, ["--batch-size", "1"])
+    again = app.test_cli_runner().invoke(pack_prices_command)
+
+    assert result.exit_code == 0, result.output
+    assert "Переупаковано матриц цен: 1" in result.output
+    assert "Переупаковано матриц цен: 0" in again.output
+    assert db.session.scalars(sa.select(sa.func.typeof(Route.price_matrix)).order_by(Route.id)).all() == ["blob", "blob"]
+    assert db.session.scalars(sa.select(Route.updated_at).order_by(Route.id)).all() == updated_at
+    db.session.expire_all()
+    assert price_matrix_as_list(db.session.get(Route, legacy.id).price_matrix) == matrix
+    assert price_matrix_as_list(db.session.get(Route, packed.id).price_matrix) == [[{"1": 0.0}, {"1": 10.5}], [{"1": 10.5}, {"1": 0.0}]]
+
+
+def test_backfill_route_counts(app, test_user):
+    for number in ("001", "002", "003"):
+        add_route(test_user.id, number)
+    db.session.execute(sa.update(Route.__table__).where(Route.route_number != "002").values(stops_count=0, tariffs_count=0))
+    db.session.commit()
+    updated_at = db.session.scalars(sa.select(Route.updated_at).order_by(Route.id)).all()
+
+    result = app.test_cli_runner().invoke(backfill_route_counts_command, ["--batch-size", "2"])
+
+    assert result.exit_code == 0, result.output
+    assert "Обновлено счётчиков маршрутов: 2" in result.output
+    assert db.session.execute(sa.select(Route.stops_count, Route.tariffs_count).order_by(Route.id)).all() == [(2, 1)] * 3
+    assert db.session.scalars(sa.select(Route.updated_at).order_by(Route.id)).all() == updated_at
@@ -0,0 +1,37 @@
+import pytest
+import sqlalchemy as sa
+
+from app import create_app, db
+from app.database import sqlite_pragmas
+from tests.conftest import TestConfig
+
+
+def make_file_app(path, **overrides):
+    config = type("FileConfig", (TestConfig,), {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}", **overrides})
+    return create_app(config)
+
+
+def test_pragmas_are_applied_on_connect(tmp_path):
+    app = make_file_app(tmp_path / "app.db", SQLITE_BUSY_TIMEOUT=1234, SQLITE_CACHE_SIZE_KB=2048)
+
+    with app.app_context():
+        with db.engine.connect() as connection:
+            pragmas = {name: connection.exec_driver_sql(f"PRAGMA {name}").scalar() for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size")}
+        db.engine.dispose()
+
+    assert pragmas == {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 1234, "cache_size": -2048}
+
+
+def test_pool_options_come_from_config(tmp_path):
+    app = make_file_app(tmp_path / "app.db", DB_POOL_SIZE=3, DB_POOL_RECYCLE=60)
+
+    with app.app_context():
+        assert isinstance(db.engine.pool, sa.pool.QueuePool)
+        assert db.engine.pool.size() == 3
+        assert db.engine.pool._recycle == 60
+        db.engine.dispose()
+
+
+def test_unknown_pragma_value_is_rejected(app):
+    with pytest.raises(ValueError):
+        sqlite_pragmas({**app.config, "SQLITE_JOURNAL_MODE": "wal; DROP TABLE user"})
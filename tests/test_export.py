@@ -0,0 +1,152 @@
+import io
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import sqlalchemy as sa
+
+from app import db
+from app.export import format_config_header, get_export_executor, iter_bulk_config, iter_route_chunks, iter_routes, iter_zip_config, render_payload, render_route_bodies, route_export_payload
+from app.models import Route
+from app.utils import write_route_body_to_buffer
+
+
+def make_route(route_number="001", stops_count=3):
+    return Route(
+        user_id=1,
+        route_name=f"Route {route_number}",
+        transport_type="0x02",
+        carrier_id="1234",
+        unit_id="5678",
+        route_number=route_number,
+        region_code="01",
+        decimal_places="2",
+        stops=[{"name": f"Stop{i}", "km": f"{i}.00"} for i in range(stops_count)],
+        price_matrix=[[{"1": float(i + j)} for j in range(stops_count)] for i in range(stops_count)],
+        tariff_tables=[
+            {
+                "tab_number": 1,
+                "tariff_name": "T1",
+                "table_type_code": "02",
+                "ss_series_codes": "01",
+                "parsed_ss_codes_list": ["01"],
+            }
+        ],
+        stops_set=True,
+        is_completed=True,
+    )
+
+
+class TestFormatConfigHeader:
+    def test_pads_codes_with_zeros(self):
+        assert format_config_header("1", "12", "3", "240101", "2") == "01;0012;0003;240101;2"
+
+
+class TestIterBulkConfig:
+    def test_output_matches_buffer_writer(self):
+        routes = [make_route("001"), make_route("002", stops_count=5)]
+
+        expected = io.BytesIO()
+        expected.write(b"01;1234;5678;240101;2\r\n")
+        for route in routes:
+            write_route_body_to_buffer(expected, route, "2")
+
+        streamed = b"".join(iter_bulk_config("01;1234;5678;240101;2", routes, "2"))
+        assert streamed == expected.getvalue()
+
+    def test_splits_output_into_chunks(self):
+        routes = [make_route(f"{n:03d}") for n in range(10)]
+
+        chunks = list(iter_bulk_config("01;1234;5678;240101;2", routes, "2", chunk_size=64))
+
+        assert len(chunks) > 1
+        assert chunks[0].startswith(b"01;1234;5678;240101;2\r\nR;000;")
+
+    def test_no_routes_yields_only_header(self):
+        assert list(iter_bulk_config("01;1234;5678;240101;2", [], "2")) == [b"01;1234;5678;240101;2\r\n"]
+
+
+class TestRenderRouteBodies:
+    def test_process_pool_keeps_route_order(self):
+        routes = [make_route(f"{n:03d}", stops_count=n % 4 + 1) for n in range(8)]
+        serial = render_route_bodies(routes, "2")
+
+        with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn")) as executor:
+            parallel = render_route_bodies(routes, "2", executor=executor)
+
+        assert parallel == serial
+        assert [body.split(b";")[1] for body in parallel] == [f"{n:03d}".encode() for n in range(8)]
+
+    def test_payload_is_plain_data(self):
+        payload = route_export_payload(make_route())
+        assert set(payload) == {"route_number", "transport_type", "route_name", "stops", "tariff_tables", "price_matrix"}
+        assert render_payload(payload, "2") == render_route_bodies([make_route()], "2")[0]
+
+    def test_bulk_config_with_executor_matches_serial(self):
+        routes = [make_route(f"{n:03d}") for n in range(7)]
+        serial = b"".join(iter_bulk_config("01;1234;5678;240101;2", routes, "2"))
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            parallel = b"".join(iter_bulk_config("01;1234;5678;240101;2", routes, "2", executor=executor, batch_size=3))
+
+        assert parallel == serial
+
+
+class TestGetExportExecutor:
+    def test_disabled_by_default(self, app):
+        assert get_export_executor() is None
+
+
+class TestIterRouteChunks:
+    def test_reads_fixed_size_chunks_by_key(self, app, test_user):
+        for number in range(5):
+            route = make_route(f"{number:03d}")
+            route.user_id = test_user.id
+            db.session.add(route)
+        db.session.commit()
+        statements = []
+        sa.event.listen(db.engine, "before_cursor_execute", lambda conn, cursor, statement, *args: "FROM route" in statement and statements.append(statement))
+
+        query = sa.select(Route).where(Route.user_id == test_user.id).order_by(Route.id)
+        chunks = [[route.route_number for route in routes] for routes in iter_route_chunks(query, per_fetch=2)]
+
+        assert chunks == [["000", "001"], ["002", "003"], ["004"]]
+        assert len(statements) == 3
+        assert all(" IN " not in statement and "LIMIT" in statement for statement in statements)
+        routes = list(iter_routes(query, per_fetch=2))
+        assert [route.route_number for route in routes] == ["000", "001", "002", "003", "004"]
+        assert not any(route in db.session for route in routes)
+
+
+class TestIterZipConfig:
+    def test_one_entry_per_route_with_own_header(self):
+        first = make_route("001")
+        second = make_route("002", stops_count=2)
+        second.decimal_places = "1"
+
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(iter_zip_config([first, second], "240101"))))
+
+        assert archive.namelist() == ["TRFZ_001_240101.txt", "TRFZ_002_240101.txt"]
+        for route, name in zip([first, second], archive.namelist(), strict=True):
+            expected = io.BytesIO()
+            expected.write(f"01;1234;5678;240101;{route.decimal_places}\r\n".encode("cp866"))
+            write_route_body_to_buffer(expected, route, route.decimal_places)
+            assert archive.read(name) == expected.getvalue()
+
+    def test_duplicate_route_numbers_get_unique_names(self):
+        first, second = make_route("001"), make_route("001")
+        first.id, second.id = 1, 2
+
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(iter_zip_config([first, second], "240101"))))
+
+        assert archive.namelist() == ["TRFZ_001_240101.txt", "TRFZ_001_240101_2.txt"]
+
+    def test_compression_option(self):
+        routes = [make_route(f"{n:03d}", stops_count=10) for n in range(3)]
+
+        stored = zipfile.ZipFile(io.BytesIO(b"".join(iter_zip_config(routes, "240101", compression="stored"))))
+        deflated = zipfile.ZipFile(io.BytesIO(b"".join(iter_zip_config(routes, "240101", compression="deflated-9"))))
+
+        assert {info.compress_type for info in stored.infolist()} == {zipfile.ZIP_STORED}
+        assert {info.compress_type for info in deflated.infolist()} == {zipfile.ZIP_DEFLATED}
+        assert [stored.read(name) for name in stored.namelist()] == [deflated.read(name) for name in deflated.namelist()]
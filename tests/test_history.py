@@ -0,0 +1,184 @@
+import json
+from datetime import UTC, datetime, timedelta
+
+import sqlalchemy as sa
+
+from app import db
+from app.audit import build_audit_row, route_snapshot_details, serialize_route
+from app.history import route_state_at
+from app.models import AuditLog, Route, User
+from app.routes.route_management import _update_route
+from tests.test_export import make_route
+
+
+def add_route_with_history(app, created_at=None):
+    """Маршрут пользователя 1 с записью о создании, как её делает _create_route."""
+    with app.app_context():
+        route = make_route(stops_count=2)
+        db.session.add(route)
+        db.session.flush()
+        row = build_audit_row("route_created", "route", route_id=route.id, details=route_snapshot_details(route), user_id=1)
+        db.session.add(AuditLog(**{**row, "created_at": created_at or row["created_at"]}))
+        db.session.commit()
+        return route.id, serialize_route(route)
+
+
+def save_prices(client, route_id, price):
+    matrix = [[{"1": 0.0}, {"1": price}], [{"1": price}, {"1": 2.0}]]
+    return client.post(f"/route/edit/{route_id}/prices", data={"price_matrix_data": json.dumps(matrix)})
+
+
+def test_history_api_rebuilds_each_version_and_deletion(logged_in_client):
+    app = logged_in_client.application
+    app.config["AUDIT_SNAPSHOT_INTERVAL"] = 3
+    route_id, created = add_route_with_history(app)
+    moments = [datetime.now(UTC)]
+    for price in (5, 6, 7):
+        save_prices(logged_in_client, route_id, price)
+        moments.append(datetime.now(UTC))
+    logged_in_client.post(f"/route/delete/{route_id}")
+
+    states = [logged_in_client.get(f"/route/{route_id}/history", query_string={"at": moment.isoformat()}).get_json() for moment in moments]
+    deleted = logged_in_client.get(f"/route/{route_id}/history").get_json()
+    before = logged_in_client.get(f"/route/{route_id}/history", query_string={"at": (moments[0] - timedelta(hours=1)).isoformat()})
+
+    assert states[0]["route"] == created
+    assert [state["version"] for state in states] == [1, 2, 3, 4]
+    assert [state["route"]["price_matrix"][0][1] for state in states] == [{"1": 1.0}, {"1": 5.0}, {"1": 6.0}, {"1": 7.0}]
+    assert deleted["deleted"] is True and deleted["route"] is None
+    assert before.status_code == 404
+
+
+def test_history_reads_only_changes_since_nearest_snapshot(app, test_user):
+    app.config["AUDIT_SNAPSHOT_INTERVAL"] = 3
+    route_id, _ = add_route_with_history(app)
+    route = db.session.get(Route, route_id)
+
+    for number in range(7):
+        _update_route(route_id, {"route_name": f"Имя {number}"}, [build_audit_row("route_info_updated", "route", route_id=route_id, user_id=1)], db.session)
+        db.session.commit()
+
+    state = route_state_at(route_id, datetime.now(UTC))
+
+    assert state.snapshot["route_name"] == route.route_name == "Имя 6"
+    assert state.version == 8
+    assert state.deltas == 2
+
+
+def test_history_replays_legacy_full_value_rows(app, test_user):
+    route = make_route(stops_count=2)
+    db.session.add(route)
+    db.session.commit()
+    legacy = serialize_route(route)
+    new_matrix = [[{"1": 0.0}, {"1": 3.0}], [{"1": 3.0}, {"1": 2.0}]]
+    now = datetime.now(UTC)
+    db.session.add_all(
+        [
+            AuditLog(action="route_created", entity_type="route", route_id=route.id, user_id=1, details={"after": legacy}, created_at=now - timedelta(minutes=2)),
+            AuditLog(
+                action="route_prices_updated",
+                entity_type="route",
+                route_id=route.id,
+                user_id=1,
+                details={"before_price_matrix": legacy["price_matrix"], "after_price_matrix": new_matrix},
+                created_at=now - timedelta(minutes=1),
+            ),
+        ]
+    )
+    db.session.commit()
+
+    state = route_state_at(route.id, now)
+
+    assert state.snapshot == {**legacy, "price_matrix": new_matrix}
+    assert state.version is None
+
+
+def test_history_trfz_matches_config_of_that_version(logged_in_client):
+    route_id, _ = add_route_with_history(logged_in_client.application)
+    old_config = logged_in_client.get(f"/route/{route_id}/generate_config").get_data()
+    moment = datetime.now(UTC)
+    save_prices(logged_in_client, route_id, 9)
+
+    response = logged_in_client.get(f"/route/{route_id}/history", query_string={"at": moment.isoformat(), "format": "trfz"})
+
+    assert response.status_code == 200
+    assert "_v1.txt" in response.headers["Content-Disposition"]
+    assert response.get_data().split(b"\r\n", 1)[1] == old_config.split(b"\r\n", 1)[1]
+
+
+def test_history_is_shown_to_owner_and_admin_only(admin_client):
+    route_id, _ = add_route_with_history(admin_client.application)
+    with admin_client.application.app_context():
+        other = User(username="other", email="other@example.com")
+        other.set_password("password")
+        db.session.add(other)
+        db.session.flush()
+        db.session.execute(sa.update(Route).values(user_id=other.id))
+        db.session.commit()
+
+    page = admin_client.get("/admin/route_history/", query_string={"route_id": route_id})
+    admin_api = admin_client.get(f"/route/{route_id}/history")
+    admin_client.get("/logout")
+    admin_client.post("/login", data={"username": "other", "password": "password"})
+    owner_api = admin_client.get(f"/route/{route_id}/history")
+    with admin_client.application.app_context():
+        db.session.execute(sa.update(Route).values(user_id=1))
+        db.session.commit()
+    stranger_api = admin_client.get(f"/route/{route_id}/history")
+
+    assert page.status_code == admin_api.status_code == owner_api.status_code == 200
+    assert "Скачать TRFZ этой версии" in page.get_data(as_text=True)
+    assert stranger_api.status_code == 404
+
+
+def test_deleted_route_id_is_not_reused(logged_in_client):
+    route_id, _ = add_route_with_history(logged_in_client.application)
+    logged_in_client.post(f"/route/delete/{route_id}")
+
+    new_route_id, _ = add_route_with_history(logged_in_client.application)
+
+    assert new_route_id > route_id
+
+
+def test_history_is_scoped_to_route_lifetime_after_id_reuse(logged_in_client):
+    app = logged_in_client.application
+    route_id, first = add_route_with_history(app)
+    first_moment = datetime.now(UTC)
+    logged_in_client.post(f"/route/delete/{route_id}")
+    # Таблица, созданная до AUTOINCREMENT: SQLite выдаёт ID удалённого маршрута новому маршруту другого пользователя
+    with app.app_context():
+        other = User(username="other", email="other@example.com")
+        other.set_password("password")
+        db.session.add(other)
+        db.session.flush()
+        reused = make_route("777", stops_count=2)
+        reused.id = route_id
+        reused.user_id = other.id
+        db.session.add(reused)
+        db.session.flush()
+        db.session.add(AuditLog(**build_audit_row("route_created", "route", route_id=route_id, details=route_snapshot_details(reused), user_id=other.id)))
+        db.session.commit()
+
+    owner_past = logged_in_client.get(f"/route/{route_id}/history", query_string={"at": first_moment.isoformat()})
+    owner_now = logged_in_client.get(f"/route/{route_id}/history")
+    logged_in_client.get("/logout")
+    logged_in_client.post("/login", data={"username": "other", "password": "password"})
+    other_past = logged_in_client.get(f"/route/{route_id}/history", query_string={"at": first_moment.isoformat()})
+    other_now = logged_in_client.get(f"/route/{route_id}/history")
+    with app.app_context():
+        admin = User(username="boss", email="boss@example.com", is_admin=True)
+        admin.set_password("password")
+        db.session.add(admin)
+        db.session.commit()
+    logged_in_client.get("/logout")
+    logged_in_client.post("/login", data={"username": "boss", "password": "password"})
+    past_page = logged_in_client.get("/admin/route_history/", query_string={"route_id": route_id, "at": first_moment.isoformat()}).get_data(as_text=True)
+    now_page = logged_in_client.get("/admin/route_history/", query_string={"route_id": route_id}).get_data(as_text=True)
+
+    assert owner_past.status_code == 200
+    assert owner_past.get_json()["route"] == first
+    assert owner_now.status_code == 404
+    assert other_past.status_code == 404
+    assert other_now.get_json()["route"]["route_number"] == "777"
+    assert (past_page.count("<td>route_created</td>"), past_page.count("<td>route_deleted</td>")) == (1, 1)
+    assert (now_page.count("<td>route_created</td>"), now_page.count("<td>route_deleted</td>")) == (1, 0)
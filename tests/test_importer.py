@@ -0,0 +1,90 @@
+import io
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import sqlalchemy as sa
+
+from app import db
+from app.importer import import_trfz_routes, import_zip_routes
+from app.models import AuditLog, Route
+
+
+def route_file(number, price="100"):
+    return f"01;1234;5678;240101;2\r\nR;{number};02;1;Route {number};1\r\n0;0.00;Stop1\r\n1;02;01\r\n0;0;{price}\r\n".encode("cp866")
+
+
+def make_archive(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+class TestImportTrfzRoutes:
+    def test_inserts_routes_in_batches_with_audit_rows(self, app, test_user):
+        data = b"01;1234;5678;240101;2\r\n" + b"".join(route_file(f"{n:03d}").split(b"\r\n", 1)[1] for n in range(5))
+
+        imported, errors = import_trfz_routes(io.BytesIO(data), test_user.id, batch_size=2)
+        db.session.commit()
+
+        assert errors == []
+        assert [name for _, name in imported] == [f"Route {n:03d}" for n in range(5)]
+        assert db.session.scalar(sa.select(sa.func.count()).select_from(Route)) == 5
+        assert db.session.scalar(sa.select(sa.func.count()).select_from(AuditLog).where(AuditLog.action == "route_imported")) == 5
+        assert set(db.session.execute(sa.select(Route.stops_count, Route.tariffs_count))) == {(1, 1)}
+
+
+class TestImportZipRoutes:
+    def test_summary_per_file(self, app, test_user):
+        archive = make_archive(
+            [
+                ("a/TRFZ_001.txt", route_file("001")),
+                ("a/", b""),
+                ("readme.md", b"hello"),
+                ("TRFZ_002.txt", route_file("002", price="x")),
+                ("TRFZ_003.txt", route_file("003")),
+                ("big.txt", b"0" * 2048),
+            ]
+        )
+
+        imported, summary = import_zip_routes(archive, test_user.id, max_entry_bytes=1024)
+        db.session.commit()
+
+        assert [name for _, name in imported] == ["Route 001", "Route 003"]
+        assert [(item["name"], item["status"], item["routes"]) for item in summary] == [
+            ("a/TRFZ_001.txt", "imported", 1),
+            ("readme.md", "skipped", 0),
+            ("TRFZ_002.txt", "failed", 0),
+            ("TRFZ_003.txt", "imported", 1),
+            ("big.txt", "skipped", 0),
+        ]
+        assert "Маршрут 002 (блок 1)" in summary[2]["errors"][0]
+
+    def test_process_pool_keeps_archive_order(self, app, test_user):
+        archive = make_archive([(f"TRFZ_{n:03d}.txt", route_file(f"{n:03d}")) for n in range(6)])
+
+        with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn")) as executor:
+            imported, summary = import_zip_routes(archive, test_user.id, max_entry_bytes=1024, executor=executor, max_in_flight=3)
+
+        assert [name for _, name in imported] == [f"Route {n:03d}" for n in range(6)]
+        assert {item["status"] for item in summary} == {"imported"}
+
+    def test_skips_already_imported_and_repeated_files(self, app, test_user):
+        import_zip_routes(make_archive([("first.txt", route_file("001"))]), test_user.id, max_entry_bytes=1024)
+        archive = make_archive([("again.txt", route_file("001")), ("new.txt", route_file("002")), ("copy.txt", route_file("002"))])
+
+        imported, summary = import_zip_routes(archive, test_user.id, max_entry_bytes=1024)
+
+        assert [name for _, name in imported] == ["Route 002"]
+        assert [(item["status"], item["errors"]) for item in summary] == [
+            ("skipped", ["Уже импортирован как маршрут №1"]),
+            ("imported", []),
+            ("skipped", ["Повторяет файл new.txt"]),
+        ]
+
+        archive.seek(0)
+        imported, _ = import_zip_routes(archive, test_user.id, max_entry_bytes=1024, force=True)
+        assert len(imported) == 3
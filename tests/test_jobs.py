@@ -0,0 +1,149 @@
+from datetime import UTC, datetime, timedelta
+
+from app import db
+from app.jobs import STALE_EXPORT_JOB_ERROR, cleanup_export_artifacts, create_export_job, export_job_status, fail_stale_export_jobs, run_export_job
+from app.models import ExportJob, Route
+from tests.test_export import make_route
+
+
+def make_done_job(path, size, finished_at):
+    path.write_bytes(b"x" * size)
+    job = ExportJob(user_id=1, status="done", params={}, total_routes=1, done_routes=1, artifact_path=str(path), size_bytes=size, finished_at=finished_at)
+    db.session.add(job)
+    return job
+
+
+class TestCleanupExportArtifacts:
+    def test_expires_old_artifacts(self, app, tmp_path):
+        now = datetime.now(UTC)
+        old = make_done_job(tmp_path / "old.txt", 10, now - timedelta(days=2))
+        fresh = make_done_job(tmp_path / "fresh.txt", 10, now)
+        db.session.commit()
+
+        assert cleanup_export_artifacts() == 1
+
+        assert old.status == "expired"
+        assert old.artifact_path is None
+        assert not (tmp_path / "old.txt").exists()
+        assert fresh.status == "done"
+        assert (tmp_path / "fresh.txt").exists()
+
+    def test_expires_oldest_artifacts_over_disk_budget(self, app, tmp_path):
+        app.config["EXPORT_ARTIFACT_MAX_BYTES"] = 25
+        now = datetime.now(UTC)
+        oldest = make_done_job(tmp_path / "a.txt", 10, now - timedelta(minutes=3))
+        middle = make_done_job(tmp_path / "b.txt", 10, now - timedelta(minutes=2))
+        newest = make_done_job(tmp_path / "c.txt", 10, now - timedelta(minutes=1))
+        db.session.commit()
+
+        assert cleanup_export_artifacts() == 1
+
+        assert oldest.status == "expired"
+        assert middle.status == "done"
+        assert newest.status == "done"
+
+
+class TestFailStaleExportJobs:
+    def test_fails_jobs_left_by_restart(self, app, tmp_path):
+        app.config["EXPORT_ARTIFACT_DIR"] = str(tmp_path)
+        app.config["EXPORT_JOB_STALE_AFTER"] = 600
+        old = datetime.now(UTC) - timedelta(hours=1)
+        pending = ExportJob(user_id=1, status="pending", params={}, created_at=old, updated_at=old)
+        running = ExportJob(user_id=1, status="running", params={}, created_at=old, updated_at=old)
+        active = ExportJob(user_id=1, status="running", params={}, created_at=old)
+        db.session.add_all([pending, running, active])
+        db.session.commit()
+        (tmp_path / f"export_{running.id}.txt.part").write_bytes(b"x")
+
+        assert fail_stale_export_jobs() == 2
+
+        db.session.expire_all()
+        assert (pending.status, running.status, active.status) == ("failed", "failed", "running")
+        assert pending.error == STALE_EXPORT_JOB_ERROR
+        assert pending.finished_at is not None
+        assert not (tmp_path / f"export_{running.id}.txt.part").exists()
+
+    def test_cleanup_fails_stale_jobs(self, app):
+        app.config["EXPORT_JOB_STALE_AFTER"] = 600
+        old = datetime.now(UTC) - timedelta(hours=1)
+        job = ExportJob(user_id=1, status="pending", params={}, created_at=old, updated_at=old)
+        db.session.add(job)
+        db.session.commit()
+
+        cleanup_export_artifacts()
+
+        db.session.expire_all()
+        assert job.status == "failed"
+
+
+class TestExportJobStatus:
+    def test_reports_progress_percent(self):
+        job = ExportJob(id=5, status="running", total_routes=8, done_routes=2)
+        assert export_job_status(job)["percent"] == 25
+
+
+class TestRunExportJob:
+    def add_routes(self, user_id, numbers):
+        routes = [make_route(number) for number in numbers]
+        for route in routes:
+            route.user_id = user_id
+        routes[-1].transport_type = "0x01"
+        db.session.add_all(routes)
+        db.session.commit()
+        return [route.id for route in routes]
+
+    def run(self, app, params, total_routes):
+        job = ExportJob(user_id=1, status="pending", params=params, total_routes=total_routes, done_routes=0)
+        db.session.add(job)
+        db.session.commit()
+        run_export_job(app, job.id)
+        db.session.refresh(job)
+        with open(job.artifact_path, encoding="cp866", newline="") as f:
+            return job, [line.split(";")[1] for line in f.read().split("\r\n") if line.startswith("R;")]
+
+    def test_job_stores_criteria_and_finds_routes_when_run(self, app, test_user, tmp_path):
+        app.config["EXPORT_ARTIFACT_DIR"] = str(tmp_path)
+        self.add_routes(test_user.id, ["001", "002", "003"])
+
+        job = db.session.get(ExportJob, create_export_job(test_user.id, {"transport": "0x02"}, 2, "01", "1234", "5678", "2", db.session))
+        db.session.commit()
+        job, numbers = self.run(app, job.params, job.total_routes)
+
+        assert "route_ids" not in job.params
+        assert job.status == "done"
+        assert numbers == ["001", "002"]
+        assert (job.done_routes, job.total_routes) == (2, 2)
+
+    def test_job_with_empty_filter_exports_all_routes(self, app, test_user, tmp_path):
+        app.config["EXPORT_ARTIFACT_DIR"] = str(tmp_path)
+        self.add_routes(test_user.id, ["001", "002"])
+        job = db.session.get(ExportJob, create_export_job(test_user.id, {}, 2, "01", "1234", "5678", "2", db.session))
+        db.session.commit()
+
+        job, numbers = self.run(app, job.params, job.total_routes)
+
+        assert job.status == "done"
+        assert numbers == ["001", "002"]
+
+    def test_job_with_route_ids_list_still_runs(self, app, test_user, tmp_path):
+        app.config["EXPORT_ARTIFACT_DIR"] = str(tmp_path)
+        route_ids = self.add_routes(test_user.id, ["001", "002", "003"])
+        params = {"route_ids": route_ids[1:], "region_code": "01", "carrier_id": "1234", "unit_id": "5678", "decimal_places": "2"}
+
+        job, numbers = self.run(app, params, 2)
+
+        assert job.status == "done"
+        assert numbers == ["002", "003"]
+
+    def test_job_skips_routes_that_became_incomplete(self, app, test_user, tmp_path):
+        app.config["EXPORT_ARTIFACT_DIR"] = str(tmp_path)
+        route_ids = self.add_routes(test_user.id, ["001", "002", "003"])
+        job = db.session.get(ExportJob, create_export_job(test_user.id, {"route_ids": route_ids}, 3, "01", "1234", "5678", "2", db.session))
+        db.session.get(Route, route_ids[1]).is_completed = False
+        db.session.commit()
+
+        job, numbers = self.run(app, job.params, job.total_routes)
+
+        assert job.status == "done"
+        assert numbers == ["001", "003"]
+        assert job.total_routes == 2
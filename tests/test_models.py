@@ -34,6 +34,16 @@ class TestUserModel:
         route = Route(route_name="Test Route")
         assert repr(route) == "<Route Test Route>"
 
+    def test_route_counts_follow_stops_and_tariffs(self):
+        from app.models import Route
+
+        route = Route(route_name="Test Route", stops=[{"name": "A", "km": "0"}, {"name": "B", "km": "1"}], tariff_tables=[{"tab_number": 1}])
+        assert (route.stops_count, route.tariffs_count) == (2, 1)
+
+        route.stops = []
+        route.tariff_tables = None
+        assert (route.stops_count, route.tariffs_count) == (0, 0)
+
     def test_audit_log_repr(self):
         log = AuditLog(action="route_created", entity_type="route", user_id=1, route_id=2)
         assert "route_created" in repr(log)
@@ -0,0 +1,126 @@
+import io
+import json
+import pickle
+
+import pytest
+import sqlalchemy as sa
+
+from app import db, prices, utils
+from app.models import Route
+from app.prices import PriceMatrix, price_matrix_as_list
+from app.utils import format_price_lines, write_route_body_to_buffer
+from tests.test_export import make_route
+
+
+def symmetric(matrix):
+    """Ожидаемое представление: нижний треугольник повторяет верхний."""
+    return [[matrix[min(i, j)][max(i, j)] for j in range(len(matrix))] for i in range(len(matrix))]
+
+
+class TestPriceMatrix:
+    def test_round_trip_keeps_upper_triangle(self):
+        matrix = [
+            [{"1": 0.0, "2": 1.5}, {"1": 10.25}, {}],
+            [{"1": 99.0}, {"2": 3.0}, {"1": 12.34, "2": 0.01}],
+            [{}, {}, {"1": 7.0, "2": 8.0}],
+        ]
+
+        packed = PriceMatrix.from_bytes(PriceMatrix.from_list(matrix).to_bytes())
+
+        assert packed.tolist() == symmetric(matrix)
+        assert packed == symmetric(matrix)
+        assert packed[1][0] == {"1": 10.25}  # Нижний треугольник берётся из верхнего
+        assert packed[0][1] is packed[1][0]
+        assert packed.tabs == ("1", "2")
+        assert packed.itemsize == 4
+
+    def test_missing_cells_and_rows_are_empty(self):
+        packed = PriceMatrix.from_list([[{"1": 5}], None, [None, "x", {"1": 1}]])
+
+        assert packed.tolist() == [[{"1": 5.0}, {}, {}], [{}, {}, {}], [{}, {}, {"1": 1.0}]]
+
+    def test_large_prices_use_int64(self):
+        packed = PriceMatrix.from_list([[{"1": 5_000_000.5}]])
+
+        assert packed.itemsize == 8
+        assert PriceMatrix.from_bytes(packed.to_bytes()).tolist() == [[{"1": 5_000_000.5}]]
+
+    def test_values_are_narrowed_without_numpy(self, monkeypatch):
+        pytest.importorskip("numpy")
+        matrices = [[[{"1": 1.5, "2": 7}, {"1": 2.25}], [{}, {"2": 3}]], [[{"1": 5_000_000.5}]]]
+        expected = [PriceMatrix.from_list(matrix) for matrix in matrices]
+
+        monkeypatch.setattr(prices, "np", None)
+
+        assert [PriceMatrix.from_list(matrix).to_bytes() for matrix in matrices] == [packed.to_bytes() for packed in expected]
+        assert [packed.itemsize for packed in expected] == [4, 8]
+
+    @pytest.mark.parametrize("price", ["abc", None, float("nan"), 1e300])
+    def test_invalid_price_raises_value_error(self, price):
+        with pytest.raises(ValueError):
+            PriceMatrix.from_list([[{"1": price}]])
+
+    def test_legacy_json_value_is_read(self):
+        matrix = [[{"1": 1.0}, {"1": 2.0}], [{"1": 2.0}, {"1": 3.0}]]
+
+        assert PriceMatrix.from_bytes(json.dumps(matrix).encode()).tolist() == matrix
+
+    def test_pickle_and_list_conversion(self):
+        packed = PriceMatrix.from_bytes(PriceMatrix.from_list([[{"1": 1.0, "2": 2.0}]]).to_bytes())
+
+        assert pickle.loads(pickle.dumps(packed)) == packed
+        assert price_matrix_as_list(packed) == [[{"1": 1.0, "2": 2.0}]]
+        assert price_matrix_as_list([]) == []
+
+    def test_packed_export_matches_list_export(self, monkeypatch):
+        route = make_route(stops_count=25)
+        route.price_matrix = [[{"1": 12.34 + i * 0.01 + j} for j in range(25)] for i in range(25)]
+        route.price_matrix[2][7] = {}
+        expected = io.BytesIO()
+        write_route_body_to_buffer(expected, route, "1")
+
+        route.price_matrix = PriceMatrix.from_list(route.price_matrix)
+        packed = io.BytesIO()
+        write_route_body_to_buffer(packed, route, "1")
+        assert packed.getvalue() == expected.getvalue()
+
+        monkeypatch.setattr(utils, "np", None)
+        assert format_price_lines(route.price_matrix, ["1"], 25, 10) == format_price_lines(route.price_matrix.tolist(), ["1"], 25, 10)
+
+    def test_packed_array_ignores_extra_zones_and_unknown_tabs(self):
+        pytest.importorskip("numpy")
+        packed = PriceMatrix.from_list([[{"1": 1.0}, {"1": 2.0}, {"1": 3.0}]] * 3)
+
+        prices = utils.price_matrix_to_array(packed, ["1", "9"], 2, 100)
+
+        assert prices.shape == (2, 2, 2)
+        assert prices[:, :, 0].tolist() == [[100, 200], [0, 200]]
+        assert prices[:, :, 1].tolist() == [[0, 0], [0, 0]]
+
+
+class TestPackedColumn:
+    def test_route_loads_price_matrix_view(self, app, test_user):
+        route = make_route(stops_count=3)
+        route.user_id = test_user.id
+        db.session.add(route)
+        db.session.commit()
+        route_id = route.id
+        db.session.expire_all()
+
+        loaded = db.session.get(Route, route_id)
+
+        assert isinstance(loaded.price_matrix, PriceMatrix)
+        assert loaded.price_matrix[2][1] == {"1": 3.0}
+        assert loaded.price_matrix == symmetric([[{"1": float(i + j)} for j in range(3)] for i in range(3)])
+
+    def test_route_loads_legacy_json_text(self, app, test_user):
+        route = make_route(stops_count=2)
+        db.session.add(route)
+        db.session.commit()
+        legacy = [[{"1": 0.0}, {"1": 5.5}], [{"1": 5.5}, {"1": 0.0}]]
+        db.session.execute(sa.text("UPDATE route SET price_matrix = :matrix"), {"matrix": json.dumps(legacy)})
+        db.session.commit()
+        db.session.expire_all()
+
+        assert db.session.scalar(sa.text("SELECT typeof(price_matrix) FROM route")) == "text"
+        assert price_matrix_as_list(db.session.get(Route, route.id).price_matrix) == legacy
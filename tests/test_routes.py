@@ -1,5 +1,15 @@
+import io
+import re
+import zipfile
+from datetime import UTC, datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlsplit
+
+import sqlalchemy as sa
+
 from app import db
-from app.models import AuditLog, Route
+from app.models import AuditLog, ExportJob, Route
+from app.routes import route_management
+from tests.test_export import make_route
 
 
 def test_index_redirects_to_login_when_not_logged_in(client):
@@ -94,6 +104,195 @@ def test_route_list(logged_in_client):
     assert "routes" in response.get_data(as_text=True) or "Маршруты" in response.get_data(as_text=True)  # Assuming template has this
 
 
+def capture_route_payload_selects(engine):
+    """Запоминает запросы, читающие тяжёлые поля маршрута (остановки, тарифы, матрицу цен)."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if re.search(r"route\.(stops|tariff_tables|price_matrix)\b", statement):
+            statements.append(statement)
+
+    sa.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def test_route_list_does_not_load_route_payload(logged_in_client):
+    with logged_in_client.application.app_context():
+        for number in ("001", "002"):
+            route = Route(
+                user_id=1,
+                route_name=f"Route {number}",
+                transport_type="0x02",
+                carrier_id="1234",
+                unit_id="5678",
+                route_number=number,
+                region_code="01",
+                decimal_places="2",
+                stops=[{"name": "A", "km": "0.00"}, {"name": "B", "km": "1.00"}, {"name": "C", "km": "2.00"}],
+                tariff_tables=[{"tab_number": 1}, {"tab_number": 2}],
+                price_matrix=[[{"1": 10.0}] * 3] * 3,
+            )
+            db.session.add(route)
+        db.session.commit()
+        statements = capture_route_payload_selects(db.engine)
+
+    response = logged_in_client.get("/routes")
+
+    html = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert "Route 002" in html
+    assert re.search(r'<td class="text-center">\s*3\s*</td>\s*<td class="text-center">\s*2\s*</td>', html)
+    assert statements == []
+
+
+def add_list_routes(app, specs):
+    """Маршруты пользователя 1 для проверок списка: specs — (номер, тип транспорта, готов ли)."""
+    with app.app_context():
+        for number, transport_type, is_completed in specs:
+            db.session.add(
+                Route(
+                    user_id=1,
+                    route_name=f"Route {number}",
+                    transport_type=transport_type,
+                    carrier_id="1234",
+                    unit_id="5678",
+                    route_number=number,
+                    region_code="01",
+                    decimal_places="2",
+                    stops=[{"name": "A", "km": "0"}],
+                    tariff_tables=[{"tab_number": 1, "tariff_name": "T1", "table_type_code": "02", "ss_series_codes": "A", "parsed_ss_codes_list": ["A"]}],
+                    price_matrix=[[{"1": 10.0}]],
+                    is_completed=is_completed,
+                )
+            )
+        db.session.commit()
+
+
+def page_route_names(response):
+    return re.findall(r"<strong>(Route \d+)</strong>", response.get_data(as_text=True))
+
+
+def page_link(response, link_id):
+    match = re.search(rf'id="{link_id}" href="([^"]+)"', response.get_data(as_text=True))
+    return match.group(1).replace("&amp;", "&")
+
+
+def test_route_list_keyset_pagination(logged_in_client):
+    logged_in_client.application.config["ROUTES_PER_PAGE"] = 2
+    add_list_routes(logged_in_client.application, [(f"00{n}", "0x02", True) for n in range(1, 6)])
+
+    first = logged_in_client.get("/routes")
+    second = logged_in_client.get(page_link(first, "next-page-link"))
+    third = logged_in_client.get(page_link(second, "next-page-link"))
+    back = logged_in_client.get(page_link(third, "prev-page-link"))
+
+    assert page_route_names(first) == ["Route 001", "Route 002"]
+    assert page_link(first, "prev-page-link") == "#"
+    assert page_route_names(second) == ["Route 003", "Route 004"]
+    assert page_route_names(third) == ["Route 005"]
+    assert page_link(third, "next-page-link") == "#"
+    assert page_route_names(back) == ["Route 003", "Route 004"]
+    assert page_route_names(logged_in_client.get(page_link(back, "prev-page-link"))) == ["Route 001", "Route 002"]
+    assert "Найдено маршрутов: 5" in first.get_data(as_text=True)
+    # Испорченный курсор не ломает страницу
+    assert page_route_names(logged_in_client.get("/routes?after=abc")) == ["Route 001", "Route 002"]
+
+
+def test_route_list_filters_and_sort(logged_in_client):
+    logged_in_client.application.config["ROUTES_PER_PAGE"] = 2
+    add_list_routes(logged_in_client.application, [("030", "0x02", True), ("010", "0x01", True), ("020", "0x02", False), ("005", "0x02", True)])
+
+    by_number = logged_in_client.get("/routes?sort=number&transport=0x02")
+    next_by_number = logged_in_client.get(page_link(by_number, "next-page-link"))
+
+    assert page_route_names(by_number) == ["Route 005", "Route 020"]
+    assert "transport=0x02" in page_link(by_number, "next-page-link")
+    assert page_route_names(next_by_number) == ["Route 030"]
+    assert page_route_names(logged_in_client.get("/routes?status=draft")) == ["Route 020"]
+    assert page_route_names(logged_in_client.get("/routes?region=1&status=completed&transport=0x01")) == ["Route 010"]
+    empty = logged_in_client.get("/routes?region=77")
+    assert page_route_names(empty) == []
+    assert "Нет маршрутов, подходящих под фильтр" in empty.get_data(as_text=True)
+
+
+def test_generate_bulk_config_select_all_matching(logged_in_client):
+    logged_in_client.application.config["ROUTES_PER_PAGE"] = 1
+    add_list_routes(logged_in_client.application, [("001", "0x02", True), ("002", "0x01", True), ("003", "0x02", True), ("004", "0x02", False)])
+    data = {"region_code": "01", "carrier_id": "1234", "unit_id": "5678", "decimal_places": "2", "select_all": "1", "transport": "0x02"}
+
+    page = logged_in_client.get("/routes?transport=0x02")
+    response = logged_in_client.post("/routes/generate_bulk_config", data={**data, "status": "completed"})
+    body = response.get_data(as_text=True)
+    incomplete = logged_in_client.post("/routes/generate_bulk_config", data=data, follow_redirects=True)
+
+    assert "Выбрать все 3 маршрутов, подходящих под фильтр" in page.get_data(as_text=True)
+    assert response.status_code == 200
+    assert [line.split(";")[1] for line in body.splitlines() if line.startswith("R;")] == ["001", "003"]
+    assert "не заполнены до конца: Route 004." in incomplete.get_data(as_text=True)
+
+
+def test_bulk_export_repeats_saved_selection(logged_in_client):
+    add_list_routes(logged_in_client.application, [("001", "0x02", True), ("002", "0x01", True)])
+    data = {"region_code": "01", "carrier_id": "1234", "unit_id": "5678", "decimal_places": "2"}
+
+    first = logged_in_client.post("/routes/generate_bulk_config", data={**data, "select_all": "1", "transport": "0x01"})
+    first.get_data()
+    add_list_routes(logged_in_client.application, [("003", "0x01", True)])
+    repeated = logged_in_client.post("/routes/generate_bulk_zip", data={**data, "selection_export": first.headers["X-Export-Id"]})
+    archive = zipfile.ZipFile(io.BytesIO(repeated.get_data()))
+    missing = logged_in_client.post("/routes/generate_bulk_config", data={**data, "selection_export": "999"}, follow_redirects=True)
+
+    assert "(1routes).txt" in first.headers["Content-Disposition"]
+    assert [name.split("_")[1] for name in archive.namelist()] == ["002", "003"]
+    assert "Выгрузка №999 не найдена" in missing.get_data(as_text=True)
+    with logged_in_client.application.app_context():
+        log = db.session.get(AuditLog, int(first.headers["X-Export-Id"]))
+        assert log.details["selection"] == {"transport": "0x01"}
+        assert "route_ids" not in log.details
+
+
+def test_admin_lists_do_not_load_route_payload(admin_client):
+    with admin_client.application.app_context():
+        route = Route(
+            user_id=1,
+            route_name="Route 001",
+            transport_type="0x02",
+            carrier_id="1234",
+            unit_id="5678",
+            route_number="001",
+            region_code="01",
+            decimal_places="2",
+            stops=[{"name": "A", "km": "0.00"}],
+            tariff_tables=[],
+            price_matrix=[[{}]],
+        )
+        db.session.add(route)
+        db.session.flush()
+        db.session.add(AuditLog(action="route_created", entity_type="route", route_id=route.id, user_id=1))
+        db.session.commit()
+        statements = capture_route_payload_selects(db.engine)
+
+    responses = [admin_client.get(url) for url in ("/admin/", "/admin/route/", "/admin/auditlog/")]
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert "Route 001" in responses[2].get_data(as_text=True)
+    assert statements == []
+
+
+def test_admin_route_form_hides_managed_fields(admin_client):
+    with admin_client.application.app_context():
+        route = make_route()
+        db.session.add(route)
+        db.session.commit()
+        route_id = route.id
+
+    page = admin_client.get("/admin/route/edit/", query_string={"id": route_id}).get_data(as_text=True)
+
+    assert 'name="route_name"' in page
+    for field in ("version", "updated_at", "import_hash", "stops_count", "tariffs_count"):
+        assert f'name="{field}"' not in page
+
+
 def test_admin_panel_forbidden_for_non_admin(logged_in_client):
     response = logged_in_client.get("/admin/", follow_redirects=False)
     assert response.status_code == 403
@@ -300,6 +499,294 @@ def test_generate_bulk_config(logged_in_client):
     assert response.mimetype == "text/plain"
 
 
+def test_generate_bulk_config_streams_all_routes(logged_in_client):
+    with logged_in_client.application.app_context():
+        route_ids = []
+        for number in ("001", "002"):
+            route = Route(
+                user_id=1,
+                route_name=f"Route {number}",
+                transport_type="0x02",
+                carrier_id="1234",
+                unit_id="5678",
+                route_number=number,
+                region_code="01",
+                decimal_places=2,
+                stops=[{"name": "Stop1", "km": "0"}],
+                price_matrix=[[{"1": 10.0}]],
+                tariff_tables=[
+                    {
+                        "tab_number": 1,
+                        "tariff_name": "T1",
+                        "table_type_code": "02",
+                        "ss_series_codes": "A",
+                        "parsed_ss_codes_list": ["A"],
+                    }
+                ],
+                is_completed=True,
+            )
+            db.session.add(route)
+            db.session.commit()
+            route_ids.append(str(route.id))
+
+    response = logged_in_client.post(
+        "/routes/generate_bulk_config",
+        data={
+            "route_ids": route_ids,
+            "region_code": "1",
+            "carrier_id": "1234",
+            "unit_id": "5678",
+            "decimal_places": "1",
+        },
+    )
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert "attachment" in response.headers["Content-Disposition"]
+    assert "(2routes)" in response.headers["Content-Disposition"]
+
+    lines = response.get_data().decode("cp866").split("\r\n")
+    assert lines[0].startswith("01;1234;5678;")
+    assert lines[0].endswith(";1")
+    assert [line for line in lines if line.startswith("R;")] == ["R;001;02;1;Route 001;1", "R;002;02;1;Route 002;1"]
+    assert lines.count("0;0;100") == 2
+
+
+def test_generate_bulk_config_since_previous_export(logged_in_client):
+    with logged_in_client.application.app_context():
+        route_ids = []
+        for number in ("001", "002", "003"):
+            route = Route(
+                user_id=1,
+                route_name=f"Route {number}",
+                transport_type="0x02",
+                carrier_id="1234",
+                unit_id="5678",
+                route_number=number,
+                region_code="01",
+                decimal_places=2,
+                stops=[{"name": "Stop1", "km": "0"}],
+                price_matrix=[[{"1": 10.0}]],
+                tariff_tables=[{"tab_number": 1, "tariff_name": "T1", "table_type_code": "02", "ss_series_codes": "A", "parsed_ss_codes_list": ["A"]}],
+                is_completed=True,
+            )
+            db.session.add(route)
+            db.session.commit()
+            route_ids.append(route.id)
+
+    form = {"route_ids": [str(i) for i in route_ids], "region_code": "1", "carrier_id": "1234", "unit_id": "5678", "decimal_places": "1"}
+    full = logged_in_client.post("/routes/generate_bulk_config", data=form)
+    assert full.get_data().count(b"\r\nR;") == 3
+    assert "(3routes)" in full.headers["Content-Disposition"]
+    assert "X-Deleted-Routes" not in full.headers
+    export_id = full.headers["X-Export-Id"]
+
+    # После выгрузки: маршрут 002 изменён, 003 удалён
+    with logged_in_client.application.app_context():
+        route = db.session.get(Route, route_ids[1])
+        route.route_name = "Changed"
+        db.session.commit()
+    logged_in_client.post(f"/route/delete/{route_ids[2]}")
+
+    form["route_ids"] = [str(i) for i in route_ids[:2]]
+    response = logged_in_client.post("/routes/generate_bulk_config", data={**form, "since_export": export_id})
+    assert response.status_code == 200
+    assert "(1routes)" in response.headers["Content-Disposition"]
+    assert response.headers["X-Deleted-Routes"] == str(route_ids[2])
+    assert response.headers["X-Deleted-Routes-Count"] == "1"
+    deleted_url = urlsplit(response.headers["X-Deleted-Routes-Url"])
+    assert deleted_url.path == "/routes/deleted"
+    assert parse_qs(deleted_url.query) == {"since": [response.headers["X-Export-Since"]]}
+    assert int(response.headers["X-Export-Id"]) > int(export_id)
+    lines = response.get_data().decode("cp866").split("\r\n")
+    assert [line for line in lines if line.startswith("R;")] == ["R;002;02;1;Changed;1"]
+
+    deleted = logged_in_client.get("/routes/deleted", query_string={"since": response.headers["X-Export-Since"]}).get_json()
+    assert [(d["route_id"], d["route_number"]) for d in deleted["deleted"]] == [(route_ids[2], "003")]
+
+    # Неизвестный номер выгрузки
+    response = logged_in_client.post("/routes/generate_bulk_config", data={**form, "since_export": "9999"}, follow_redirects=True)
+    assert "Выгрузка №9999 не найдена" in response.get_data(as_text=True)
+
+
+def test_bulk_export_lists_only_few_deleted_routes(logged_in_client, monkeypatch):
+    monkeypatch.setattr(route_management, "DELETED_ROUTES_LISTED", 1)
+    with logged_in_client.application.app_context():
+        routes = [make_route(number) for number in ("001", "002", "003")]
+        db.session.add_all(routes)
+        db.session.commit()
+        route_ids = [route.id for route in routes]
+    form = {"route_ids": [str(route_ids[0])], "region_code": "1", "carrier_id": "1234", "unit_id": "5678", "decimal_places": "1"}
+    full = logged_in_client.post("/routes/generate_bulk_config", data=form)
+    full.get_data()
+    for route_id in route_ids[1:]:
+        logged_in_client.post(f"/route/delete/{route_id}")
+
+    response = logged_in_client.post("/routes/generate_bulk_config", data={**form, "since_export": full.headers["X-Export-Id"]})
+    assert response.get_data().count(b"\r\nR;") == 0
+    deleted = logged_in_client.get(response.headers["X-Deleted-Routes-Url"]).get_json()
+
+    assert response.status_code == 200
+    assert "X-Deleted-Routes" not in response.headers
+    assert response.headers["X-Deleted-Routes-Count"] == "2"
+    assert [d["route_id"] for d in deleted["deleted"]] == route_ids[1:]
+    with logged_in_client.application.app_context():
+        log = db.session.get(AuditLog, int(response.headers["X-Export-Id"]))
+        assert log.details["deleted_routes_count"] == 2
+        assert log.details["deleted_route_ids"] == route_ids[1:2]
+
+
+def test_deleted_routes_since_with_offset_is_converted_to_utc(logged_in_client):
+    with logged_in_client.application.app_context():
+        route = make_route()
+        db.session.add(route)
+        db.session.commit()
+        route_id = route.id
+    logged_in_client.post(f"/route/delete/{route_id}")
+    moscow = timezone(timedelta(hours=3))
+    before = (datetime.now(UTC) - timedelta(minutes=1)).astimezone(moscow)
+    after = (datetime.now(UTC) + timedelta(minutes=1)).astimezone(moscow)
+
+    listed = logged_in_client.get("/routes/deleted", query_string={"since": before.isoformat()}).get_json()
+    empty = logged_in_client.get("/routes/deleted", query_string={"since": after.isoformat()}).get_json()
+
+    assert [d["route_id"] for d in listed["deleted"]] == [route_id]
+    assert listed["since"] == before.astimezone(UTC).isoformat()
+    assert empty["deleted"] == []
+
+
+def test_bulk_export_skips_routes_that_became_incomplete(logged_in_client, monkeypatch):
+    with logged_in_client.application.app_context():
+        routes = [make_route(number) for number in ("001", "002")]
+        db.session.add_all(routes)
+        db.session.commit()
+        route_ids = [route.id for route in routes]
+    validate = route_management._validate_bulk_selection
+
+    def validate_then_edit():
+        # Маршрут становится незавершённым между проверкой выборки и чтением маршрутов
+        db.session.execute(sa.update(Route).where(Route.id == route_ids[1]).values(is_completed=True))
+        validated = validate()
+        db.session.execute(sa.update(Route).where(Route.id == route_ids[1]).values(is_completed=False))
+        db.session.commit()
+        return validated
+
+    monkeypatch.setattr(route_management, "_validate_bulk_selection", validate_then_edit)
+    form = {"route_ids": [str(i) for i in route_ids], "region_code": "1", "carrier_id": "1234", "unit_id": "5678", "decimal_places": "2"}
+
+    config = logged_in_client.post("/routes/generate_bulk_config", data=form).get_data().decode("cp866")
+    archive = zipfile.ZipFile(io.BytesIO(logged_in_client.post("/routes/generate_bulk_zip", data={**form, "zip_compression": "stored"}).get_data()))
+
+    assert [line.split(";")[1] for line in config.split("\r\n") if line.startswith("R;")] == ["001"]
+    assert [name.split("_")[1] for name in archive.namelist()] == ["001"]
+
+
+def test_generate_bulk_zip(logged_in_client):
+    with logged_in_client.application.app_context():
+        route = Route(
+            user_id=1,
+            route_name="Test",
+            transport_type="0x02",
+            carrier_id="1234",
+            unit_id="5678",
+            route_number="001",
+            region_code="01",
+            decimal_places=2,
+            stops=[{"name": "Stop1", "km": "0"}],
+            price_matrix=[[{"1": 10.0}]],
+            tariff_tables=[{"tab_number": 1, "tariff_name": "T1", "table_type_code": "02", "ss_series_codes": "A", "parsed_ss_codes_list": ["A"]}],
+            stops_set=True,
+            is_completed=True,
+        )
+        db.session.add(route)
+        db.session.commit()
+        route_id = route.id
+
+    response = logged_in_client.post(
+        "/routes/generate_bulk_zip",
+        data={"route_ids": [str(route_id)], "region_code": "01", "carrier_id": "1234", "unit_id": "5678", "decimal_places": "2", "zip_compression": "stored"},
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+
+    archive = zipfile.ZipFile(io.BytesIO(response.get_data()))
+    single = logged_in_client.get(f"/route/{route_id}/generate_config")
+    assert archive.read(archive.namelist()[0]) == single.get_data()
+
+
+def test_bulk_export_job_lifecycle(logged_in_client, tmp_path):
+    app = logged_in_client.application
+    app.config["EXPORT_ARTIFACT_DIR"] = str(tmp_path)
+    with app.app_context():
+        route = Route(
+            user_id=1,
+            route_name="Test",
+            transport_type="0x02",
+            carrier_id="1234",
+            unit_id="5678",
+            route_number="001",
+            region_code="01",
+            decimal_places=2,
+            stops=[{"name": "Stop1", "km": "0"}],
+            price_matrix=[[{"1": 10.0}]],
+            tariff_tables=[{"tab_number": 1, "tariff_name": "T1", "table_type_code": "02", "ss_series_codes": "A", "parsed_ss_codes_list": ["A"]}],
+            is_completed=True,
+        )
+        db.session.add(route)
+        db.session.commit()
+        route_id = route.id
+
+    response = logged_in_client.post(
+        "/routes/export_jobs",
+        data={"route_ids": [str(route_id)], "region_code": "01", "carrier_id": "1234", "unit_id": "5678", "decimal_places": "2"},
+    )
+    assert response.status_code == 302
+    with app.app_context():
+        job = db.session.scalar(db.select(ExportJob))
+        job_id = job.id
+        assert job.status == "done"
+
+    status = logged_in_client.get(f"/routes/export_jobs/{job_id}/status").get_json()
+    assert status["status"] == "done"
+    assert status["done_routes"] == status["total_routes"] == 1
+    assert status["percent"] == 100
+
+    page = logged_in_client.get(f"/routes/export_jobs/{job_id}")
+    assert page.status_code == 200
+
+    download = logged_in_client.get(f"/routes/export_jobs/{job_id}/download")
+    assert download.status_code == 200
+    lines = download.get_data().decode("cp866").split("\r\n")
+    assert lines[0].startswith("01;1234;5678;")
+    assert "R;001;02;1;Test;1" in lines
+    assert "0;0;1000" in lines
+
+
+def test_bulk_export_job_of_other_user_is_hidden(logged_in_client):
+    with logged_in_client.application.app_context():
+        job = ExportJob(user_id=999, status="done", params={}, total_routes=0, done_routes=0)
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+
+    assert logged_in_client.get(f"/routes/export_jobs/{job_id}/status").status_code == 404
+    assert logged_in_client.get(f"/routes/export_jobs/{job_id}/download").status_code == 404
+
+
+def test_bulk_export_job_left_by_restart_reports_failed(logged_in_client):
+    logged_in_client.application.config["EXPORT_JOB_STALE_AFTER"] = 600
+    old = datetime.now(UTC) - timedelta(hours=1)
+    with logged_in_client.application.app_context():
+        job = ExportJob(user_id=1, status="running", params={}, total_routes=5, done_routes=2, created_at=old, updated_at=old)
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+
+    status = logged_in_client.get(f"/routes/export_jobs/{job_id}/status").get_json()
+
+    assert status["status"] == "failed"
+    assert status["error"]
+
+
 def test_import_route_get(logged_in_client):
     response = logged_in_client.get("/route/import")
     assert response.status_code == 200
@@ -504,6 +991,84 @@ def test_generate_config_completed_route(logged_in_client):
     assert response.mimetype == "text/plain"
 
 
+def test_edit_route_stops_invalidates_cached_config(logged_in_client):
+    with logged_in_client.application.app_context():
+        route = Route(
+            user_id=1,
+            route_name="Test",
+            transport_type="0x02",
+            carrier_id="1234",
+            unit_id="5678",
+            route_number="001",
+            region_code="01",
+            decimal_places=2,
+            stops=[{"name": "Stop1", "km": "0"}],
+            price_matrix=[[{"1": 10.0}]],
+            tariff_tables=[{"tab_number": 1, "tariff_name": "T1", "table_type_code": "02", "ss_series_codes": "A", "parsed_ss_codes_list": ["A"]}],
+            stops_set=True,
+            is_completed=True,
+        )
+        db.session.add(route)
+        db.session.commit()
+        route_id = route.id
+
+    cache = logged_in_client.application.extensions["route_body_cache"]
+    assert logged_in_client.get(f"/route/{route_id}/generate_config").status_code == 200
+    assert len(cache._entries) == 1
+
+    logged_in_client.post(
+        f"/route/edit/{route_id}/stops",
+        data={"stops-0-stop_name": "Renamed", "stops-0-km_distance": "0"},
+    )
+    assert len(cache._entries) == 0
+
+
+def test_generate_config_conditional_get(logged_in_client):
+    with logged_in_client.application.app_context():
+        route = Route(
+            user_id=1,
+            route_name="Test",
+            transport_type="0x02",
+            carrier_id="1234",
+            unit_id="5678",
+            route_number="001",
+            region_code="01",
+            decimal_places=2,
+            stops=[{"name": "Stop1", "km": "0"}],
+            price_matrix=[[{"1": 10.0}]],
+            tariff_tables=[{"tab_number": 1, "tariff_name": "T1", "table_type_code": "02", "ss_series_codes": "A", "parsed_ss_codes_list": ["A"]}],
+            stops_set=True,
+            is_completed=True,
+        )
+        db.session.add(route)
+        db.session.commit()
+        route_id = route.id
+        assert route.version == 1
+
+    first = logged_in_client.get(f"/route/{route_id}/generate_config")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+    assert first.last_modified is not None
+    assert "no-cache" in first.headers["Cache-Control"]
+
+    cached = logged_in_client.get(f"/route/{route_id}/generate_config", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.data == b""
+    assert cached.headers["ETag"] == etag
+
+    # Изменение маршрута повышает ревизию и меняет ETag
+    with logged_in_client.application.app_context():
+        route = db.session.get(Route, route_id)
+        route.stops = [{"name": "Renamed", "km": "0"}]
+        db.session.commit()
+        assert route.version == 2
+
+    changed = logged_in_client.get(f"/route/{route_id}/generate_config", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert "Renamed".encode("cp866") in changed.data
+
+
 def test_generate_config_not_owner(logged_in_client):
     # Create route for different user
     with logged_in_client.application.app_context():
@@ -645,6 +1210,80 @@ R;001;02;1;Test Route;1
         os.unlink(temp_file_path)
 
 
+def test_import_route_bulk_file_with_broken_block(logged_in_client):
+    config_content = (
+        "01;1234;5678;240101;2\r\n"
+        "R;001;02;1;First;1\r\n0;0.00;Stop1\r\n1;02;01\r\n0;0;100\r\n"
+        "R;002;02;1;Broken;1\r\n0;0.00;Stop1\r\n1;02;01\r\n0;x;100\r\n"
+        "R;003;02;2;Third;1\r\n0;0.00;A\r\n1;2.00;B\r\n1;02;01\r\n0;0;0\r\n0;1;2550\r\n1;1;0\r\n"
+    )
+
+    response = logged_in_client.post(
+        "/route/import",
+        data={"route_file": (io.BytesIO(config_content.encode("cp866")), "bulk.txt")},
+        content_type="multipart/form-data",
+        follow_redirects=True,
+    )
+
+    text = response.get_data(as_text=True)
+    assert "Импортировано маршрутов: 2." in text
+    assert "Маршрут 002 (блок 2) не импортирован" in text
+    with logged_in_client.application.app_context():
+        routes = db.session.scalars(sa.select(Route).order_by(Route.id)).all()
+        assert [r.route_number for r in routes] == ["001", "003"]
+        assert routes[1].price_matrix[1][0] == {"1": 25.5}
+        assert routes[1].version == 1
+        logs = db.session.scalars(sa.select(AuditLog).where(AuditLog.action == "route_imported")).all()
+        assert sorted(log.route_id for log in logs) == [r.id for r in routes]
+        assert logs[0].user_id == 1
+        assert logs[0].details["snapshot"]["route_number"] == "001"
+
+
+def test_import_route_zip_archive(logged_in_client):
+    import zipfile
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        for number in ("001", "002"):
+            zf.writestr(f"TRFZ_{number}.txt", f"01;1234;5678;240101;2\r\nR;{number};02;1;Z{number};1\r\n0;0.00;S\r\n1;02;01\r\n0;0;100\r\n")
+        zf.writestr("notes.doc", "x")
+    archive.seek(0)
+
+    response = logged_in_client.post("/route/import", data={"route_file": (archive, "routes.zip")}, content_type="multipart/form-data")
+
+    text = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert "Импортировано маршрутов: <strong>2</strong>" in text
+    assert "notes.doc" in text
+    with logged_in_client.application.app_context():
+        assert db.session.scalars(sa.select(Route.route_name).order_by(Route.id)).all() == ["Z001", "Z002"]
+
+
+def test_import_route_same_file_twice(logged_in_client):
+    content = b"01;1234;5678;240101;2\r\nR;001;02;1;Twice;1\r\n0;0.00;S\r\n1;02;01\r\n0;0;100\r\n"
+
+    def upload(data, **extra):
+        return logged_in_client.post(
+            "/route/import",
+            data={"route_file": (io.BytesIO(data), "route.txt"), **extra},
+            content_type="multipart/form-data",
+            follow_redirects=True,
+        )
+
+    upload(content)
+    # Те же строки с другими окончаниями и пустыми строками — тот же файл
+    response = upload(content.replace(b"\r\n", b"\n") + b"\n\n")
+    assert "Файл уже импортирован как маршрут &#34;Twice&#34; (№1)" in response.get_data(as_text=True)
+    with logged_in_client.application.app_context():
+        assert db.session.scalar(sa.select(sa.func.count()).select_from(Route)) == 1
+
+    upload(content, force="y")
+    with logged_in_client.application.app_context():
+        hashes = db.session.scalars(sa.select(Route.import_hash)).all()
+        assert len(hashes) == 2
+        assert hashes[0] == hashes[1] is not None
+
+
 def test_import_route_post_invalid_file(logged_in_client):
     response = logged_in_client.post(
         "/route/import",
@@ -0,0 +1,39 @@
+import pytest
+import sqlalchemy as sa
+
+from app import db
+from app.models import Route
+from app.selection import decode_cursor, keyset_page, route_filter_conditions
+from tests.test_export import make_route
+
+
+def add_routes(user_id, numbers):
+    for number in numbers:
+        route = make_route(route_number=number)
+        route.user_id = user_id
+        db.session.add(route)
+    db.session.commit()
+
+
+def test_keyset_page_walks_equal_sort_keys_without_gaps(app, test_user):
+    add_routes(test_user.id, ["002", "001", "002", "002", "003"])
+    query = sa.select(Route).where(*route_filter_conditions(test_user.id))
+
+    seen = []
+    page = keyset_page(query, "number", per_page=2)
+    while True:
+        seen.extend((route.route_number, route.id) for route in page.routes)
+        if page.next_cursor is None:
+            break
+        page = keyset_page(query, "number", after=page.next_cursor, per_page=2)
+
+    assert seen == sorted(seen)
+    assert len(seen) == 5
+    back = keyset_page(query, "number", before=page.prev_cursor, per_page=2)
+    assert [(route.route_number, route.id) for route in back.routes] == seen[2:4]
+
+
+def test_decode_cursor_keeps_colons_in_route_number():
+    assert decode_cursor("A:1:42", "number") == ("A:1", 42)
+    with pytest.raises(ValueError):
+        decode_cursor("abc", "id")
@@ -0,0 +1,111 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from app import trfz
+from app.export import iter_bulk_config
+from app.trfz import TrfzParseError, iter_trfz_routes, parse_trfz
+from app.utils import write_route_body_to_buffer
+from tests.test_export import make_route
+
+
+def render_config(route, decimal_places="2"):
+    buffer = io.BytesIO()
+    buffer.write(f"01;1234;5678;240101;{decimal_places}\r\n".encode("cp866"))
+    write_route_body_to_buffer(buffer, route, decimal_places)
+    return buffer.getvalue()
+
+
+class TestParseTrfz:
+    def test_round_trip_of_exported_route(self):
+        route = make_route("007", stops_count=4)
+        route.route_name = "Маршрут «Центр»"
+
+        parsed = parse_trfz(io.BytesIO(render_config(route)))
+
+        assert parsed["route_number"] == "007"
+        assert parsed["region_code"] == "01"
+        assert parsed["transport_type"] == "0x02"
+        assert parsed["decimal_places"] == 2
+        assert parsed["route_name"] == 'Маршрут "Центр"'
+        assert parsed["stops"] == route.stops
+        assert [t["tab_number"] for t in parsed["tariff_tables"]] == [1]
+        assert parsed["price_matrix"] == route.price_matrix
+        assert parsed["price_matrix"][1][3] is parsed["price_matrix"][3][1]
+
+    def test_utf8_input(self):
+        content = "01;1234;5678;240101;1\nR;001;02;2;Тест;1\n0;0.00;Старт\n1;1.50;Финиш\n1;02;01\n0;0;0\n0;1;125\n1;1;0\n"
+
+        parsed = parse_trfz(io.BytesIO(content.encode("utf-8")))
+
+        assert parsed["stops"] == [{"name": "Старт", "km": "0.00"}, {"name": "Финиш", "km": "1.50"}]
+        assert parsed["price_matrix"][1][0] == {"1": 12.5}
+
+    def test_vectorized_path_matches_line_parser(self, monkeypatch):
+        numpy = pytest.importorskip("numpy")
+        data = render_config(make_route(stops_count=20))
+
+        monkeypatch.setattr(trfz, "np", None)
+        expected = parse_trfz(io.BytesIO(data))
+        monkeypatch.setattr(trfz, "np", numpy)
+        monkeypatch.setattr(trfz, "PRICE_LINES_PER_CHUNK", 100)
+
+        assert parse_trfz(io.BytesIO(data)) == expected
+
+    def test_ragged_price_lines_fall_back_to_line_parser(self):
+        pytest.importorskip("numpy")
+        prices = "".join(f"{i};{i};{i}00\n" if i % 2 else f"{i};{i};{i}00;7\n" for i in range(80))
+        content = "01;1234;5678;240101;0\nR;001;02;80;Тест;1\n" + "".join(f"{i};0.00;S{i}\n" for i in range(80)) + "1;02;01\n" + prices
+
+        parsed = parse_trfz(io.BytesIO(content.encode("utf-8")))
+
+        assert parsed["price_matrix"][3][3] == {"1": 300.0}
+        assert parsed["price_matrix"][0][1] == {}
+
+    def test_round_trip_is_lossless(self):
+        route = make_route(stops_count=30)
+        route.price_matrix = [[{"1": round(0.01 * (i * 37 + j * 101 % 997), 2)} for j in range(30)] for i in range(30)]
+        data = render_config(route)
+
+        parsed = parse_trfz(io.BytesIO(data))
+
+        assert render_config(SimpleNamespace(**parsed)) == data
+
+    def test_prices_scale_to_stored_units_exactly(self):
+        content = "01;1234;5678;240101;3\nR;001;02;1;X;2\n0;0.00;S\n1;02;01\n2;02;01\n0;0;1005;7\n"
+
+        parsed = parse_trfz(io.BytesIO(content.encode("utf-8")))
+
+        assert parsed["price_matrix"].values().tolist() == [1005, 7]
+        assert parsed["price_matrix"][0][0] == {"1": 1.005, "2": 0.007}
+
+    def test_empty_file(self):
+        with pytest.raises(TrfzParseError, match="Файл пуст"):
+            parse_trfz(io.BytesIO(b"01;1234;5678;240101;2\r\n"))
+
+    def test_price_outside_matrix(self):
+        content = b"01;1234;5678;240101;2\nR;001;02;1;X;1\n0;0.00;S\n1;02;01\n0;5;100\n"
+        with pytest.raises(TrfzParseError):
+            parse_trfz(io.BytesIO(content))
+
+
+class TestIterTrfzRoutes:
+    def test_walks_every_block_of_bulk_export(self):
+        routes = [make_route(f"{n:03d}", stops_count=n + 1) for n in range(4)]
+        data = b"".join(iter_bulk_config("01;1234;5678;240101;2", routes, "2"))
+
+        blocks = list(iter_trfz_routes(io.BytesIO(data)))
+
+        assert [block.route_number for block in blocks] == ["000", "001", "002", "003"]
+        assert all(block.error is None for block in blocks)
+        assert [block.fields["price_matrix"] for block in blocks] == [route.price_matrix for route in routes]
+
+    def test_broken_block_does_not_stop_parsing(self):
+        content = "01;1234;5678;240101;0\nR;001;02;1;A;1\n0;0.00;S\n1;02;01\n0;0;x\n0;0;1\nR;002;02;1;B;1\n0;0.00;S\n1;02;01\n0;0;5\n"
+
+        first, second = iter_trfz_routes(io.BytesIO(content.encode("utf-8")))
+
+        assert (first.number, first.route_number, first.fields) == (1, "001", None)
+        assert "Цена должна быть числом" in first.error
+        assert second.fields["price_matrix"] == [[{"1": 5.0}]]
@@ -1,7 +1,10 @@
 import io
 
+import pytest
+
+from app import utils
 from app.models import Route
-from app.utils import normalize_for_cp866, write_route_body_to_buffer
+from app.utils import encode_cp866_lines, format_price_lines, normalize_for_cp866, write_route_body_to_buffer
 
 
 class TestNormalizeForCp866:
@@ -28,6 +31,16 @@ class TestNormalizeForCp866:
         assert result == '--""""No'
 
 
+class TestEncodeCp866Lines:
+    def test_empty_block(self):
+        assert encode_cp866_lines([]) == b""
+
+    def test_matches_line_by_line_encoding(self):
+        lines = ["R;001;02;2;Маршрут — «тест» №1;1", "0;0.00;Остановка №1", "1;02;01;02", "0;0;100", "emoji 🚌"]
+        expected = b"".join((normalize_for_cp866(line) + "\r\n").encode("cp866", errors="replace") for line in lines)
+        assert encode_cp866_lines(lines) == expected
+
+
 class TestWriteRouteBodyToBuffer:
     def test_write_route_body_complete_route(self):
         # Create a mock route with all necessary data
@@ -200,3 +213,53 @@ class TestWriteRouteBodyToBuffer:
             if len(parts) >= 3:
                 prices = parts[2:]
                 assert all(price == "0" for price in prices)
+
+
+class TestFormatPriceLines:
+    tab_ids = ["1", "2", "3"]
+
+    def make_matrix(self, zones_count):
+        matrix = [[{"1": 12.34 + i + j, "2": (i * j) % 7, "3": -0.5 * j} for j in range(zones_count)] for i in range(zones_count)]
+        matrix[0][1] = {}  # Нет цен
+        matrix[1][2] = None  # Пустая ячейка
+        matrix[2] = matrix[2][:3]  # Короткая строка
+        return matrix
+
+    def test_vectorized_path_matches_loop(self, monkeypatch):
+        numpy = pytest.importorskip("numpy")
+        matrix = self.make_matrix(20)
+
+        monkeypatch.setattr(utils, "np", None)
+        expected = format_price_lines(matrix, self.tab_ids, 20, 100)
+        monkeypatch.setattr(utils, "np", numpy)
+        assert utils.price_matrix_to_array(matrix, self.tab_ids, 20, 100) is not None
+        assert format_price_lines(matrix, self.tab_ids, 20, 100) == expected
+
+    def test_non_numeric_prices_fall_back_to_loop(self):
+        pytest.importorskip("numpy")
+        matrix = self.make_matrix(20)
+        matrix[3][4] = {"1": "abc", "2": "7.5"}
+
+        assert utils.price_matrix_to_array(matrix, self.tab_ids, 20, 100) is None
+        lines = format_price_lines(matrix, self.tab_ids, 20, 100)
+        assert "3;4;0;750;0" in lines
+
+    def test_array_has_zones_by_zones_by_tables_shape(self):
+        pytest.importorskip("numpy")
+        matrix = self.make_matrix(20)
+
+        prices = utils.price_matrix_to_array(matrix, self.tab_ids, 20, 10)
+
+        assert prices.shape == (20, 20, 3)
+        assert prices[0, 0].tolist() == [123, 0, 0]
+        assert prices[5, 0].tolist() == [0, 0, 0]  # Нижний треугольник не заполняется
+
+    def test_prices_are_converted_without_float_truncation(self, monkeypatch):
+        # int(float(1.15) * 100) == 114 и int(0.29 * 100) == 28 — перевод через целые единицы даёт точные значения
+        matrix = [[{"1": 1.15, "2": 0.29, "3": "4.35"} for _ in range(20)] for _ in range(20)]
+
+        lines = format_price_lines(matrix, self.tab_ids, 20, 100)
+        monkeypatch.setattr(utils, "np", None)
+
+        assert lines[0] == "0;0;115;29;435"
+        assert format_price_lines(matrix, self.tab_ids, 20, 100) == lines
@@ -0,0 +1,277 @@
+import io
+import threading
+from datetime import UTC, datetime, timedelta
+from functools import partial
+
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from app import create_app, db
+from app.audit import build_audit_row, log_action
+from app.history import route_state_at
+from app.models import AuditLog, ExportJob, Route, User
+from app.routes import route_management
+from app.writer import insert_audit_rows, run_write
+from tests.conftest import TestConfig
+from tests.test_export import make_route
+from tests.test_importer import make_archive, route_file
+
+
+def make_file_app(path, **overrides):
+    config = type("WriterConfig", (TestConfig,), {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}", **overrides})
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        user = User(username="testuser", email="test@example.com")
+        user.set_password("password")
+        db.session.add(user)
+        db.session.commit()
+    return app
+
+
+def stop_file_app(app):
+    for name in ("audit_writer", "write_coordinator"):
+        if app.extensions[name] is not None:
+            app.extensions[name].stop()
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def writer_app(tmp_path):
+    app = make_file_app(tmp_path / "app.db", DB_SINGLE_WRITER=True, DB_WRITER_BATCH_WAIT_MS=50)
+    yield app
+    stop_file_app(app)
+
+
+@pytest.fixture
+def async_audit_app(tmp_path):
+    app = make_file_app(tmp_path / "app.db", AUDIT_ASYNC=True)
+    yield app
+    stop_file_app(app)
+
+
+def audit_row(action):
+    return {"user_id": 1, "route_id": None, "action": action, "entity_type": "test", "details": {}}
+
+
+def test_concurrent_writes_are_grouped_into_batches(writer_app):
+    commits = []
+    results = []
+
+    def count_commit(session):
+        commits.append(threading.current_thread().name)
+
+    def write(number):
+        with writer_app.app_context():
+            results.append(run_write(partial(insert_audit_rows, [audit_row(f"action_{number}")])))
+
+    sa.event.listen(db.session, "after_commit", count_commit)
+    try:
+        threads = [threading.Thread(target=write, args=(number,)) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sa.event.remove(db.session, "after_commit", count_commit)
+
+    with writer_app.app_context():
+        assert db.session.scalar(sa.select(sa.func.count(AuditLog.id))) == 8
+    assert sorted(log_id for ids in results for log_id in ids) == list(range(1, 9))
+    assert 1 <= commits.count("db-writer") < 8
+
+
+def test_failed_write_does_not_cancel_batch(writer_app):
+    coordinator = writer_app.extensions["write_coordinator"]
+
+    def fail(session):
+        raise ValueError("ошибка записи")
+
+    futures = [coordinator.submit(partial(insert_audit_rows, [audit_row("first")])), coordinator.submit(fail), coordinator.submit(partial(insert_audit_rows, [audit_row("second")]))]
+
+    assert futures[0].result() and futures[2].result()
+    with pytest.raises(ValueError):
+        futures[1].result()
+    with writer_app.app_context():
+        assert db.session.scalars(sa.select(AuditLog.action).order_by(AuditLog.id)).all() == ["first", "second"]
+
+
+def test_log_action_is_written_after_request_commit(writer_app):
+    with writer_app.app_context():
+        log = log_action("login_success", "auth", user_id=1)
+        assert db.session.scalar(sa.select(sa.func.count(AuditLog.id))) == 0
+        db.session.commit()
+        assert log.id == db.session.scalar(sa.select(AuditLog.id).where(AuditLog.action == "login_success"))
+
+        log_action("discarded", "auth", user_id=1)
+        db.session.rollback()
+        db.session.commit()
+        assert db.session.scalar(sa.select(AuditLog.id).where(AuditLog.action == "discarded")) is None
+
+
+def test_route_edits_go_through_writer(writer_app):
+    with writer_app.app_context():
+        route = make_route(stops_count=2)
+        db.session.add(route)
+        db.session.commit()
+        route_id = route.id
+    client = writer_app.test_client()
+    client.post("/login", data={"username": "testuser", "password": "password"})
+
+    response = client.post(f"/route/edit/{route_id}/prices", data={"price_matrix_data": '[[{"1": 5}, {"1": 7}], [{"1": 7}, {"1": 9}]]'})
+    deleted = client.post(f"/route/delete/{route_id}")
+
+    assert response.status_code == deleted.status_code == 302
+    with writer_app.app_context():
+        actions = db.session.scalars(sa.select(AuditLog.action).order_by(AuditLog.id)).all()
+        assert actions == ["login_success", "route_prices_updated", "route_deleted"]
+        assert db.session.get(Route, route_id) is None
+
+
+def test_queued_route_edits_are_logged_in_version_order(writer_app):
+    coordinator = writer_app.extensions["write_coordinator"]
+    template = make_route()
+    columns = (
+        "user_id",
+        "route_name",
+        "transport_type",
+        "carrier_id",
+        "unit_id",
+        "route_number",
+        "region_code",
+        "decimal_places",
+        "stops",
+        "price_matrix",
+        "tariff_tables",
+        "stops_set",
+        "is_completed",
+    )
+    with writer_app.app_context():
+        route_id = run_write(partial(route_management._create_route, {key: getattr(template, key) for key in columns}, build_audit_row("route_created", "route", user_id=1)))
+
+    # Запрос второй правки начался раньше, но в очередь записи она попала после первой
+    first_row = build_audit_row("route_info_updated", "route", route_id=route_id, user_id=1)
+    second_row = {**first_row, "created_at": first_row["created_at"] - timedelta(minutes=1)}
+    futures = [
+        coordinator.submit(partial(route_management._update_route, route_id, {"route_name": "First"}, [first_row])),
+        coordinator.submit(partial(route_management._update_route, route_id, {"route_name": "Second"}, [second_row])),
+    ]
+    for future in futures:
+        future.result()
+
+    with writer_app.app_context():
+        logs = db.session.execute(sa.select(AuditLog.created_at, AuditLog.details).where(AuditLog.route_id == route_id).order_by(AuditLog.created_at, AuditLog.id)).all()
+        assert [log.details["version"] for log in logs] == [1, 2, 3]
+        state = route_state_at(route_id, datetime.now(UTC))
+        assert (state.snapshot["route_name"], state.version) == ("Second", 3)
+
+
+def test_imports_and_export_jobs_go_through_writer(writer_app, tmp_path):
+    writer_app.config["EXPORT_ARTIFACT_DIR"] = str(tmp_path / "exports")
+    client = writer_app.test_client()
+    client.post("/login", data={"username": "testuser", "password": "password"})
+    writes = []
+
+    def record_write(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith(("INSERT INTO route ", "UPDATE export_job", "INSERT INTO export_job")):
+            writes.append((statement.split(" (")[0].split(" SET ")[0], threading.current_thread().name))
+
+    with writer_app.app_context():
+        engine = db.engine
+    sa.event.listen(engine, "before_cursor_execute", record_write)
+    try:
+        single = client.post("/route/import", data={"route_file": (io.BytesIO(route_file("001")), "route.txt")}, content_type="multipart/form-data")
+        archive = make_archive([("002.txt", route_file("002")), ("003.txt", route_file("003"))])
+        summary = client.post("/route/import", data={"route_file": (archive, "routes.zip")}, content_type="multipart/form-data")
+        job = client.post("/routes/export_jobs", data={"select_all": "1", "transport": "0x02", "region_code": "01", "carrier_id": "1234", "unit_id": "5678", "decimal_places": "2"})
+    finally:
+        sa.event.remove(engine, "before_cursor_execute", record_write)
+
+    assert single.status_code == job.status_code == 302
+    assert summary.status_code == 200
+    assert [statement for statement, _ in writes].count("UPDATE export_job") == 3  # Запуск, прогресс, завершение
+    assert {statement for statement, _ in writes} == {"INSERT INTO route", "INSERT INTO export_job", "UPDATE export_job"}
+    assert {thread for _, thread in writes} == {"db-writer"}
+    with writer_app.app_context():
+        assert db.session.scalars(sa.select(Route.route_number).order_by(Route.id)).all() == ["001", "002", "003"]
+        assert db.session.scalar(sa.select(AuditLog.user_id).where(AuditLog.action == "route_imported").limit(1)) == 1
+        assert db.session.scalar(sa.select(ExportJob.status)) == "done"
+
+
+def test_overlapping_route_save_is_rejected_without_single_writer(tmp_path, monkeypatch):
+    app = make_file_app(tmp_path / "app.db")
+    try:
+        with app.app_context():
+            route = make_route(stops_count=2)
+            db.session.add(route)
+            db.session.commit()
+            route_id = route.id
+        client = app.test_client()
+        client.post("/login", data={"username": "testuser", "password": "password"})
+        update_route = route_management._update_route
+
+        def save_in_other_session_first(*args):
+            # Другой запрос сохраняет маршрут, пока этот держит загруженную версию
+            with app.app_context(), so.Session(db.engine) as other:
+                other.get_one(Route, route_id).route_name = "Сохранено раньше"
+                other.commit()
+            return update_route(*args)
+
+        monkeypatch.setattr(route_management, "_update_route", save_in_other_session_first)
+        prices = '[[{"1": 0}, {"1": 7}], [{"1": 7}, {"1": 0}]]'
+        rejected = client.post(f"/route/edit/{route_id}/prices", data={"price_matrix_data": prices})
+        monkeypatch.setattr(route_management, "_update_route", update_route)
+        page = client.get(rejected.headers["Location"]).get_data(as_text=True)
+        saved = client.post(f"/route/edit/{route_id}/prices", data={"price_matrix_data": prices})
+
+        assert rejected.status_code == saved.status_code == 302
+        assert rejected.headers["Location"].endswith(f"/route/edit/{route_id}/prices")
+        assert "Изменения не сохранены" in page
+        assert saved.headers["Location"].endswith("/routes")
+        with app.app_context():
+            route = db.session.get(Route, route_id)
+            assert (route.route_name, route.version) == ("Сохранено раньше", 3)
+            # Отклонённое сохранение не оставило записи в журнале
+            assert [details["version"] for details in db.session.scalars(sa.select(AuditLog.details).where(AuditLog.action == "route_prices_updated"))] == [3]
+    finally:
+        stop_file_app(app)
+
+
+def test_async_audit_rows_are_written_in_batches_after_commit(async_audit_app):
+    statements = []
+
+    def count_insert(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO audit_log"):
+            statements.append(executemany)
+
+    with async_audit_app.app_context():
+        sa.event.listen(db.engine, "before_cursor_execute", count_insert)
+        for number in range(20):
+            log_action("route_config_generated", "route", user_id=1, details={"number": number})
+        log_action("discarded", "auth", user_id=1)
+        db.session.rollback()
+        for number in range(20):
+            log_action("route_config_generated", "route", user_id=1, details={"number": number})
+        db.session.commit()
+        async_audit_app.extensions["audit_writer"].flush()
+
+        logs = db.session.scalars(sa.select(AuditLog).order_by(AuditLog.id)).all()
+        assert [log.details["number"] for log in logs] == list(range(20))
+        assert statements == [True]
+
+
+def test_sync_log_action_bypasses_async_queue(async_audit_app):
+    with async_audit_app.app_context():
+        log = log_action("routes_bulk_config_generated", "route", user_id=1, sync=True)
+        db.session.commit()
+        assert log.id is not None
+
+
+def test_stop_flushes_queued_audit_rows(async_audit_app):
+    with async_audit_app.app_context():
+        log_action("logout", "auth", user_id=1)
+        db.session.commit()
+        async_audit_app.extensions["audit_writer"].stop()
+        assert db.session.scalar(sa.select(AuditLog.action)) == "logout"
@@ -2,9 +2,15 @@ import sqlalchemy as sa
 import sqlalchemy.orm as so
 
 from app import app, db
+from app.cli import backfill_route_counts_command, export_command, pack_prices_command
 from app.models import User
 
 
 @app.shell_context_processor
 def make_shell_context():
     return {"sa": sa, "so": so, "db": db, "User": User}
+
+
+app.cli.add_command(export_command)
+app.cli.add_command(pack_prices_command)
+app.cli.add_command(backfill_route_counts_command)